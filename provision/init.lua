@@ -329,6 +329,16 @@ if queue == nil then
     queue.workers = {}
     queue.stat = {}
     queue.restart = {}
+    queue.any_waiters = {}
+
+    setmetatable(queue.any_waiters, {
+            __index = function(tbs, space)
+                local waiters = {}
+                rawset(tbs, space, waiters)
+                return waiters
+            end
+        }
+    )
 
     setmetatable(queue.consumers, {
             __index = function(tbs, space)
@@ -336,9 +346,21 @@ if queue == nil then
                 setmetatable(spt, {
                     __index = function(tbt, tube)
                         local channel = box.ipc.channel(1)
-                        rawset(tbt, tube, channel)
+                        -- every put also wakes up queue.take_any waiters of the space
+                        local consumer = {
+                            put = function(self, value, timeout)
+                                for waiter in pairs(queue.any_waiters[space]) do
+                                    waiter:put(true, 0)
+                                end
+                                return channel:put(value, timeout)
+                            end,
+                            get = function(self, timeout)
+                                return channel:get(timeout)
+                            end
+                        }
+                        rawset(tbt, tube, consumer)
                         queue.restart_check(space, tube)
-                        return channel
+                        return consumer
                     end
                 })
                 rawset(tbs, space, spt)
@@ -743,29 +765,22 @@ queue.urgent = function(space, tube, delayed, ...)
     return put_task(space, tube, ipri, delayed, ...)
 end
 
--- queue.take(space, tube, timeout)
--- take task for processing
-queue.take = function(space, tube, timeout)
-
-    space = tonumber(space)
-
-    if timeout == nil then
-        timeout = 0
-    else
-        timeout = tonumber(timeout)
-        if timeout < 0 then
-            timeout = 0
+local function take_ready(space, tube, count)
+    local candidates = {}
+    local iterator = box.space[space].index[idx_tube]
+                            :iterator(box.index.EQ, tube, ST_READY)
+    for task in iterator do
+        if #candidates >= count then
+            break
         end
+        table.insert(candidates, task[i_uuid])
     end
 
-    local created = box.time()
-
-    while true do
-
-        local iterator = box.space[space].index[idx_tube]
-                                :iterator(box.index.EQ, tube, ST_READY)
-
-        for task in iterator do
+    local taken = {}
+    for i, id in ipairs(candidates) do
+        -- box.update yields, so the task may have been taken meanwhile
+        local task = box.select(space, idx_task, id)
+        if task ~= nil and task[i_status] == ST_READY then
             local now = box.time64()
             local created = box.unpack('l', task[i_created])
             local ttr = box.unpack('l', task[i_ttr])
@@ -779,7 +794,6 @@ queue.take = function(space, tube, timeout)
                 end
             end
 
-
             task = box.update(space,
                 task[i_uuid],
                     '=p=p=p+p',
@@ -796,14 +810,41 @@ queue.take = function(space, tube, timeout)
                     1
             )
 
-            queue.workers[space][tube].ch:put(true, 0)
-            queue.consumers[space][tube]:put(true, 0)
             queue.stat[space][tube]:inc('take')
-            return rettask(task)
+            table.insert(taken, task)
         end
+    end
 
-        if timeout > 0 then
-            now = box.time()
+    if #taken > 0 then
+        queue.workers[space][tube].ch:put(true, 0)
+        queue.consumers[space][tube]:put(true, 0)
+    end
+    return taken
+end
+
+-- timeout: 0 or nil - wait forever, < 0 - do not wait
+local function wait_and_take(space, tube, count, timeout)
+
+    if timeout == nil then
+        timeout = 0
+    else
+        timeout = tonumber(timeout)
+    end
+
+    local created = box.time()
+
+    while true do
+
+        local taken = take_ready(space, tube, count)
+        if #taken > 0 then
+            return taken
+        end
+
+        if timeout < 0 then
+            queue.stat[space][tube]:inc('take_timeout')
+            return
+        elseif timeout > 0 then
+            local now = box.time()
             if now < created + timeout then
                 queue.consumers[space][tube]:get(created + timeout - now)
             else
@@ -816,6 +857,141 @@ queue.take = function(space, tube, timeout)
     end
 end
 
+-- queue.take(space, tube, timeout)
+-- take task for processing
+queue.take = function(space, tube, timeout)
+    space = tonumber(space)
+
+    local taken = wait_and_take(space, tube, 1, timeout)
+    if taken ~= nil then
+        return rettask(taken[1])
+    end
+end
+
+
+local function taken_rows(taken)
+    local now = box.pack('l', box.time64())
+    local result = {}
+    for i, task in ipairs(taken) do
+        table.insert(result, task
+            :transform(i_ipri, i_created - i_ipri)
+            :transform(i_cbury - (i_created - i_ipri), 1)
+            :transform(i_ctaken - (i_created - i_ipri), 0, now)
+            :transform(i_status, 1, human_status[ task[i_status] ])
+        )
+    end
+    return result
+end
+
+
+-- queue.take_batch(space, tube, count, timeout)
+--  take up to count ready tasks for processing in one call
+--   waits like queue.take until at least one task is ready,
+--   a negative timeout returns at once when no task is ready
+--   returns for every task:
+--      1.  uuid:str
+--      2.  tube:str
+--      3.  status:str
+--      4.  event:time64 (deadline of processing)
+--      5.  created:time64
+--      6.  ttl:time64
+--      7.  ttr:time64
+--      8.  ctaken:num64
+--      9.  now:time64
+--      10. ... - task data
+queue.take_batch = function(space, tube, count, timeout)
+    space = tonumber(space)
+    count = tonumber(count)
+    if count == nil or count < 1 then
+        count = 1
+    end
+
+    local taken = wait_and_take(space, tube, count, timeout)
+    if taken == nil then
+        return
+    end
+
+    return unpack(taken_rows(taken))
+end
+
+
+-- queue.take_any(space, count, timeout, tube1, count1, tube2, count2, ...)
+--  take up to count ready tasks from several tubes in one call
+--   first takes up to count_i tasks from every tube, then fills
+--   the rest of count from the tubes in the same order, so a tube
+--   without ready tasks gives its share to the others
+--   waits until at least one task is ready in any of the tubes,
+--   a negative timeout returns at once like queue.take_batch
+--   returns tasks like queue.take_batch
+queue.take_any = function(space, count, timeout, ...)
+    space = tonumber(space)
+    count = tonumber(count)
+    if count == nil or count < 1 then
+        count = 1
+    end
+    timeout = tonumber(timeout)
+    if timeout == nil then
+        timeout = 0
+    end
+
+    local args = {...}
+    local tubes = {}
+    local shares = {}
+    for i = 1, #args, 2 do
+        table.insert(tubes, args[i])
+        table.insert(shares, tonumber(args[i + 1]) or 0)
+    end
+
+    local created = box.time()
+    local waiter = box.ipc.channel(1)
+    local taken = {}
+
+    while true do
+        -- register before taking: take_ready yields and may miss a put
+        queue.any_waiters[space][waiter] = true
+
+        for i, tube in ipairs(tubes) do
+            local share = math.min(shares[i], count - #taken)
+            if share > 0 then
+                for j, task in ipairs(take_ready(space, tube, share)) do
+                    table.insert(taken, task)
+                end
+            end
+        end
+        for i, tube in ipairs(tubes) do
+            if #taken >= count then
+                break
+            end
+            for j, task in ipairs(take_ready(space, tube, count - #taken)) do
+                table.insert(taken, task)
+            end
+        end
+
+        if #taken > 0 or timeout < 0 then
+            break
+        end
+
+        if timeout > 0 then
+            local now = box.time()
+            if now >= created + timeout then
+                break
+            end
+            waiter:get(created + timeout - now)
+        else
+            waiter:get()
+        end
+    end
+
+    queue.any_waiters[space][waiter] = nil
+    if #taken == 0 then
+        for i, tube in ipairs(tubes) do
+            queue.stat[space][tube]:inc('take_timeout')
+        end
+        return
+    end
+    return unpack(taken_rows(taken))
+end
+
 
 -- queue.delete(space, id)
 --  deletes task from queue
@@ -853,6 +1029,29 @@ queue.ack = function(space, id)
 end
 
 
+local function call_batch(method, space, ...)
+    local result = {}
+    for i = 1, select('#', ...) do
+        local id = select(i, ...)
+        local ok, err = pcall(method, space, id)
+        if ok then
+            table.insert(result, box.tuple.new({ id, 'ok' }))
+        else
+            table.insert(result, box.tuple.new({ id, 'error', tostring(err) }))
+        end
+    end
+    return unpack(result)
+end
+
+
+-- queue.ack_batch(space, id, ...)
+--  ack several tasks in one call
+--   returns one tuple per id: (id, 'ok') or (id, 'error', message)
+queue.ack_batch = function(space, ...)
+    return call_batch(queue.ack, space, ...)
+end
+
+
 -- queue.touch(space, id)
 --  prolong ttr for taken task
 queue.touch = function(space, id)
@@ -958,6 +1157,13 @@ queue.bury = function(space, id)
     return rettask(task)
 end
 
+-- queue.bury_batch(space, id, ...)
+--  bury several tasks in one call
+--   returns one tuple per id: (id, 'ok') or (id, 'error', message)
+queue.bury_batch = function(space, ...)
+    return call_batch(queue.bury, space, ...)
+end
+
 -- queue.dig(space, id)
 --  dig(unbury) task
 queue.dig = function(space, id)
@@ -1122,6 +1328,23 @@ queue.release = function(space, id, delay, ttl)
 end
 
 
+-- queue.release_untaken(space, id [, delay ])
+--  releases task like queue.release, but the take is not counted in ctaken:
+--  consumer returns the task without processing it
+queue.release_untaken = function(space, id, delay)
+    local task = box.select(tonumber(space), idx_task, id)
+    if task ~= nil and task[i_status] == ST_TAKEN and
+            box.unpack('i', task[i_cid]) == box.session.id() then
+        local ctaken = box.unpack('l', task[i_ctaken])
+        if ctaken > 0 then
+            box.update(tonumber(space), id,
+                '=p', i_ctaken, box.pack('l', ctaken - 1))
+        end
+    end
+    return queue.release(space, id, delay)
+end
+
+
 -- queue.requeue(space, id)
 --  marks task as ready and push it at end of queue
 queue.requeue = function(space, id)
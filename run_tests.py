@@ -14,6 +14,26 @@ from source.tests.test_redirect_checker import RedirectCheckerTestCase
 from source.tests.test_lib_utils import LibUtilsTestCase
 from source.tests.test_lib_worker import LibWorkerTestCase
 from source.tests.test_lib__init import LibInitTestCase
+from source.tests.test_lib_session_pool import LibSessionPoolTestCase
+from source.tests.test_lib_queue_ext import LibQueueExtTestCase
+from source.tests.test_lib_host_scheduler import LibHostSchedulerTestCase
+from source.tests.test_lib_adaptive_limit import LibAdaptiveLimitTestCase
+from source.tests.test_lib_retry_policy import LibRetryPolicyTestCase
+from source.tests.test_lib_circuit_breaker import LibCircuitBreakerTestCase
+from source.tests.test_lib_coalescer import LibCoalescerTestCase
+from source.tests.test_lib_resident_pool import LibResidentPoolTestCase
+from source.tests.test_lib_timed_queue import LibTimedQueueTestCase
+from source.tests.test_lib_fair_lock import LibFairLockTestCase
+from source.tests.test_lib_payload import LibPayloadTestCase
+from source.tests.test_lib_metrics import LibMetricsTestCase
+from source.tests.test_lib_async_logging import LibAsyncLoggingTestCase
+from source.tests.test_lib_resizable_pool import LibResizablePoolTestCase
+from source.tests.test_lib_ttr_guard import LibTtrGuardTestCase
+from source.tests.test_lib_curl_pool import LibCurlPoolTestCase
+from source.tests.test_lib_multi_checker import LibMultiCheckerTestCase
+from source.tests.test_lib_counters import LibCountersTestCase
+from source.tests.test_lib_body_buffer import LibBodyBufferTestCase
+from source.tests.test_lib_meta_refresh import LibMetaRefreshTestCase
 
 
 def _create_connection(*args, **kwargs):
@@ -35,6 +55,26 @@ if __name__ == '__main__':
         unittest.makeSuite(LibUtilsTestCase),
         unittest.makeSuite(LibWorkerTestCase),
         unittest.makeSuite(LibInitTestCase),
+        unittest.makeSuite(LibSessionPoolTestCase),
+        unittest.makeSuite(LibQueueExtTestCase),
+        unittest.makeSuite(LibHostSchedulerTestCase),
+        unittest.makeSuite(LibAdaptiveLimitTestCase),
+        unittest.makeSuite(LibRetryPolicyTestCase),
+        unittest.makeSuite(LibCircuitBreakerTestCase),
+        unittest.makeSuite(LibCoalescerTestCase),
+        unittest.makeSuite(LibResidentPoolTestCase),
+        unittest.makeSuite(LibTimedQueueTestCase),
+        unittest.makeSuite(LibFairLockTestCase),
+        unittest.makeSuite(LibPayloadTestCase),
+        unittest.makeSuite(LibMetricsTestCase),
+        unittest.makeSuite(LibAsyncLoggingTestCase),
+        unittest.makeSuite(LibResizablePoolTestCase),
+        unittest.makeSuite(LibTtrGuardTestCase),
+        unittest.makeSuite(LibCurlPoolTestCase),
+        unittest.makeSuite(LibMultiCheckerTestCase),
+        unittest.makeSuite(LibCountersTestCase),
+        unittest.makeSuite(LibBodyBufferTestCase),
+        unittest.makeSuite(LibMetaRefreshTestCase),
     ))
     with mocked_connection():
         result = unittest.TextTestRunner().run(suite)
@@ -0,0 +1,63 @@
+#!/usr/bin/env python2.7
+# coding: utf-8
+"""
+Скорость поиска счетчиков: отдельное выражение .*счетчик.* на каждый счетчик (как было раньше)
+и один проход CounterDetector по всем счетчикам.
+
+    python2 source/benchmarks/counters.py [--size 500] [--extra 0]
+
+--size — размер страницы в КБ, --extra — сколько счетчиков добавить к COUNTER_TYPES.
+"""
+import argparse
+import os
+import random
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lib  # noqa
+from lib.counters import CounterDetector  # noqa
+
+PAGE_PARTS = [
+    '<div class="item">', '<script src="//cdn.example.com/app.js"></script>',
+    '<a href="http://top.example.ru/">link</a>', 'text ', ' Lorem ipsum dolor sit amet\n',
+    '<img src="/counter.png">',
+]
+
+
+def make_page(size):
+    random.seed(1)
+    parts = []
+    length = 0
+    while length < size:
+        parts.append(random.choice(PAGE_PARTS))
+        length += len(parts[-1])
+    parts.insert(len(parts) // 2, '<script src="https://mc.yandex.ru/metrika/watch.js"></script>')
+    return ''.join(parts)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Counter detection benchmark')
+    parser.add_argument('--size', type=int, default=500)
+    parser.add_argument('--extra', type=int, default=0)
+    args = parser.parse_args(argv[1:])
+
+    counter_types = lib.COUNTER_TYPES + tuple(
+        ('EXTRA_{}'.format(number), r'counter{}\.example\.com/hit'.format(number)) for number in xrange(args.extra)
+    )
+    regexps = [(name, re.compile(r'.*' + pattern + '.*', re.I + re.S)) for name, pattern in counter_types]
+    detector = CounterDetector(counter_types)
+    page = make_page(args.size * 1024)
+
+    def per_counter():
+        return [name for name, regexp in regexps if re.match(regexp, page)]
+
+    assert per_counter() == detector.find(page)
+    for title, find in (('regexp per counter', per_counter), ('single pass', lambda: detector.find(page))):
+        print '{:<20} {:>8.2f} ms/page'.format(title, timeit.timeit(find, number=10) * 100)
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -0,0 +1,153 @@
+#!/usr/bin/env python2.7
+# coding: utf-8
+"""
+Скорость проверки цепочек редиректов: переходов в секунду без переиспользования
+curl-хендлов (как было раньше: новый хендл на каждый переход), с пулом хендлов
+и с одновременной проверкой --concurrent цепочек через MultiChecker.
+
+Локальный keep-alive сервер отдает цепочки /hop/N -> /hop/N-1 -> ... -> /hop/0,
+каждый ответ задерживается на --latency секунд, как у удаленного сервера.
+
+    python2 source/benchmarks/redirect_hops.py [--chains 200] [--length 5] [--latency 0] [--concurrent 100] [--https]
+
+--https поднимает сервер с самоподписанным сертификатом (нужен openssl),
+чтобы измерить и переиспользование TLS-сессий.
+"""
+import argparse
+import os
+import ssl
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+import lib  # noqa
+from lib.multi_checker import MultiChecker  # noqa
+
+
+class HopHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # ответ одной записью без задержки Nagle, иначе keep-alive ждет delayed ACK
+    wbufsize = -1
+    disable_nagle_algorithm = True
+
+    latency = 0
+
+    def do_GET(self):
+        time.sleep(self.latency)
+        hops = int(self.path.rsplit('/', 1)[-1])
+        if hops:
+            self.send_response(302)
+            self.send_header('Location', '/hop/{}'.format(hops - 1))
+            body = ''
+        else:
+            self.send_response(200)
+            body = '<html><body>done</body></html>'
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class ThreadingServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+    # одновременные соединения MultiChecker не должны упираться в очередь accept
+    request_queue_size = 1024
+
+
+def make_certificate(directory):
+    key, cert = os.path.join(directory, 'key.pem'), os.path.join(directory, 'cert.pem')
+    subprocess.check_call([
+        'openssl', 'req', '-x509', '-newkey', 'rsa:2048', '-nodes', '-subj', '/CN=localhost',
+        '-keyout', key, '-out', cert, '-days', '1'
+    ], stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT)
+    return key, cert
+
+
+def start_server(https):
+    server = ThreadingServer(('127.0.0.1', 0), HopHandler)
+    scheme = 'http'
+    if https:
+        key, cert = make_certificate(tempfile.mkdtemp())
+        server.socket = ssl.wrap_socket(server.socket, keyfile=key, certfile=cert, server_side=True)
+        scheme = 'https'
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return '{}://localhost:{}'.format(scheme, server.server_address[1])
+
+
+def measure(base_url, chains, length, pool_size):
+    lib.curl_pool.clear()
+    lib.curl_pool.size = pool_size
+
+    hops = 0
+    started_at = time.time()
+    for _ in xrange(chains):
+        history_types, history_urls, counters = lib.get_redirect_history(
+            '{}/hop/{}'.format(base_url, length), timeout=5
+        )
+        assert 'ERROR' not in history_types, history_urls
+        hops += len(history_urls)
+    return hops / (time.time() - started_at)
+
+
+def measure_multi(base_url, chains, length, concurrent):
+    lib.curl_pool.clear()
+    lib.curl_pool.size = concurrent
+
+    checker = MultiChecker(concurrent, timeout=5)
+    hops = started = done = 0
+    started_at = time.time()
+    while done < chains:
+        while started < chains and checker.free_count():
+            checker.add(started, '{}/hop/{}'.format(base_url, length))
+            started += 1
+        for _, chain in checker.perform(1):
+            history_types, history_urls, counters = chain.result()
+            assert 'ERROR' not in history_types, history_urls
+            hops += len(history_urls)
+            done += 1
+    return hops / (time.time() - started_at)
+
+
+def main(argv):
+    parser = argparse.ArgumentParser(description='Redirect checker hops/sec benchmark')
+    parser.add_argument('--chains', type=int, default=200)
+    parser.add_argument('--length', type=int, default=5)
+    parser.add_argument('--latency', type=float, default=0)
+    parser.add_argument('--concurrent', type=int, default=100)
+    parser.add_argument('--https', action='store_true')
+    args = parser.parse_args(argv[1:])
+
+    if args.https:
+        # самоподписанный сертификат тестового сервера
+        original_acquire = lib.curl_pool.acquire
+
+        def acquire():
+            curl = original_acquire()
+            curl.setopt(curl.SSL_VERIFYPEER, 0)
+            curl.setopt(curl.SSL_VERIFYHOST, 0)
+            return curl
+        lib.curl_pool.acquire = acquire
+
+    HopHandler.latency = args.latency
+    base_url = start_server(args.https)
+    measure(base_url, 5, args.length, 4)
+
+    for title, pool_size in (('new handle per hop', 0), ('pooled handles', 4)):
+        print '{:<20} {:>8.0f} hops/sec'.format(title, measure(base_url, args.chains, args.length, pool_size))
+    title = '{} concurrent'.format(args.concurrent)
+    print '{:<20} {:>8.0f} hops/sec'.format(title, measure_multi(base_url, args.chains, args.length, args.concurrent))
+
+
+if __name__ == '__main__':
+    main(sys.argv)
@@ -14,16 +14,24 @@ OUTPUT_QUEUE_TUBE = 'url_redirect.queue'
 
 WORKER_POOL_SIZE = 10
 QUEUE_TAKE_TIMEOUT = 0.1
+QUEUE_PREFETCH_COUNT = 1
+# урлов, проверяемых одним обработчиком одновременно через pycurl.CurlMulti; 0 — по одному урлу
+CONCURRENT_CHAINS = 0
 
 SLEEP = 10
 
 HTTP_TIMEOUT = 3
 MAX_REDIRECTS = 30
+# сколько байт тела ответа скачивать для поиска мета-редиректа и счетчиков, None — без ограничения
+MAX_BODY_SIZE = 1024 * 1024
 RECHECK_DELAY = 300
 USER_AGENT = "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/31.0.1650.63 Safari/537.36"
 
 CHECK_URL = "http://t.mail.ru"
 
+# счетчики в дополнение к lib.COUNTER_TYPES: пары (тип счетчика, регулярное выражение)
+EXTRA_COUNTER_TYPES = []
+
 LOGGING = {
     'version': 1,
     'formatters': {
@@ -31,12 +39,23 @@ LOGGING = {
             'format': '%(asctime)s %(levelname)s %(threadName)s %(message)s'
         }
     },
+    'filters': {
+        'per_task': {
+            '()': 'lib.async_logging.SamplingFilter',
+            'rules': [
+                {'match': r'(Starting task|Task id=)', 'per_second': 100},
+            ],
+        }
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            'class': 'lib.async_logging.AsyncStreamHandler',
             'level': 'DEBUG',
             'stream': getwriter('utf-8')(sys.stderr),
-            'formatter': 'basic'
+            'formatter': 'basic',
+            'filters': ['per_task'],
+            'buffer_size': 10000,
+            'flush_interval': 0.1
         },
         'null': {
             'class': 'logging.NullHandler',
@@ -6,12 +6,58 @@ QUEUE_PORT = 33013
 QUEUE_SPACE = 0
 QUEUE_TAKE_TIMEOUT = 0.1
 QUEUE_TUBE = 'api.push_notifications'
+QUEUE_TUBES = []
+QUEUE_TUBES_STRICT_PRIORITY = False
+QUEUE_INTAKE_MODE = 'polling'
+QUEUE_LONG_POLL_TIMEOUT = 1
+QUEUE_TAKE_BATCH = True
+ACK_BATCH_SIZE = 100
+ACKER_ENABLED = True
+PROCESSED_QUEUE_SIZE = 1000
+ACK_LAG_WARNING = 5
+TTR_MIN_REMAINING = 2
+TTR_TOUCH_MARGIN = 5
 
 HTTP_CONNECTION_TIMEOUT = 30
+HTTP_POOL_SIZE = 10
+HTTP_POOL_IDLE_TIMEOUT = 60
+JSON_ENCODER = 'json'
+RESPONSE_MAX_SIZE = 65536
+
+RETRY_MAX_ATTEMPTS = 5
+RETRY_BASE_DELAY = 5
+RETRY_MAX_DELAY = 600
+
 SLEEP = 0.1
 SLEEP_ON_FAIL = 10
 
 WORKER_POOL_SIZE = 10
+RESIDENT_WORKERS = False
+WORKER_BUFFER_SIZE = 10
+WORKERS_SHUTDOWN_TIMEOUT = 30
+DRAIN_TIMEOUT = 20
+
+ADAPTIVE_POOL = False
+ADAPTIVE_POOL_MIN_SIZE = 2
+ADAPTIVE_LATENCY_TARGET = 1.0
+ADAPTIVE_MAX_ERROR_RATE = 0.1
+
+HOST_CONCURRENCY_LIMIT = 0
+HOST_QUEUE_SIZE = 20
+HOST_OVERFLOW_DELAY = 1
+SCHEDULER_MAX_PENDING = 100
+
+CIRCUIT_BREAKER_THRESHOLD = 5
+CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+CIRCUIT_BREAKER_PROBES = 1
+
+COALESCE_CALLBACK_URLS = []
+COALESCE_WINDOW = 0.05
+COALESCE_MAX_SIZE = 100
+COALESCE_MAX_PENDING = 1000
+
+METRICS_HOST = '127.0.0.1'
+METRICS_PORT = 9110
 
 LOGGING = {
     'version': 1,
@@ -20,12 +66,26 @@ LOGGING = {
             'format': '%(asctime)s %(levelname)s %(threadName)s %(message)s'
         }
     },
+    'filters': {
+        'per_task': {
+            '()': 'lib.async_logging.SamplingFilter',
+            'rules': [
+                {
+                    'match': r'(Start worker for task|Send data to callback url|Callback url \[.*\] response status code=)',
+                    'per_second': 100,
+                },
+            ],
+        }
+    },
     'handlers': {
         'console': {
-            'class': 'logging.StreamHandler',
+            'class': 'lib.async_logging.AsyncStreamHandler',
             'level': 'DEBUG',
             'stream': getwriter('utf-8')(sys.stderr),
-            'formatter': 'basic'
+            'formatter': 'basic',
+            'filters': ['per_task'],
+            'buffer_size': 10000,
+            'flush_interval': 0.1
         },
         'null': {
             'class': 'logging.NullHandler',
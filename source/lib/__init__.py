@@ -5,9 +5,13 @@ import re
 from urllib import quote, quote_plus
 from urlparse import urljoin, urlsplit, urlparse, urlunparse
 
-from bs4 import BeautifulSoup
 import pycurl
 
+from body_buffer import BodyBuffer
+from counters import CounterDetector
+from curl_pool import CurlPool
+from meta_refresh import find_meta_refresh
+
 logger = getLogger('redirect_checker')
 logger.addHandler(NullHandler())
 
@@ -18,17 +22,23 @@ OK_REDIRECT = re.compile(r'http://(www\.)?odnoklassniki\.ru/.*st\.redirect', re.
 OK_URL = re.compile(r'http(?:s)?://(www\.)?odnoklassniki\.ru/', re.I)
 MM_URL = re.compile(r'http(?:s)?://my\.mail\.ru/apps/', re.I)
 
+curl_pool = CurlPool()
+"""Curl-хендлы процесса: соединения с хостами переиспользуются между переходами и задачами"""
+
 COUNTER_TYPES = (
-    ('GOOGLE_ANALYTICS', re.compile(r'.*google-analytics\.com/ga\.js.*', re.I+re.S)),
-    ('YA_METRICA', re.compile(r'.*mc\.yandex\.ru/metrika/watch\.js.*', re.I+re.S)),
-    ('TOP_MAIL_RU', re.compile(r'.*top-fwz1\.mail\.ru/counter.*', re.I+re.S)),
-    ('TOP_MAIL_RU', re.compile(r'.*top\.mail\.ru/jump\?from.*', re.I+re.S)),
-    ('DOUBLECLICK', re.compile(r'.*//googleads\.g\.doubleclick\.net/pagead/viewthroughconversion.*', re.I+re.S)),
-    ('VISUALDNA', re.compile(r'.*//a1\.vdna-assets\.com/analytics\.js.*', re.I+re.S)),
-    ('LI_RU', re.compile(r'.*/counter\.yadro\.ru/hit.*', re.I+re.S)),
-    ('RAMBLER_TOP100', re.compile(r'.*counter\.rambler\.ru/top100.*', re.I+re.S))
+    ('GOOGLE_ANALYTICS', r'google-analytics\.com/ga\.js'),
+    ('YA_METRICA', r'mc\.yandex\.ru/metrika/watch\.js'),
+    ('TOP_MAIL_RU', r'top-fwz1\.mail\.ru/counter'),
+    ('TOP_MAIL_RU', r'top\.mail\.ru/jump\?from'),
+    ('DOUBLECLICK', r'//googleads\.g\.doubleclick\.net/pagead/viewthroughconversion'),
+    ('VISUALDNA', r'//a1\.vdna-assets\.com/analytics\.js'),
+    ('LI_RU', r'/counter\.yadro\.ru/hit'),
+    ('RAMBLER_TOP100', r'counter\.rambler\.ru/top100')
 )
 
+counter_detector = CounterDetector(COUNTER_TYPES)
+"""Счетчики, которые ищутся на конечных страницах: COUNTER_TYPES и счетчики из конфигурации"""
+
 
 def to_unicode(val, errors='strict'):
     return val if isinstance(val, unicode) else val.decode('utf8', errors=errors)
@@ -42,31 +52,34 @@ def get_counters(content):
     """
     Ищет в хтмл-странице счетичик и возвращает массив типов найденных
     """
-    counters = []
-    for counter_name, regexp in COUNTER_TYPES:
-        if re.match(regexp, content):
-            counters.append(counter_name)
-    return counters
+    return counter_detector.find(content)
+
+
+def load_counter_types(extra_counter_types=()):
+    """
+    Добавляет к COUNTER_TYPES счетчики из конфигурации
+    :param extra_counter_types: пары (тип счетчика, регулярное выражение)
+    """
+    counter_detector.load(COUNTER_TYPES + tuple(extra_counter_types))
 
 
 def check_for_meta(content, url):
     """
     Ищет в хтмл-странице мета-редирект теги и возраещет урл редиректа
+    Учитывается первый мета-тег refresh до </head>
     """
-    soup = BeautifulSoup(content, "html.parser")
-    result = soup.find("meta")
-    if result and 'content' in result.attrs:
-        for attr, value in result.attrs.items():
-            if attr == 'http-equiv' and value.lower() == 'refresh':
-                splitted = result['content'].split(";")
-                if len(splitted) != 2:
-                    return
-                wait, text = splitted
-                text = text.strip()
-                m = re.search(r"url\s*=\s*['\"]?([^'\"]+)", text, re.I)
-                if m:
-                    meta_url = m.groups()[0]
-                    return urljoin(url, to_unicode(meta_url, 'ignore'))
+    meta_content = find_meta_refresh(content)
+    if meta_content is None:
+        return
+    splitted = meta_content.split(";")
+    if len(splitted) != 2:
+        return
+    wait, text = splitted
+    text = text.strip()
+    m = re.search(r"url\s*=\s*['\"]?([^'\"]+)", text, re.I)
+    if m:
+        meta_url = m.groups()[0]
+        return urljoin(url, to_unicode(meta_url, 'ignore'))
 
 
 def fix_market_url(url):
@@ -75,42 +88,81 @@ def fix_market_url(url):
     return 'http://play.google.com/store/apps/' + url[len(market):] if url.startswith(market) else url
 
 
-def make_pycurl_request(url, timeout, useragent=None):
+def make_pycurl_request(url, timeout, useragent=None, body=None):
     """Делает http запрос (без перехода по редиректам)
     Возвращает контент ответа и возможный редирект
+    Хендл берется из curl_pool и возвращается в него, keep-alive соединения сохраняются
+    Тело ответа принимает body (BodyBuffer), по умолчанию без ограничения размера
     :return: содержимое ответа, урл редиректа
 
+    """
+    if body is None:
+        body = BodyBuffer(StringIO())
+    curl = curl_pool.acquire()
+    try:
+        setup_pycurl_request(curl, url, timeout, body, useragent)
+        try:
+            curl.perform()
+        except pycurl.error:
+            # скачивание прервал body: тело больше не нужно, ответ получен
+            if not body.aborted:
+                raise
+        content = body.getvalue()
+        redirect_url = get_pycurl_redirect_url(curl, body)
+    finally:
+        curl_pool.release(curl)
+    return content, redirect_url
+
+
+def setup_pycurl_request(curl, url, timeout, body, useragent=None):
+    """Настраивает хендл на http запрос без перехода по редиректам
+    Заголовки и содержимое ответа передаются в body (BodyBuffer)
+
     """
     prepared_url = to_str(prepare_url(url), 'ignore')
-    buff = StringIO()
-    curl = pycurl.Curl()
     curl.setopt(curl.URL, prepared_url)
     if useragent:
         curl.setopt(curl.USERAGENT, useragent)
-    curl.setopt(curl.WRITEDATA, buff)
+    curl.setopt(curl.HEADERFUNCTION, body.header)
+    curl.setopt(curl.WRITEFUNCTION, body.write)
     curl.setopt(curl.FOLLOWLOCATION, False)
     # curl.setopt(curl.CONNECTTIMEOUT, timeout)
     curl.setopt(curl.TIMEOUT, timeout)
-    curl.perform()
-    content = buff.getvalue()
+
+
+def get_pycurl_redirect_url(curl, body=None):
+    """
+    :param body: BodyBuffer запроса: если он прервал скачивание, урл редиректа берется из его location
+    :return: урл редиректа из ответа выполненного запроса или None
+    """
     redirect_url = curl.getinfo(curl.REDIRECT_URL)
-    curl.close()
+    if redirect_url is None and body is not None and body.aborted and body.location:
+        redirect_url = urljoin(curl.getinfo(curl.EFFECTIVE_URL), body.location)
     if redirect_url is not None:
         redirect_url = to_unicode(redirect_url, 'ignore')
-    return content, redirect_url
+    return redirect_url
 
 
-def get_url(url, timeout, user_agent=None):
+def get_url(url, timeout, user_agent=None, body=None):
     """
+    :param body: BodyBuffer для тела ответа
     :return: урл, тип редиректа, содержимое страницы (если есть)
     """
     content = None
     try:
-        content, new_redirect_url = make_pycurl_request(url, timeout, user_agent)
+        content, new_redirect_url = make_pycurl_request(url, timeout, user_agent, body)
     except (pycurl.error, ValueError) as e:
         logger.error(u'error in url {} {}'.format(url, e))
         return url, 'ERROR', content  # TODO add exception in ERROR
 
+    return get_redirect(url, content, new_redirect_url)
+
+
+def get_redirect(url, content, new_redirect_url):
+    """
+    Находит редирект в ответе на запрос урла: http редирект или мета-тег
+    :return: урл, тип редиректа, содержимое страницы (если есть)
+    """
     redirect_type = None
 
     # ignoring ok login redirects
@@ -130,7 +182,7 @@ def get_url(url, timeout, user_agent=None):
     return prepare_url(new_redirect_url), redirect_type, content
 
 
-def get_redirect_history(url, timeout, max_redirects=30, user_agent=None):
+def get_redirect_history(url, timeout, max_redirects=30, user_agent=None, max_body_size=None):
     """
     Входные параметры:
 
@@ -138,6 +190,7 @@ def get_redirect_history(url, timeout, max_redirects=30, user_agent=None):
     + timeout - таймаут на проверку *одного* урла
     + max_redirects - максимальное количество редиректов, после превышения проверка останавливается
     + user_agent - юзер-агент, если не передает, то будет дефолтный из pycurl
+    + max_body_size - сколько байт тела ответа скачивать, None - без ограничения
 
 
     Выходные параметры:
@@ -148,37 +201,84 @@ def get_redirect_history(url, timeout, max_redirects=30, user_agent=None):
     3. установленные счетчики на конечном урле
 
     """
-    url = prepare_url(url)
-    history_types = []
-    history_urls = [url]
-    redirect_url = url
+    return get_redirect_chain(url, timeout, max_redirects, user_agent, max_body_size).result()
 
-    # ignore mm / ok domains
-    if re.match(MM_URL, url) or re.match(OK_URL, url):
-        return history_types, history_urls, []
 
-    content = None
-    while True:
+def get_redirect_chain(url, timeout, max_redirects=30, user_agent=None, max_body_size=None):
+    """
+    То же, что get_redirect_history, но возвращает RedirectChain:
+    кроме истории редиректов в ней есть количество скачанных байт
+    :rtype: RedirectChain
+    """
+    chain = RedirectChain(url, max_redirects)
+    while not chain.finished:
+        body = BodyBuffer(StringIO(), max_body_size)
         redirect_url, redirect_type, content = get_url(
-            url=redirect_url,
+            url=chain.url,
             timeout=timeout,
-            user_agent=user_agent
+            user_agent=user_agent,
+            body=body
         )
-        if not redirect_url:
-            break
+        chain.add_hop(redirect_url, redirect_type, content, body.received)
 
-        history_types.append(redirect_type)
-        history_urls.append(redirect_url)
+    return chain
 
-        if redirect_type == 'ERROR':
-            break
 
-        if len(history_urls) > max_redirects or (redirect_url in history_urls[:-1]):
-            break
+class RedirectChain(object):
+    """
+    История редиректов урла, которая строится по одному переходу.
+
+    Следующий урл для запроса — url, результат запроса передается в add_hop
+    в том виде, в каком его возвращает get_url. Так один и тот же обход редиректов
+    работает и с блокирующими запросами (get_redirect_history), и с CurlMulti.
+    """
+
+    def __init__(self, url, max_redirects=30):
+        """
+        :param url: урл, для которого нужно получить редиректы
+        :param max_redirects: максимальное количество редиректов
+        :type max_redirects: int
+        """
+        self.url = prepare_url(url)
+        self.max_redirects = max_redirects
+        self.history_types = []
+        self.history_urls = [self.url]
+        self.content = None
+        self.received = 0
+
+        # ignore mm / ok domains
+        self.finished = bool(re.match(MM_URL, self.url) or re.match(OK_URL, self.url))
+
+    def add_hop(self, redirect_url, redirect_type, content, received=0):
+        """
+        Учитывает результат запроса урла url.
+
+        :param received: сколько байт тела ответа скачано
+        :type received: int
+        """
+        self.content = content
+        self.received += received
+        if not redirect_url:
+            self.finished = True
+            return
 
-    counters = get_counters(content) if content else []
+        self.history_types.append(redirect_type)
+        self.history_urls.append(redirect_url)
+        self.url = redirect_url
 
-    return history_types, history_urls, counters
+        if redirect_type == 'ERROR':
+            self.finished = True
+        elif len(self.history_urls) > self.max_redirects or (redirect_url in self.history_urls[:-1]):
+            self.finished = True
+
+    def result(self):
+        """
+        :return: типы найденных редиректов, урлы редиректов (включая конечный),
+            счетчики на конечном урле
+        :rtype: tuple
+        """
+        counters = get_counters(self.content) if self.content else []
+        return self.history_types, self.history_urls, counters
 
 
 def prepare_url(url):
@@ -0,0 +1,84 @@
+# coding: utf-8
+from logging import getLogger
+
+logger = getLogger('pusher')
+
+
+class AdaptiveLimit(object):
+    """
+    Ограничение числа одновременных запросов по схеме AIMD.
+
+    Результаты запросов собираются окнами по limit штук. Если в окне доля ошибок
+    больше max_error_rate или средняя задержка больше latency_target, лимит
+    умножается на decrease_factor, иначе увеличивается на единицу.
+    Лимит всегда остается в границах [min_limit, max_limit].
+    """
+
+    def __init__(self, min_limit, max_limit, latency_target, max_error_rate, decrease_factor=0.75):
+        """
+        :param min_limit: нижняя граница лимита
+        :type min_limit: int
+        :param max_limit: верхняя граница лимита
+        :type max_limit: int
+        :param latency_target: допустимая средняя задержка ответа, секунды
+        :type latency_target: float
+        :param max_error_rate: допустимая доля ошибок в окне
+        :type max_error_rate: float
+        :param decrease_factor: множитель уменьшения лимита
+        :type decrease_factor: float
+        """
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.latency_target = latency_target
+        self.max_error_rate = max_error_rate
+        self.decrease_factor = decrease_factor
+        self.limit = min_limit
+        self._reset_window()
+
+    def _reset_window(self):
+        self.samples = 0
+        self.errors = 0
+        self.latency_sum = 0.0
+
+    def record(self, url, elapsed, status_code, received=0):
+        """
+        Учитывает результат запроса.
+
+        :param url: урл запроса
+        :param elapsed: время запроса, секунды
+        :type elapsed: float
+        :param status_code: код ответа или None, если ответа не было
+        :type status_code: int
+        :param received: размер прочитанного тела ответа, байты
+        :type received: int
+        """
+        self.samples += 1
+        self.latency_sum += elapsed
+        if status_code is None or status_code >= 500 or status_code == 429:
+            self.errors += 1
+
+        if self.samples >= self.limit:
+            self.adjust()
+
+    def adjust(self):
+        """
+        Пересчитывает лимит по накопленному окну и начинает новое окно.
+        """
+        if not self.samples:
+            return
+
+        error_rate = float(self.errors) / self.samples
+        latency = self.latency_sum / self.samples
+
+        if error_rate > self.max_error_rate or latency > self.latency_target:
+            limit = max(self.min_limit, int(self.limit * self.decrease_factor))
+        else:
+            limit = min(self.max_limit, self.limit + 1)
+
+        if limit != self.limit:
+            logger.info('Change concurrency limit {old} -> {new} (error rate={rate:.2f}, latency={latency:.3f}s).'.format(
+                old=self.limit, new=limit, rate=error_rate, latency=latency
+            ))
+            self.limit = limit
+
+        self._reset_window()
@@ -0,0 +1,225 @@
+# coding: utf-8
+"""
+Обработчик логов, пишущий в поток из отдельного потока ОС, и фильтр,
+прореживающий частые сообщения.
+
+Оба настраиваются через LOGGING конфигурации:
+
+    'filters': {
+        'per_task': {
+            '()': 'lib.async_logging.SamplingFilter',
+            'rules': [{'match': r'Task id=\\d+ done', 'every': 10, 'per_second': 100}],
+        }
+    },
+    'handlers': {
+        'console': {
+            'class': 'lib.async_logging.AsyncStreamHandler',
+            'stream': ...,
+            'buffer_size': 10000,
+            'flush_interval': 0.1,
+            'filters': ['per_task'],
+        }
+    }
+"""
+from collections import deque
+import logging
+import os
+import re
+import time
+
+from gevent.monkey import get_original
+
+_allocate_lock, _start_new_thread = get_original('thread', ['allocate_lock', 'start_new_thread'])
+_sleep = get_original('time', 'sleep')
+"""Настоящие потоки и sleep: после patch_all запись не должна выполняться в gevent hub"""
+
+
+class AsyncStreamHandler(logging.StreamHandler):
+    """
+    StreamHandler, который только складывает записи в буфер, а форматирует
+    и пишет их фоновый поток раз в flush_interval секунд.
+
+    Когда в буфере buffer_size записей, новые записи отбрасываются, а в лог
+    пишется их количество. Фоновый поток запускается при первой записи
+    в каждом процессе, поэтому обработчик можно настроить до fork.
+    """
+
+    def __init__(self, stream=None, buffer_size=10000, flush_interval=0.1):
+        """
+        :param stream: поток вывода, по умолчанию sys.stderr
+        :param buffer_size: максимальное количество записей в буфере
+        :type buffer_size: int
+        :param flush_interval: период записи буфера, секунды
+        :type flush_interval: float
+        """
+        logging.StreamHandler.__init__(self, stream)
+        self.buffer_size = buffer_size
+        self.flush_interval = flush_interval
+        self.buffer = deque()
+        self.dropped = 0
+        self.pid = None
+        self.closed = False
+        self.write_lock = _allocate_lock()
+
+    def emit(self, record):
+        if self.closed:
+            self.write_records([record])
+            return
+
+        if self.pid != os.getpid():
+            self.start_writer()
+
+        if len(self.buffer) >= self.buffer_size:
+            self.dropped += 1
+            return
+
+        self.buffer.append(record)
+
+    def start_writer(self):
+        """
+        Запускает фоновый поток записи в текущем процессе.
+
+        Записи, унаследованные от родительского процесса, запишет родитель.
+        """
+        self.pid = os.getpid()
+        self.buffer.clear()
+        self.dropped = 0
+        self.write_lock = _allocate_lock()
+        _start_new_thread(self._run, (self.pid,))
+
+    def flush(self):
+        """
+        Записывает накопленные записи в вызывающем потоке.
+        """
+        self.write_pending()
+
+    def close(self):
+        self.closed = True
+        self.write_pending()
+        logging.StreamHandler.close(self)
+
+    def write_pending(self):
+        """
+        Пишет все записи из буфера и сообщение об отброшенных записях.
+        """
+        records = []
+        while self.buffer:
+            records.append(self.buffer.popleft())
+
+        dropped, self.dropped = self.dropped, 0
+        if dropped:
+            records.append(logging.makeLogRecord({
+                'name': __name__,
+                'levelno': logging.WARNING,
+                'levelname': logging.getLevelName(logging.WARNING),
+                'threadName': 'logging.writer',
+                'msg': '{count} log record(s) dropped, buffer is full.'.format(count=dropped),
+            }))
+
+        if records:
+            self.write_records(records)
+
+    def write_records(self, records):
+        """
+        :param records: записи лога
+        :type records: list
+        """
+        with self.write_lock:
+            for record in records:
+                try:
+                    message = self.format(record)
+                    if isinstance(message, str):
+                        message = message.decode('utf-8', 'replace')
+                    try:
+                        self.stream.write(message + u'\n')
+                    except UnicodeError:
+                        self.stream.write((message + u'\n').encode('utf-8'))
+                except Exception:
+                    self.handleError(record)
+
+            if hasattr(self.stream, 'flush'):
+                self.stream.flush()
+
+    def _run(self, pid):
+        while not self.closed and self.pid == pid:
+            self.write_pending()
+            _sleep(self.flush_interval)
+
+
+class SamplingRule(object):
+    """
+    Правило прореживания сообщений одного вида: пропускается каждое every-е
+    сообщение, но не больше per_second в секунду (0 — без ограничения).
+    """
+
+    def __init__(self, match, every=1, per_second=0):
+        """
+        :param match: регулярное выражение, с которым совпадает начало сообщения
+        :type match: basestring
+        :param every: пропускать каждое every-е сообщение
+        :type every: int
+        :param per_second: максимум сообщений в секунду
+        :type per_second: int
+        """
+        self.pattern = re.compile(match)
+        self.every = every
+        self.per_second = per_second
+        self.seen = 0
+        self.window_start = 0
+        self.window_count = 0
+
+    def matches(self, message):
+        """
+        :rtype: bool
+        """
+        return self.pattern.match(message) is not None
+
+    def allow(self):
+        """
+        Учитывает сообщение и решает, писать ли его.
+
+        :rtype: bool
+        """
+        self.seen += 1
+        if self.seen % self.every:
+            return False
+
+        if self.per_second:
+            now = time.time()
+            if now - self.window_start >= 1:
+                self.window_start = now
+                self.window_count = 0
+            if self.window_count >= self.per_second:
+                return False
+            self.window_count += 1
+
+        return True
+
+
+class SamplingFilter(logging.Filter):
+    """
+    Прореживает частые сообщения (например, строки на каждую задачу) по правилам.
+
+    Сообщения уровня level и выше, а также не подошедшие ни под одно правило,
+    пропускаются всегда. Применяется первое подошедшее правило.
+    """
+
+    def __init__(self, rules=(), level=logging.WARNING):
+        """
+        :param rules: параметры SamplingRule
+        :type rules: list
+        :param level: уровень, начиная с которого сообщения не прореживаются
+        """
+        logging.Filter.__init__(self)
+        self.rules = [SamplingRule(**rule) for rule in rules]
+        self.level = logging._checkLevel(level)
+
+    def filter(self, record):
+        if record.levelno >= self.level:
+            return True
+
+        message = record.msg if isinstance(record.msg, basestring) else record.getMessage()
+        for rule in self.rules:
+            if rule.matches(message):
+                return rule.allow()
+        return True
@@ -0,0 +1,79 @@
+# coding: utf-8
+
+HTML_CONTENT_TYPES = ('text/html', 'application/xhtml+xml')
+"""Тела ответов других типов не скачиваются: мета-редиректов и счетчиков в них нет"""
+
+
+def is_html(content_type):
+    """
+    :param content_type: значение заголовка Content-Type или None
+    :rtype: bool
+    """
+    if not content_type:
+        return True
+    return content_type.split(';', 1)[0].strip().lower() in HTML_CONTENT_TYPES
+
+
+class BodyBuffer(object):
+    """
+    Принимает тело ответа от curl (WRITEFUNCTION/HEADERFUNCTION) и прерывает скачивание,
+    когда тело больше не нужно: набрано max_size байт или ответ не html.
+
+    Прерванная так загрузка заканчивается ошибкой pycurl E_WRITE_ERROR, при этом aborted
+    истинно, и полученное тело можно использовать как обычный ответ. Урла редиректа
+    curl для прерванной загрузки не знает, он остается в location.
+    """
+
+    def __init__(self, buff, max_size=None):
+        """
+        :param buff: куда писать тело, например StringIO
+        :param max_size: сколько байт тела сохранять, None — без ограничения
+        :type max_size: int
+        """
+        self.buff = buff
+        self.max_size = max_size
+        self.size = 0
+        self.received = 0
+        self.content_type = None
+        self.location = None
+        self.is_redirect = False
+        self.truncated = False
+        self.skipped = False
+
+    @property
+    def aborted(self):
+        return self.truncated or self.skipped
+
+    def header(self, line):
+        if line.startswith('HTTP/'):
+            # новый ответ, например после 100 Continue
+            status = line.split(None, 2)[1:2]
+            self.is_redirect = bool(status) and status[0].startswith('3')
+            self.content_type = None
+            self.location = None
+            return
+
+        name, _, value = line.partition(':')
+        name = name.strip().lower()
+        if name == 'content-type':
+            self.content_type = value.strip()
+        elif name == 'location' and self.is_redirect:
+            self.location = value.strip()
+
+    def write(self, data):
+        self.received += len(data)
+        if not is_html(self.content_type):
+            self.skipped = True
+            return 0
+
+        if self.max_size is not None and self.size + len(data) > self.max_size:
+            data = data[:self.max_size - self.size]
+            self.truncated = True
+
+        self.buff.write(data)
+        self.size += len(data)
+        if self.truncated:
+            return 0
+
+    def getvalue(self):
+        return self.buff.getvalue()
@@ -0,0 +1,135 @@
+# coding: utf-8
+from logging import getLogger
+import time
+from urlparse import urlsplit
+
+logger = getLogger('pusher')
+
+STATE_CLOSED = 'closed'
+STATE_OPEN = 'open'
+STATE_HALF_OPEN = 'half_open'
+
+
+class HostCircuit(object):
+    """
+    Состояние автомата одного хоста.
+    """
+
+    def __init__(self):
+        self.state = STATE_CLOSED
+        self.failures = 0
+        self.changed_at = 0.0
+        self.probes = 0
+
+
+class CircuitBreaker(object):
+    """
+    Автоматы отключения запросов к хостам (circuit breaker).
+
+    После failure_threshold ошибок подряд хост отключается на reset_timeout секунд:
+    запросы к нему не выполняются. Затем к хосту пропускается до probe_count
+    пробных запросов; успешный ответ включает хост, ошибка отключает его снова.
+    Ошибкой считается отсутствие ответа, 5xx и 429.
+    """
+
+    def __init__(self, failure_threshold, reset_timeout, probe_count=1):
+        """
+        :param failure_threshold: число ошибок подряд до отключения хоста
+        :type failure_threshold: int
+        :param reset_timeout: время отключения хоста, секунды
+        :type reset_timeout: float
+        :param probe_count: число одновременных пробных запросов
+        :type probe_count: int
+        """
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.probe_count = probe_count
+        self.circuits = {}
+
+    def _set_state(self, host, circuit, state):
+        log = logger.warning if state == STATE_OPEN else logger.info
+        log('Circuit for host [{host}] {old} -> {new} (failures={failures}).'.format(
+            host=host, old=circuit.state, new=state, failures=circuit.failures
+        ))
+        circuit.state = state
+        circuit.changed_at = time.time()
+        circuit.probes = 0
+
+    def allow(self, host):
+        """
+        Можно ли сейчас выполнить запрос к хосту.
+
+        В полуоткрытом состоянии разрешенный запрос считается пробным.
+        Если пробный запрос не завершился за reset_timeout, пропускается следующий.
+
+        :rtype: bool
+        """
+        circuit = self.circuits.get(host)
+        if circuit is None or circuit.state == STATE_CLOSED:
+            return True
+
+        now = time.time()
+        if now - circuit.changed_at >= self.reset_timeout:
+            if circuit.state == STATE_OPEN:
+                self._set_state(host, circuit, STATE_HALF_OPEN)
+            else:
+                circuit.changed_at = now
+                circuit.probes = 0
+
+        if circuit.state == STATE_HALF_OPEN and circuit.probes < self.probe_count:
+            circuit.probes += 1
+            return True
+        return False
+
+    def retry_delay(self, host):
+        """
+        Через сколько секунд к хосту снова можно будет обратиться.
+
+        :rtype: float
+        """
+        circuit = self.circuits.get(host)
+        if circuit is None or circuit.state == STATE_CLOSED:
+            return 0.0
+        return max(0.0, self.reset_timeout - (time.time() - circuit.changed_at))
+
+    def record(self, url, elapsed, status_code, received=0):
+        """
+        Учитывает результат запроса.
+
+        :param url: урл запроса
+        :param elapsed: время запроса, секунды
+        :type elapsed: float
+        :param status_code: код ответа или None, если ответа не было
+        :type status_code: int
+        :param received: размер прочитанного тела ответа, байты
+        :type received: int
+        """
+        host = urlsplit(url).netloc
+        failed = status_code is None or status_code >= 500 or status_code == 429
+
+        circuit = self.circuits.get(host)
+        if circuit is None:
+            if not failed:
+                return
+            circuit = self.circuits[host] = HostCircuit()
+
+        if not failed:
+            if circuit.state != STATE_CLOSED:
+                circuit.failures = 0
+                self._set_state(host, circuit, STATE_CLOSED)
+            del self.circuits[host]
+            return
+
+        circuit.failures += 1
+        if circuit.state == STATE_HALF_OPEN or (
+                circuit.state == STATE_CLOSED and circuit.failures >= self.failure_threshold):
+            self._set_state(host, circuit, STATE_OPEN)
+
+    def states(self):
+        """
+        Состояния хостов, у которых были ошибки.
+
+        :return: словарь хост -> состояние
+        :rtype: dict
+        """
+        return dict((host, circuit.state) for host, circuit in self.circuits.iteritems())
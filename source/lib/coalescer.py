@@ -0,0 +1,88 @@
+# coding: utf-8
+import time
+
+
+class Coalescer(object):
+    """
+    Группирует задачи с одинаковым урлом уведомления в пачки.
+
+    Пачка урла готова к отправке, когда в ней max_size задач или когда с момента
+    появления в ней первой задачи прошло window секунд.
+    """
+
+    def __init__(self, urls, window, max_size):
+        """
+        :param urls: урлы, уведомления на которые отправляются пачками
+        :type urls: list
+        :param window: время накопления пачки, секунды
+        :type window: float
+        :param max_size: максимальный размер пачки
+        :type max_size: int
+        """
+        self.urls = frozenset(urls)
+        self.window = window
+        self.max_size = max_size
+        self.batches = {}
+        self.deadlines = {}
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def accepts(self, url):
+        """
+        Отправляются ли уведомления на урл пачками.
+
+        :rtype: bool
+        """
+        return url in self.urls
+
+    def add(self, url, item):
+        """
+        Добавляет задачу в пачку урла.
+        """
+        batch = self.batches.get(url)
+        if batch is None:
+            batch = self.batches[url] = []
+            self.deadlines[url] = time.time() + self.window
+
+        batch.append(item)
+        self.pending += 1
+
+    def pop_ready(self):
+        """
+        Забирает одну готовую к отправке пачку, не больше max_size задач.
+
+        :return: кортеж (урл, список задач) или None, если готовых пачек нет
+        """
+        now = time.time()
+        for url, batch in self.batches.iteritems():
+            if len(batch) >= self.max_size or self.deadlines[url] <= now:
+                break
+        else:
+            return None
+
+        items, rest = batch[:self.max_size], batch[self.max_size:]
+        if rest:
+            self.batches[url] = rest
+            self.deadlines[url] = now + self.window
+        else:
+            del self.batches[url]
+            del self.deadlines[url]
+
+        self.pending -= len(items)
+        return url, items
+
+    def drain(self):
+        """
+        Забирает все накопленные задачи.
+
+        :rtype: list
+        """
+        items = []
+        for batch in self.batches.itervalues():
+            items.extend(batch)
+        self.batches.clear()
+        self.deadlines.clear()
+        self.pending = 0
+        return items
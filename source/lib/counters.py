@@ -0,0 +1,70 @@
+# coding: utf-8
+import re
+
+ESCAPE_OR_TEXT = re.compile(r'\\.|[^\\]+', re.S)
+
+
+def lower_pattern(pattern):
+    """
+    Переводит регулярное выражение в нижний регистр, не трогая экранированные
+    последовательности (\\S, \\W и т.п. от регистра зависят).
+    """
+    return ESCAPE_OR_TEXT.sub(
+        lambda m: m.group() if m.group().startswith('\\') else m.group().lower(), pattern
+    )
+
+
+class CounterDetector(object):
+    """
+    Ищет счетчики на странице за один проход.
+
+    Выражения всех счетчиков объединяются в одно: страница переводится в нижний регистр
+    и просматривается один раз, сколько бы счетчиков ни было. Поиск регистронезависимый,
+    как re.I. Если выражения начинаются с обычного символа, re пропускает позиции,
+    с которых не начинается ни один счетчик, без перебора вариантов.
+    """
+
+    def __init__(self, counter_types=()):
+        """
+        :param counter_types: пары (тип счетчика, регулярное выражение);
+            у одного типа может быть несколько выражений
+        """
+        self.load(counter_types)
+
+    def load(self, counter_types):
+        """
+        Заменяет набор счетчиков.
+        """
+        self.names = [name for name, pattern in counter_types]
+        patterns = [lower_pattern(pattern) for name, pattern in counter_types]
+        self.regexps = [re.compile(pattern, re.S) for pattern in patterns]
+        self.regexp = None
+        if patterns:
+            # группа-метка в конце варианта говорит, какое выражение совпало,
+            # и не мешает re видеть первые символы вариантов
+            self.regexp = re.compile('|'.join(
+                '{}(?P<counter_{}>)'.format('(?:{})'.format(pattern) if '|' in pattern else pattern, index)
+                for index, pattern in enumerate(patterns)
+            ), re.S)
+
+    def find(self, content):
+        """
+        :return: типы найденных счетчиков в порядке counter_types
+        :rtype: list
+        """
+        if self.regexp is None:
+            return []
+
+        content = content.lower()
+        found = set()
+        match = self.regexp.search(content)
+        while match and len(found) < len(self.regexps):
+            start = match.start()
+            found.add(int(match.lastgroup[len('counter_'):]))
+            # с этой же позиции может начинаться и другой счетчик
+            for index, regexp in enumerate(self.regexps):
+                if index not in found and regexp.match(content, start):
+                    found.add(index)
+            match = self.regexp.search(content, start + 1)
+
+        return [name for index, name in enumerate(self.names) if index in found]
@@ -0,0 +1,61 @@
+# coding: utf-8
+import os
+
+import pycurl
+
+
+class CurlPool(object):
+    """
+    Curl-хендлы процесса, переиспользуемые между запросами.
+
+    Перед возвратом в пул хендл сбрасывается через reset(): настройки запроса
+    забываются, а кеш соединений, DNS и TLS-сессий остается, поэтому следующие
+    запросы к тем же хостам идут по уже открытым соединениям.
+
+    Хендлы, унаследованные через fork, не используются и не закрываются:
+    их соединения принадлежат родительскому процессу.
+    """
+
+    def __init__(self, size=4):
+        """
+        :param size: сколько свободных хендлов хранить, 0 — закрывать хендл после каждого запроса
+        :type size: int
+        """
+        self.size = size
+        self.idle = []
+        self.inherited = []
+        self.pid = os.getpid()
+
+    def acquire(self):
+        """
+        Берет свободный хендл или создает новый.
+
+        :rtype: pycurl.Curl
+        """
+        if self.pid != os.getpid():
+            self.inherited.extend(self.idle)
+            self.idle = []
+            self.pid = os.getpid()
+
+        if self.idle:
+            return self.idle.pop()
+        return pycurl.Curl()
+
+    def release(self, curl):
+        """
+        Сбрасывает настройки хендла и возвращает его в пул.
+
+        :type curl: pycurl.Curl
+        """
+        curl.reset()
+        if len(self.idle) < self.size:
+            self.idle.append(curl)
+        else:
+            curl.close()
+
+    def clear(self):
+        """
+        Закрывает свободные хендлы.
+        """
+        while self.idle:
+            self.idle.pop().close()
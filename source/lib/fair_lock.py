@@ -0,0 +1,47 @@
+# coding: utf-8
+from collections import deque
+
+from gevent.event import Event
+
+
+class FairLock(object):
+    """
+    Блокировка для greenlet, выдаваемая в порядке очереди.
+
+    gevent.lock.Semaphore не гарантирует порядок: greenlet, который отпускает
+    блокировку и сразу берет ее снова (например, цикл long-poll запросов), может
+    бесконечно обгонять ожидающих. Здесь освобожденная блокировка передается
+    первому ожидающему.
+    """
+
+    def __init__(self):
+        self.locked = False
+        self.waiters = deque()
+
+    def acquire(self):
+        if not self.locked and not self.waiters:
+            self.locked = True
+            return
+
+        event = Event()
+        self.waiters.append(event)
+        try:
+            event.wait()
+        except BaseException:
+            if event.is_set():
+                self.release()
+            else:
+                self.waiters.remove(event)
+            raise
+
+    def release(self):
+        if self.waiters:
+            self.waiters.popleft().set()
+        else:
+            self.locked = False
+
+    def __enter__(self):
+        self.acquire()
+
+    def __exit__(self, *exc_info):
+        self.release()
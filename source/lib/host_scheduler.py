@@ -0,0 +1,96 @@
+# coding: utf-8
+from collections import deque
+
+
+class HostScheduler(object):
+    """
+    Очереди задач по хостам с ограничением числа одновременных запросов к хосту.
+
+    Задачи выдаются по кругу между хостами, у которых есть ожидающие задачи
+    и не исчерпан лимит host_limit, поэтому медленный хост не занимает
+    все обработчики.
+    """
+
+    def __init__(self, host_limit, host_queue_size):
+        """
+        :param host_limit: максимум одновременных запросов к одному хосту
+        :type host_limit: int
+        :param host_queue_size: максимум ожидающих задач одного хоста
+        :type host_queue_size: int
+        """
+        self.host_limit = host_limit
+        self.host_queue_size = host_queue_size
+        self.queues = {}
+        self.hosts = deque()
+        self.in_flight = {}
+        self.pending = 0
+
+    def __len__(self):
+        return self.pending
+
+    def push(self, host, item):
+        """
+        Ставит задачу в очередь хоста.
+
+        :return: False, если очередь хоста заполнена и задача не принята
+        :rtype: bool
+        """
+        queue = self.queues.get(host)
+        if queue is None:
+            queue = self.queues[host] = deque()
+            self.hosts.append(host)
+        elif len(queue) >= self.host_queue_size:
+            return False
+
+        queue.append(item)
+        self.pending += 1
+        return True
+
+    def pop(self):
+        """
+        Выдает следующую задачу по кругу между хостами и учитывает ее как выполняющуюся.
+
+        :return: кортеж (хост, задача) или None, если все хосты с задачами заняты
+        """
+        for _ in xrange(len(self.hosts)):
+            host = self.hosts[0]
+            self.hosts.rotate(-1)
+
+            if self.in_flight.get(host, 0) >= self.host_limit:
+                continue
+
+            queue = self.queues[host]
+            item = queue.popleft()
+            if not queue:
+                del self.queues[host]
+                self.hosts.remove(host)
+
+            self.pending -= 1
+            self.in_flight[host] = self.in_flight.get(host, 0) + 1
+            return host, item
+
+        return None
+
+    def release(self, host):
+        """
+        Отмечает завершение запроса к хосту.
+        """
+        count = self.in_flight.get(host, 0) - 1
+        if count > 0:
+            self.in_flight[host] = count
+        else:
+            self.in_flight.pop(host, None)
+
+    def drain(self):
+        """
+        Забирает все ожидающие задачи.
+
+        :rtype: list
+        """
+        items = []
+        for host in self.hosts:
+            items.extend(self.queues[host])
+        self.queues.clear()
+        self.hosts.clear()
+        self.pending = 0
+        return items
@@ -0,0 +1,111 @@
+# coding: utf-8
+import codecs
+import re
+from HTMLParser import HTMLParser, HTMLParseError
+
+BYTE_ORDER_MARKS = (
+    (codecs.BOM_UTF8, 'utf-8'),
+    (codecs.BOM_UTF32_LE, 'utf-32le'),
+    (codecs.BOM_UTF32_BE, 'utf-32be'),
+    (codecs.BOM_UTF16_LE, 'utf-16le'),
+    (codecs.BOM_UTF16_BE, 'utf-16be'),
+)
+
+DECLARED_CHARSET = re.compile(r'''<\s*meta[^>]+charset\s*=\s*["']?([^>]*?)[ /;'">]''', re.I)
+"""Кодировка из <meta charset> или <meta http-equiv="Content-Type">, как ее ищет BeautifulSoup"""
+
+DECLARED_CHARSET_SEARCH_SIZE = 2048
+"""В скольких первых байтах страницы искать объявление кодировки"""
+
+FALLBACK_CHARSETS = ('utf-8', 'windows-1252')
+
+
+def get_page_charsets(content):
+    """
+    Кодировки, в которых стоит попробовать декодировать страницу, по порядку:
+    из BOM, объявленная в мета-теге, utf-8 и windows-1252 (как в BeautifulSoup).
+
+    :param content: страница
+    :type content: str
+
+    :return: пары (кодировка, сколько байт BOM пропустить)
+    :rtype: list
+    """
+    charsets = []
+    for bom, charset in BYTE_ORDER_MARKS:
+        if content.startswith(bom):
+            charsets.append((charset, len(bom)))
+            break
+
+    match = DECLARED_CHARSET.search(content, 0, max(DECLARED_CHARSET_SEARCH_SIZE, len(content) // 20))
+    if match and match.group(1):
+        charsets.append((match.group(1).lower(), 0))
+
+    charsets.extend((charset, 0) for charset in FALLBACK_CHARSETS)
+    return charsets
+
+
+def decode_page(content):
+    """
+    Переводит страницу в unicode в первой подошедшей кодировке (см. get_page_charsets).
+
+    :param content: страница
+    :type content: str
+
+    :rtype: unicode
+    """
+    for charset, skip in get_page_charsets(content):
+        try:
+            return content[skip:].decode(charset)
+        except (LookupError, UnicodeDecodeError):
+            continue
+    return content.decode('utf8', 'ignore')
+
+
+class StopParsing(Exception):
+    pass
+
+
+class MetaRefreshParser(HTMLParser):
+    """
+    Разбирает страницу до первого мета-тега refresh или до </head>.
+
+    Дерево документа не строится: HTMLParser только выделяет теги,
+    и разбор прерывается, как только ответ известен.
+    """
+
+    def __init__(self):
+        HTMLParser.__init__(self)
+        self.content = None
+
+    def handle_starttag(self, tag, attrs):
+        if tag != 'meta':
+            return
+
+        # как и в BeautifulSoup, из повторяющихся атрибутов берется последний
+        attrs = dict(attrs)
+        if (attrs.get('http-equiv') or '').lower() == 'refresh' and 'content' in attrs:
+            self.content = attrs['content'] or ''
+            raise StopParsing()
+
+    handle_startendtag = handle_starttag
+
+    def handle_endtag(self, tag):
+        if tag == 'head':
+            raise StopParsing()
+
+
+def find_meta_refresh(content):
+    """
+    Ищет в хтмл-странице мета-тег refresh
+    :param content: страница; кодировка str определяется по BOM и мета-тегам (см. decode_page)
+    :return: значение атрибута content мета-тега или None
+    """
+    if isinstance(content, str):
+        content = decode_page(content)
+    parser = MetaRefreshParser()
+    try:
+        parser.feed(content)
+    except (StopParsing, HTMLParseError):
+        pass
+    return parser.content
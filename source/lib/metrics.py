@@ -0,0 +1,127 @@
+# coding: utf-8
+from bisect import bisect_left
+from urlparse import urlsplit
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 300.0)
+"""Верхние границы интервалов гистограмм, секунды"""
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+def _format_labels(labels, extra=()):
+    pairs = labels + extra
+    if not pairs:
+        return ''
+    return '{' + ','.join(
+        '{key}="{value}"'.format(key=key, value=str(value).replace('\\', '\\\\').replace('"', '\\"'))
+        for key, value in pairs
+    ) + '}'
+
+
+class Metrics(object):
+    """
+    Счетчики, гистограммы и вычисляемые значения в текстовом формате Prometheus.
+
+    Значения хранятся в словарях и обновляются за O(1) (гистограмма — за O(log n)
+    по числу интервалов), поэтому сбор можно не выключать.
+    Объект можно передать обработчикам как observer: record() учитывает время
+    ответа, код ответа и размер тела ответа по хосту урла.
+    """
+
+    def __init__(self, buckets=LATENCY_BUCKETS):
+        """
+        :param buckets: верхние границы интервалов гистограмм
+        :type buckets: tuple
+        """
+        self.buckets = buckets
+        self.counters = {}
+        self.histograms = {}
+        self.gauges = {}
+
+    def inc(self, name, value=1, **labels):
+        """
+        Увеличивает счетчик.
+        """
+        series = self.counters.setdefault(name, {})
+        key = tuple(sorted(labels.iteritems()))
+        series[key] = series.get(key, 0) + value
+
+    def observe(self, name, value, **labels):
+        """
+        Добавляет значение в гистограмму.
+        """
+        series = self.histograms.setdefault(name, {})
+        key = tuple(sorted(labels.iteritems()))
+        histogram = series.get(key)
+        if histogram is None:
+            histogram = series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+
+        histogram[bisect_left(self.buckets, value)] += 1
+        histogram[-1] += value
+
+    def gauge(self, name, func):
+        """
+        Регистрирует значение, вычисляемое при каждой выдаче метрик.
+
+        :param func: функция без аргументов, возвращающая число
+        """
+        self.gauges[name] = func
+
+    def record(self, url, elapsed, status_code, received=0):
+        """
+        Учитывает результат запроса уведомления.
+
+        :param url: урл запроса
+        :param elapsed: время запроса, секунды
+        :type elapsed: float
+        :param status_code: код ответа или None, если ответа не было
+        :type status_code: int
+        :param received: размер прочитанного тела ответа, байты
+        :type received: int
+        """
+        host = urlsplit(url).netloc
+        self.observe('pusher_callback_latency_seconds', elapsed, host=host)
+        self.inc('pusher_callback_responses_total', host=host, status=status_code or 'error')
+        if received:
+            self.inc('pusher_callback_response_bytes_total', received, host=host)
+
+    def render(self):
+        """
+        :rtype: str
+        """
+        lines = []
+
+        for name in sorted(self.counters):
+            lines.append('# TYPE {name} counter'.format(name=name))
+            for labels, value in sorted(self.counters[name].iteritems()):
+                lines.append('{name}{labels} {value}'.format(name=name, labels=_format_labels(labels), value=value))
+
+        for name in sorted(self.histograms):
+            lines.append('# TYPE {name} histogram'.format(name=name))
+            for labels, histogram in sorted(self.histograms[name].iteritems()):
+                total = 0
+                for bound, count in zip(self.buckets + ('+Inf',), histogram):
+                    total += count
+                    lines.append('{name}_bucket{labels} {value}'.format(
+                        name=name, labels=_format_labels(labels, (('le', bound),)), value=total
+                    ))
+                lines.append('{name}_sum{labels} {value}'.format(
+                    name=name, labels=_format_labels(labels), value=histogram[-1]
+                ))
+                lines.append('{name}_count{labels} {value}'.format(
+                    name=name, labels=_format_labels(labels), value=total
+                ))
+
+        for name in sorted(self.gauges):
+            lines.append('# TYPE {name} gauge'.format(name=name))
+            lines.append('{name} {value}'.format(name=name, value=self.gauges[name]()))
+
+        return '\n'.join(lines) + '\n'
+
+    def wsgi_app(self, environ, start_response):
+        """
+        WSGI-приложение, отдающее метрики на любой GET запрос.
+        """
+        body = self.render()
+        start_response('200 OK', [('Content-Type', CONTENT_TYPE), ('Content-Length', str(len(body)))])
+        return [body]
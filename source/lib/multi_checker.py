@@ -0,0 +1,149 @@
+# coding: utf-8
+from StringIO import StringIO
+from logging import getLogger
+
+import pycurl
+
+from . import RedirectChain, curl_pool, get_pycurl_redirect_url, get_redirect, setup_pycurl_request
+from body_buffer import BodyBuffer
+
+logger = getLogger('redirect_checker')
+
+
+class MultiChecker(object):
+    """
+    Обходит редиректы многих урлов одновременно в одном потоке через pycurl.CurlMulti.
+
+    Каждая цепочка редиректов (RedirectChain) продвигается на один переход,
+    как только приходит ответ на ее текущий запрос; хендлы берутся из curl_pool,
+    поэтому keep-alive соединения переиспользуются между цепочками.
+    """
+
+    def __init__(self, size, timeout, max_redirects=30, user_agent=None, max_body_size=None):
+        """
+        :param size: максимальное количество одновременно проверяемых урлов
+        :type size: int
+        :param timeout: таймаут одного запроса, секунды
+        :param max_redirects: максимальное количество редиректов в цепочке
+        :type max_redirects: int
+        :param user_agent: юзер-агент запросов
+        :param max_body_size: сколько байт тела ответа скачивать, None — без ограничения
+        :type max_body_size: int
+        """
+        self.size = size
+        self.timeout = timeout
+        self.max_redirects = max_redirects
+        self.user_agent = user_agent
+        self.max_body_size = max_body_size
+        self.multi = pycurl.CurlMulti()
+        self.active = {}
+        self.finished = []
+
+    def __len__(self):
+        return len(self.active)
+
+    def free_count(self):
+        """
+        Сколько урлов можно добавить сейчас.
+
+        :rtype: int
+        """
+        return max(0, self.size - len(self.active) - len(self.finished))
+
+    def add(self, item, url):
+        """
+        Начинает обход редиректов урла.
+
+        :param item: объект, возвращаемый вместе с цепочкой, например задача
+        :param url: урл
+        """
+        chain = RedirectChain(url, self.max_redirects)
+        if chain.finished:
+            self.finished.append((item, chain))
+        else:
+            self.start_hop(item, chain)
+
+    def start_hop(self, item, chain):
+        body = BodyBuffer(StringIO(), self.max_body_size)
+        curl = curl_pool.acquire()
+        try:
+            setup_pycurl_request(curl, chain.url, self.timeout, body, self.user_agent)
+        except ValueError as e:
+            curl_pool.release(curl)
+            self.finish_hop(item, chain, body, e)
+            return
+
+        self.multi.add_handle(curl)
+        self.active[curl] = (item, chain, body)
+
+    def perform(self, timeout):
+        """
+        Продвигает запросы, ожидая сетевой активности не дольше timeout секунд.
+
+        :param timeout: время ожидания, секунды
+        :type timeout: float
+
+        :return: пары (item, RedirectChain) законченных цепочек
+        :rtype: list
+        """
+        if self.active and not self.finished:
+            wait = self.multi.timeout()
+            if wait >= 0:
+                timeout = min(timeout, wait / 1000.0)
+            if timeout > 0:
+                self.multi.select(timeout)
+
+        while True:
+            ret, running = self.multi.perform()
+            if ret != pycurl.E_CALL_MULTI_PERFORM:
+                break
+
+        while True:
+            queued, succeeded, failed = self.multi.info_read()
+            for curl in succeeded:
+                self.complete(curl, None)
+            for curl, errno, message in failed:
+                self.complete(curl, pycurl.error(errno, message))
+            if not queued:
+                break
+
+        finished, self.finished = self.finished, []
+        return finished
+
+    def complete(self, curl, error):
+        item, chain, body = self.active.pop(curl)
+        self.multi.remove_handle(curl)
+        if body.aborted:
+            # скачивание прервал body: тело больше не нужно, ответ получен
+            error = None
+        redirect_url = get_pycurl_redirect_url(curl, body) if error is None else None
+        curl_pool.release(curl)
+        self.finish_hop(item, chain, body, error, redirect_url)
+
+    def finish_hop(self, item, chain, body, error, redirect_url=None):
+        if error is not None:
+            logger.error(u'error in url {} {}'.format(chain.url, error))
+            chain.add_hop(chain.url, 'ERROR', None, body.received)
+        else:
+            redirect_url, redirect_type, content = get_redirect(chain.url, body.getvalue(), redirect_url)
+            chain.add_hop(redirect_url, redirect_type, content, body.received)
+
+        if chain.finished:
+            self.finished.append((item, chain))
+        else:
+            self.start_hop(item, chain)
+
+    def drain(self):
+        """
+        Прерывает незаконченные цепочки.
+
+        :return: объекты незаконченных цепочек
+        :rtype: list
+        """
+        items = []
+        for curl, (item, chain, body) in self.active.items():
+            self.multi.remove_handle(curl)
+            curl_pool.release(curl)
+            items.append(item)
+        self.active.clear()
+        return items
@@ -0,0 +1,84 @@
+# coding: utf-8
+"""
+Тело запроса уведомления.
+
+Задача хранит либо словарь данных уведомления и callback_url (данные кодируются
+в JSON при отправке), либо готовое тело — закодированный JSON-объект в поле
+RAW_BODY_KEY; в него без разбора дописывается только id задачи.
+
+Готовое тело не должно содержать поле id верхнего уровня: такая задача не отправляется
+и хоронится.
+"""
+from importlib import import_module
+import json
+import re
+
+RAW_BODY_KEY = 'raw_body'
+"""Поле данных задачи с готовым телом запроса"""
+
+ID_KEY = re.compile(r'"(?:i|\\u0069)(?:d|\\u0064)"\s*:', re.I)
+"""Возможный ключ id; есть ли он на верхнем уровне, проверяется разбором тела"""
+
+
+def load_json_encoder(module_name):
+    """
+    Функция dumps модуля JSON-кодировщика (json, ujson, simplejson...).
+
+    :param module_name: имя модуля
+    :type module_name: str
+
+    :rtype: callable
+    """
+    return import_module(module_name).dumps
+
+
+def splice_id(body, task_id):
+    """
+    Дописывает поле id в конец закодированного JSON-объекта.
+
+    Тело разбирается, только если в нем встречается ключ id: повторять ключ нельзя,
+    получатели по-разному обрабатывают повторы.
+
+    :param body: JSON-объект
+    :type body: basestring
+    :param task_id: идентификатор задачи
+
+    :rtype: str
+    """
+    if isinstance(body, unicode):
+        body = body.encode('utf-8')
+
+    head = body.rstrip()
+    if not head.endswith('}'):
+        raise ValueError('Raw body is not a JSON object.')
+
+    if ID_KEY.search(body) and 'id' in json.loads(body):
+        raise ValueError('Raw body already has an id.')
+
+    head = head[:-1].rstrip()
+    separator = '' if head.endswith('{') else ','
+    return '{head}{separator}"id":{task_id}}}'.format(
+        head=head, separator=separator, task_id=json.dumps(task_id)
+    )
+
+
+def build_body(task, dumps=json.dumps):
+    """
+    Урл и тело запроса уведомления задачи.
+
+    :param task: задача
+    :type task: tarantool_queue.Task
+    :param dumps: JSON-кодировщик для задач без готового тела
+
+    :return: кортеж (урл, тело запроса)
+    :rtype: tuple
+    """
+    data = task.data
+    raw_body = data.get(RAW_BODY_KEY)
+    if raw_body is not None:
+        return data['callback_url'], splice_id(raw_body, task.task_id)
+
+    data = data.copy()
+    url = data.pop('callback_url')
+    data['id'] = task.task_id
+    return url, dumps(data)
@@ -0,0 +1,280 @@
+# coding: utf-8
+"""
+Клиентская часть процедур из provision/init.lua, которых нет в tarantool_queue.
+"""
+import time
+
+from tarantool_queue.tarantool_queue import Task, unpack_long_long
+
+STATUS_OK = 'ok'
+
+NO_WAIT = -1
+"""Таймаут взятия задач, при котором queue.take_batch и queue.take_any не ждут задач"""
+
+TAKE_BATCH_META_FIELDS = ('event', 'created', 'ttl', 'ttr', 'ctaken', 'now')
+"""Поля метаданных задачи в ответе queue.take_batch (после uuid, tube и status)"""
+
+
+class MetaTask(Task):
+    """
+    Задача, взятая через queue.take_batch, с метаданными на момент взятия.
+
+    Времена в taken_meta — микросекунды по часам сервера очереди.
+    По ним считаются сроки ttr_deadline и ttl_deadline по локальным часам:
+    когда сервер вернет задачу в очередь и когда удалит ее.
+    """
+
+    def __init__(self, queue, taken_meta=None, **kwargs):
+        super(MetaTask, self).__init__(queue, **kwargs)
+        self.taken_meta = taken_meta or {}
+        self.ttr_deadline = None
+        self.ttl_deadline = None
+
+        if self.taken_meta:
+            taken_at = time.time()
+            server_now = self.taken_meta['now']
+            self.ttr_deadline = taken_at + (self.taken_meta['event'] - server_now) / 1000000.0
+            self.ttl_deadline = taken_at + (
+                self.taken_meta['created'] + self.taken_meta['ttl'] - server_now
+            ) / 1000000.0
+
+    def touch(self):
+        """
+        Продлевает ttr задачи через queue.touch и сдвигает ttr_deadline.
+
+        :rtype: bool
+        """
+        touched_at = time.time()
+        result = super(MetaTask, self).touch()
+        if self.ttr_deadline is not None:
+            self.ttr_deadline = min(
+                touched_at + self.taken_meta['ttr'] / 1000000.0,
+                self.ttl_deadline
+            )
+        return result
+
+    @classmethod
+    def from_row(cls, queue, row):
+        meta_end = 3 + len(TAKE_BATCH_META_FIELDS)
+        return cls(
+            queue,
+            taken_meta=dict(zip(
+                TAKE_BATCH_META_FIELDS,
+                [unpack_long_long(value) for value in row[3:meta_end]]
+            )),
+            space=queue.space,
+            task_id=row[0],
+            tube=row[1],
+            status=row[2],
+            raw_data=row[meta_end],
+        )
+
+
+def _call_batch(queue, procedure, task_ids):
+    response = queue.tnt.call(procedure, (str(queue.space),) + tuple(task_ids))
+
+    errors = {}
+    for row in response:
+        if row[1] != STATUS_OK:
+            errors[row[0]] = row[2] if len(row) > 2 else ''
+    return errors
+
+
+def ack_batch(queue, task_ids):
+    """
+    Подтверждает выполнение нескольких задач одним вызовом queue.ack_batch.
+
+    :param queue: очередь
+    :type queue: tarantool_queue.Queue
+    :param task_ids: идентификаторы задач
+    :type task_ids: list
+
+    :return: ошибки по идентификаторам задач, которые не удалось подтвердить
+    :rtype: dict
+    """
+    return _call_batch(queue, 'queue.ack_batch', task_ids)
+
+
+def bury_batch(queue, task_ids):
+    """
+    Хоронит несколько задач одним вызовом queue.bury_batch.
+
+    :param queue: очередь
+    :type queue: tarantool_queue.Queue
+    :param task_ids: идентификаторы задач
+    :type task_ids: list
+
+    :return: ошибки по идентификаторам задач, которые не удалось похоронить
+    :rtype: dict
+    """
+    return _call_batch(queue, 'queue.bury_batch', task_ids)
+
+
+def release_untaken(task, delay=0):
+    """
+    Возвращает задачу в очередь вызовом queue.release_untaken.
+
+    В отличие от Task.release взятие не засчитывается в ctaken: так возвращают задачи,
+    которые не обрабатывались, чтобы ctaken оставался числом попыток обработки.
+
+    :param task: взятая задача
+    :type task: tarantool_queue.Task
+    :param delay: задержка, секунды
+    :type delay: float
+    """
+    task.modified = True
+    queue = task.queue
+    queue.tnt.call('queue.release_untaken', (
+        str(queue.space),
+        str(task.task_id),
+        str(delay)
+    ))
+
+
+def lock_connection(queue, lock):
+    """
+    Сериализует запросы к tarantool через соединение очереди.
+
+    Соединение не рассчитано на одновременные запросы из нескольких greenlet,
+    а завершать задачу должна та же сессия, что ее взяла, поэтому greenlet,
+    работающие с одной очередью, делят соединение под блокировкой.
+
+    :param queue: очередь
+    :type queue: tarantool_queue.Queue
+    :param lock: блокировка, например FairLock
+    """
+    connection = queue.tnt
+    call = connection.call
+
+    def locked_call(*args, **kwargs):
+        with lock:
+            return call(*args, **kwargs)
+
+    connection.call = locked_call
+
+
+def take_batch(tube, count, timeout=0):
+    """
+    Берет до count готовых задач одним вызовом queue.take_batch.
+
+    Как и Tube.take, ждет появления хотя бы одной задачи не дольше timeout;
+    timeout 0 — ждать без ограничения, NO_WAIT — не ждать совсем.
+    Для TubeSet задачи берутся через queue.take_any.
+
+    :param tube: труба или набор труб
+    :type tube: tarantool_queue.Tube or TubeSet
+    :param count: максимальное количество задач
+    :type count: int
+    :param timeout: таймаут ожидания
+    :type timeout: float
+
+    :rtype: list of MetaTask
+    """
+    if isinstance(tube, TubeSet):
+        return tube.take_batch(count, timeout)
+
+    queue = tube.queue
+    response = queue.tnt.call('queue.take_batch', (
+        str(queue.space),
+        str(tube.opt['tube']),
+        str(count),
+        str(timeout)
+    ))
+    return [MetaTask.from_row(queue, row) for row in response]
+
+
+def take_any(queue, shares, count, timeout=0):
+    """
+    Берет до count готовых задач из нескольких труб одним вызовом queue.take_any.
+
+    Сначала из каждой трубы берется до ее доли, остаток count добирается
+    из труб в том же порядке. Ждет появления задачи в любой из труб не дольше timeout.
+
+    :param queue: очередь
+    :type queue: tarantool_queue.Queue
+    :param shares: пары (имя трубы, доля) в порядке приоритета
+    :type shares: list
+    :param count: максимальное количество задач
+    :type count: int
+    :param timeout: таймаут ожидания
+    :type timeout: float
+
+    :rtype: list of MetaTask
+    """
+    args = [str(queue.space), str(count), str(timeout)]
+    for name, share in shares:
+        args.extend((str(name), str(share)))
+
+    response = queue.tnt.call('queue.take_any', tuple(args))
+    return [MetaTask.from_row(queue, row) for row in response]
+
+
+class TubeSet(object):
+    """
+    Несколько труб одной очереди, из которых задачи берутся пропорционально весам.
+
+    Свободные места делятся между трубами плавным взвешенным round-robin,
+    поэтому пропорция соблюдается и при взятии по одной задаче.
+    При strict_priority задачи берутся из труб строго по порядку:
+    следующая труба получает только то, чего не хватило в предыдущих.
+    Доля пустой трубы в любом случае достается остальным (см. queue.take_any).
+
+    Как и Tube, поддерживает take и take_batch.
+    """
+
+    def __init__(self, queue, tubes, strict_priority=False):
+        """
+        :param queue: очередь
+        :type queue: tarantool_queue.Queue
+        :param tubes: пары (имя трубы, вес) в порядке приоритета
+        :type tubes: list
+        :param strict_priority: брать из труб строго по порядку, без учета весов
+        :type strict_priority: bool
+        """
+        self.queue = queue
+        self.tubes = [(name, weight) for name, weight in tubes if weight > 0 or strict_priority]
+        if not self.tubes:
+            raise ValueError('TubeSet needs at least one tube with positive weight')
+        self.strict_priority = strict_priority
+        self.total_weight = sum(weight for name, weight in self.tubes)
+        self.current = dict((name, 0) for name, weight in self.tubes)
+
+    @property
+    def names(self):
+        return [name for name, weight in self.tubes]
+
+    def allocate(self, count):
+        """
+        Делит count мест между трубами.
+
+        :param count: количество мест
+        :type count: int
+
+        :return: пары (имя трубы, доля) в порядке приоритета
+        :rtype: list
+        """
+        if self.strict_priority:
+            return [(name, count) for name, weight in self.tubes]
+
+        shares = dict((name, 0) for name, weight in self.tubes)
+        for _ in xrange(count):
+            for name, weight in self.tubes:
+                self.current[name] += weight
+            chosen = max(self.names, key=self.current.get)
+            self.current[chosen] -= self.total_weight
+            shares[chosen] += 1
+
+        return [(name, shares[name]) for name, weight in self.tubes]
+
+    def take_batch(self, count, timeout=0):
+        """
+        :rtype: list of MetaTask
+        """
+        return take_any(self.queue, self.allocate(count), count, timeout)
+
+    def take(self, timeout=0):
+        """
+        :rtype: MetaTask or None
+        """
+        tasks = self.take_batch(1, timeout)
+        return tasks[0] if tasks else None
@@ -0,0 +1,155 @@
+# coding: utf-8
+from logging import getLogger
+from threading import current_thread
+import time
+
+import gevent
+from gevent.event import Event
+from gevent.queue import Queue
+
+logger = getLogger('pusher')
+
+
+class ResidentPool(object):
+    """
+    Постоянные greenlet обработчиков, берущие задания из ограниченного буфера.
+
+    В отличие от gevent.pool.Pool greenlet не создается на каждое задание:
+    size обработчиков запускаются один раз и живут до kill().
+    Одновременно в работе и в буфере не больше size + buffer_size заданий,
+    submit() блокируется, пока в буфере нет места.
+    Количество обработчиков меняется на ходу через resize().
+    """
+
+    def __init__(self, size, buffer_size):
+        """
+        :param size: количество обработчиков
+        :type size: int
+        :param buffer_size: размер буфера заданий
+        :type buffer_size: int
+        """
+        self.size = size
+        self.buffer_size = buffer_size
+        self.buffer = Queue(buffer_size)
+        self.busy = 0
+        self.available = Event()
+        self.available.set()
+        self.greenlets = []
+        self.idle = set()
+
+    def __len__(self):
+        return self.busy + self.buffer.qsize()
+
+    def free_count(self):
+        """
+        Сколько заданий можно передать без ожидания.
+
+        :rtype: int
+        """
+        return max(0, self.size + self.buffer_size - len(self))
+
+    def wait_available(self):
+        """
+        Ждет, пока можно будет передать задание.
+        """
+        while not self.free_count():
+            self.available.clear()
+            self.available.wait()
+
+    def start(self):
+        """
+        Запускает обработчики.
+        """
+        for number in xrange(self.size):
+            self.greenlets.append(gevent.spawn(self._run, number))
+
+    def resize(self, size):
+        """
+        Меняет количество обработчиков.
+
+        Недостающие обработчики запускаются, лишние свободные останавливаются сразу,
+        а занятые — после выполнения текущего задания.
+
+        :type size: int
+        """
+        self.size = size
+
+        for number in xrange(size):
+            if number >= len(self.greenlets):
+                self.greenlets.append(gevent.spawn(self._run, number))
+            elif self.greenlets[number].dead:
+                self.greenlets[number] = gevent.spawn(self._run, number)
+
+        for number in xrange(size, len(self.greenlets)):
+            if number in self.idle:
+                self.greenlets[number].kill()
+
+        self.available.set()
+
+    def submit(self, run, args=(), kwargs=None, callback=None):
+        """
+        Ставит задание в буфер.
+
+        :param run: функция задания
+        :param args: позиционные аргументы
+        :type args: tuple
+        :param kwargs: именованные аргументы
+        :type kwargs: dict
+        :param callback: функция без аргументов, вызываемая после выполнения задания
+        """
+        self.buffer.put((run, args, kwargs or {}, callback))
+
+    def drain(self):
+        """
+        Забирает из буфера задания, которые еще не начали выполняться.
+
+        :return: список кортежей (функция, позиционные аргументы, именованные аргументы, callback)
+        :rtype: list
+        """
+        jobs = []
+        while not self.buffer.empty():
+            jobs.append(self.buffer.get_nowait())
+        self.available.set()
+        return jobs
+
+    def join(self, timeout=None):
+        """
+        Ждет выполнения всех заданий, не дольше timeout секунд.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        while len(self):
+            remaining = None if deadline is None else deadline - time.time()
+            if remaining is not None and remaining <= 0:
+                break
+            self.available.clear()
+            self.available.wait(remaining)
+
+    def kill(self):
+        """
+        Останавливает обработчики, задания из буфера не выполняются.
+        """
+        gevent.killall(self.greenlets)
+        del self.greenlets[:]
+        while not self.buffer.empty():
+            self.buffer.get_nowait()
+
+    def _run(self, number):
+        current_thread().name = 'pusher.worker#{number}'.format(number=number)
+
+        while number < self.size:
+            self.idle.add(number)
+            try:
+                run, args, kwargs, callback = self.buffer.get()
+            finally:
+                self.idle.discard(number)
+
+            self.busy += 1
+            try:
+                run(*args, **kwargs)
+            except Exception as exc:
+                logger.exception(exc)
+            finally:
+                self.busy -= 1
+                if callback is not None:
+                    callback()
+                self.available.set()
@@ -0,0 +1,44 @@
+# coding: utf-8
+from gevent.event import Event
+from gevent.pool import Group, Pool
+
+
+class ResizablePool(Pool):
+    """
+    gevent.pool.Pool, размер которого можно менять на ходу.
+
+    Вместо семафора на size мест свободное место проверяется по текущему
+    size, поэтому после уменьшения размера уже запущенные greenlet дорабатывают,
+    а новые ждут, пока их станет меньше size.
+    """
+
+    def __init__(self, size):
+        """
+        :param size: максимальное количество greenlet
+        :type size: int
+        """
+        Pool.__init__(self, size)
+        self.available = Event()
+        self.available.set()
+
+    def wait_available(self):
+        while self.full():
+            self.available.clear()
+            self.available.wait()
+
+    def add(self, greenlet):
+        self.wait_available()
+        Group.add(self, greenlet)
+
+    def _discard(self, greenlet):
+        Group._discard(self, greenlet)
+        self.available.set()
+
+    def resize(self, size):
+        """
+        Меняет максимальное количество greenlet.
+
+        :type size: int
+        """
+        self.size = size
+        self.available.set()
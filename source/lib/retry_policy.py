@@ -0,0 +1,89 @@
+# coding: utf-8
+from email.utils import mktime_tz, parsedate_tz
+import time
+
+ACTION_ACK = 'ack'
+ACTION_BURY = 'bury'
+ACTION_RETRY = 'retry'
+
+
+def parse_retry_after(value):
+    """
+    Разбирает заголовок Retry-After (секунды или HTTP-дата).
+
+    :return: задержка в секундах или None, если заголовок не разобран
+    :rtype: float
+    """
+    if not value:
+        return None
+
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+
+    parsed = parsedate_tz(value)
+    if parsed is None:
+        return None
+    return max(0.0, mktime_tz(parsed) - time.time())
+
+
+class RetryPolicy(object):
+    """
+    Политика повторной отправки уведомлений.
+
+    2xx и 3xx подтверждаются, 5xx, 429 и сетевые ошибки повторяются с экспоненциально
+    растущей задержкой, остальные 4xx считаются окончательной ошибкой.
+    После max_attempts попыток задача хоронится.
+    """
+
+    def __init__(self, max_attempts, base_delay, max_delay):
+        """
+        :param max_attempts: максимальное число попыток
+        :type max_attempts: int
+        :param base_delay: задержка после первой попытки, секунды
+        :type base_delay: float
+        :param max_delay: максимальная задержка, секунды
+        :type max_delay: float
+        """
+        self.max_attempts = max_attempts
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def classify(self, status_code):
+        """
+        Определяет действие над задачей по коду ответа.
+
+        :param status_code: код ответа или None, если запрос не удался
+        :type status_code: int
+
+        :rtype: str
+        """
+        if status_code is None or status_code >= 500 or status_code == 429:
+            return ACTION_RETRY
+        if status_code >= 400:
+            return ACTION_BURY
+        return ACTION_ACK
+
+    def delay(self, attempt, retry_after=None):
+        """
+        Задержка перед следующей попыткой.
+
+        :param attempt: номер завершившейся попытки, начиная с 1
+        :type attempt: int
+        :param retry_after: задержка, запрошенная сервером
+        :type retry_after: float
+
+        :rtype: float
+        """
+        if retry_after is not None:
+            return min(retry_after, self.max_delay)
+        return min(self.base_delay * 2 ** max(attempt - 1, 0), self.max_delay)
+
+    def should_retry(self, attempt):
+        """
+        :param attempt: номер завершившейся попытки, начиная с 1
+        :type attempt: int
+
+        :rtype: bool
+        """
+        return attempt < self.max_attempts
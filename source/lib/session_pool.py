@@ -0,0 +1,92 @@
+# coding: utf-8
+from logging import getLogger
+import time
+from urlparse import urlsplit
+
+from requests import Session
+from requests.adapters import HTTPAdapter
+
+logger = getLogger('pusher')
+
+
+class SessionPool(object):
+    """
+    Пул keep-alive сессий requests, по одной на хост (схема + netloc).
+
+    Сессия хоста держит до pool_size постоянных соединений, которые
+    переиспользуются всеми гринлетами. Сессии, не использовавшиеся дольше
+    idle_timeout секунд, закрываются в evict_idle().
+    """
+
+    def __init__(self, pool_size, idle_timeout, pool_block=False):
+        """
+        :param pool_size: максимальное число постоянных соединений на хост
+        :type pool_size: int
+        :param idle_timeout: время простоя сессии до закрытия, секунды
+        :type idle_timeout: float
+        :param pool_block: ждать свободного соединения вместо открытия лишнего
+        :type pool_block: bool
+        """
+        self.pool_size = pool_size
+        self.idle_timeout = idle_timeout
+        self.pool_block = pool_block
+        self.sessions = {}
+        self.last_used = {}
+
+    def _create_session(self):
+        session = Session()
+        adapter = HTTPAdapter(
+            pool_connections=1,
+            pool_maxsize=self.pool_size,
+            pool_block=self.pool_block
+        )
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+        return session
+
+    def get(self, url):
+        """
+        Возвращает сессию для хоста урла, создавая ее при необходимости.
+
+        :param url: урл запроса
+        :type url: basestring
+
+        :rtype: requests.Session
+        """
+        parts = urlsplit(url)
+        host = (parts.scheme, parts.netloc)
+
+        session = self.sessions.get(host)
+        if session is None:
+            logger.debug('Open session for host [{host}].'.format(host=parts.netloc))
+            session = self._create_session()
+            self.sessions[host] = session
+
+        self.last_used[host] = time.time()
+        return session
+
+    def evict_idle(self):
+        """
+        Закрывает сессии, простаивающие дольше idle_timeout.
+
+        :return: количество закрытых сессий
+        :rtype: int
+        """
+        deadline = time.time() - self.idle_timeout
+        idle_hosts = [host for host, used in self.last_used.iteritems() if used < deadline]
+
+        for host in idle_hosts:
+            logger.debug('Close idle session for host [{host}].'.format(host=host[1]))
+            self.sessions.pop(host).close()
+            del self.last_used[host]
+
+        return len(idle_hosts)
+
+    def close(self):
+        """
+        Закрывает все сессии пула.
+        """
+        for session in self.sessions.itervalues():
+            session.close()
+        self.sessions.clear()
+        self.last_used.clear()
@@ -0,0 +1,69 @@
+# coding: utf-8
+import time
+
+from gevent.queue import Queue
+
+MAX_WAIT_WINDOW = 60
+"""Длина окна, за которое считается максимальное ожидание, секунды"""
+
+
+class TimedQueue(Queue):
+    """
+    gevent.queue.Queue, запоминающая, сколько элементы ждали в очереди.
+
+    last_wait — ожидание последнего взятого элемента, max_wait — максимальное
+    ожидание в текущем окне из MAX_WAIT_WINDOW секунд, секунды.
+    """
+
+    def _init(self, maxsize, items=None):
+        Queue._init(self, maxsize, [(time.time(), item) for item in items or ()])
+        self.last_wait = 0.0
+        self.max_wait = 0.0
+        self.previous_max_wait = 0.0
+        self.window_started = time.time()
+
+    def copy(self):
+        return type(self)(self.maxsize, [item for _, item in self.queue])
+
+    def _put(self, item):
+        self.queue.append((time.time(), item))
+
+    def _get(self):
+        put_at, item = self.queue.popleft()
+        now = time.time()
+        self._rotate(now)
+        self.last_wait = now - put_at
+        self.max_wait = max(self.max_wait, self.last_wait)
+        return item
+
+    def _rotate(self, now):
+        elapsed = now - self.window_started
+        if elapsed < MAX_WAIT_WINDOW:
+            return
+        # если прошло больше окна без взятий, предыдущее окно пустое
+        self.previous_max_wait = self.max_wait if elapsed < 2 * MAX_WAIT_WINDOW else 0.0
+        self.max_wait = 0.0
+        self.window_started = now - elapsed % MAX_WAIT_WINDOW
+
+    def _peek(self):
+        return self.queue[0][1]
+
+    def oldest_wait(self):
+        """
+        Сколько ждет самый старый элемент в очереди.
+
+        :rtype: float
+        """
+        if not self.queue:
+            return 0.0
+        return time.time() - self.queue[0][0]
+
+    def recent_max_wait(self):
+        """
+        Максимальное ожидание за текущее и предыдущее окна, то есть не меньше
+        чем за последние MAX_WAIT_WINDOW секунд. Чтение значение не сбрасывает.
+
+        :rtype: float
+        """
+        self._rotate(time.time())
+        return max(self.max_wait, self.previous_max_wait)
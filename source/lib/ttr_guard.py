@@ -0,0 +1,113 @@
+# coding: utf-8
+import time
+
+from queue_ext import MetaTask
+
+
+class TtrGuard(object):
+    """
+    Следит, чтобы уведомление успевало уйти до того, как сервер очереди
+    вернет задачу в очередь по ttr: иначе задачу возьмет другой обработчик
+    и уведомление будет отправлено дважды.
+
+    Срок задачи — ttr_deadline, а при продлении ttr через queue.touch — ttl_deadline.
+    Работает только для задач с метаданными взятия (MetaTask), для остальных
+    сроки неизвестны и ничего не ограничивается.
+    """
+
+    def __init__(self, min_remaining, touch_margin=0):
+        """
+        :param min_remaining: задачи, у которых до срока осталось меньше, не запускаются
+        :type min_remaining: float
+        :param touch_margin: ttr запущенных задач продлевается, когда до его истечения
+            остается меньше touch_margin секунд; 0 — не продлевать
+        :type touch_margin: float
+        """
+        self.min_remaining = min_remaining
+        self.touch_margin = touch_margin
+        self.running = {}
+
+    def __len__(self):
+        return len(self.running)
+
+    def time_left(self, task, now=None):
+        """
+        Сколько секунд осталось у задачи на обработку.
+
+        :return: оставшееся время или None, если сроки задачи неизвестны
+        :rtype: float
+        """
+        if not isinstance(task, MetaTask) or task.ttr_deadline is None:
+            return None
+
+        if now is None:
+            now = time.time()
+        deadline = task.ttl_deadline if self.touch_margin else task.ttr_deadline
+        return deadline - now
+
+    def can_finish(self, task, now=None):
+        """
+        Успеет ли задача обработаться до срока.
+
+        Задача с ttr меньше min_remaining запускается всегда: при повторном
+        взятии времени у нее больше не станет.
+
+        :rtype: bool
+        """
+        left = self.time_left(task, now)
+        if left is None:
+            return True
+        if left <= 0:
+            return False
+        if left >= self.min_remaining:
+            return True
+        return not self.touch_margin and task.taken_meta['ttr'] / 1000000.0 < self.min_remaining
+
+    def timeout(self, tasks, timeout, now=None):
+        """
+        Таймаут запроса, не выходящий за срок ни одной из задач.
+
+        :param tasks: задачи запроса
+        :type tasks: list
+        :param timeout: таймаут из конфигурации
+        :type timeout: float
+
+        :rtype: float
+        """
+        for task in tasks:
+            left = self.time_left(task, now)
+            if left is not None:
+                timeout = min(timeout, max(left, 0))
+        return timeout
+
+    def track(self, tasks):
+        """
+        Запоминает запущенные задачи, чтобы продлевать их ttr.
+        """
+        if not self.touch_margin:
+            return
+        for task in tasks:
+            if isinstance(task, MetaTask) and task.ttr_deadline is not None:
+                self.running[task.task_id] = task
+
+    def untrack(self, tasks):
+        """
+        Забывает задачи, обработка которых закончилась.
+        """
+        for task in tasks:
+            self.running.pop(task.task_id, None)
+
+    def expiring(self, now=None):
+        """
+        Запущенные задачи, ttr которых пора продлить.
+
+        Задачи, у которых ttr уже упирается в ttl, не продлеваются: продлевать некуда.
+
+        :rtype: list
+        """
+        if now is None:
+            now = time.time()
+        return [
+            task for task in self.running.itervalues()
+            if task.ttr_deadline - now < self.touch_margin and task.ttr_deadline < task.ttl_deadline
+        ]
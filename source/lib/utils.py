@@ -1,5 +1,6 @@
 # coding: utf-8
 import argparse
+import logging
 from multiprocessing import Process
 import os
 import socket
@@ -61,6 +62,47 @@ def load_config_from_pyfile(filepath):
     return cfg
 
 
+def reload_config(config, filepath, keys):
+    """
+    Перечитывает py файл с настройками и обновляет в config только ключи keys.
+
+    :param config: текущие настройки, изменяются на месте
+    :type config: Config
+    :param filepath: путь до py файла с настройками
+    :type filepath: basestring
+    :param keys: ключи, которые можно менять без перезапуска
+    :type keys: tuple
+
+    :return: словарь измененных ключей и их новых значений
+    :rtype: dict
+    """
+    fresh = load_config_from_pyfile(filepath)
+
+    changed = {}
+    for key in keys:
+        if hasattr(fresh, key) and getattr(fresh, key) != getattr(config, key, None):
+            changed[key] = getattr(fresh, key)
+            setattr(config, key, changed[key])
+
+    return changed
+
+
+def apply_log_levels(logging_config):
+    """
+    Применяет уровни логгеров из словаря конфигурации logging, не пересоздавая обработчики.
+
+    :param logging_config: словарь в формате logging.config.dictConfig
+    :type logging_config: dict
+    """
+    for name, logger_config in logging_config.get('loggers', {}).iteritems():
+        if 'level' in logger_config:
+            logging.getLogger(name).setLevel(logger_config['level'])
+
+    root_config = logging_config.get('root', {})
+    if 'level' in root_config:
+        logging.getLogger().setLevel(root_config['level'])
+
+
 def parse_cmd_args(args, app_description=''):
     """
     Разбирает аргументы командной строки.
@@ -111,9 +153,13 @@ class Config(object):
     pass
 
 
-def spawn_workers(num, target, args, parent_pid):
+def spawn_workers(num, target, args, parent_pid, generation=None):
+    kwargs = {'parent_pid': parent_pid}
+    if generation is not None:
+        kwargs['generation'] = generation
+
     for _ in xrange(num):
-        p = Process(target=target, args=args, kwargs={'parent_pid': parent_pid})
+        p = Process(target=target, args=args, kwargs=kwargs)
         p.daemon = True
         p.start()
 
@@ -1,16 +1,20 @@
 # coding: utf-8
-from logging import getLogger
+from collections import deque
+from logging import getLogger, shutdown as shutdown_logging
 import os.path
+import time
 
 from tarantool.error import DatabaseError
-from . import to_unicode, get_redirect_history
+from . import to_unicode, get_redirect_chain, load_counter_types
 
+from multi_checker import MultiChecker
+from queue_ext import NO_WAIT, take_batch
 from utils import get_tube
 
 logger = getLogger('redirect_checker')
 
 
-def get_redirect_history_from_task(task, timeout, max_redirects=30, user_agent=None):
+def get_redirect_history_from_task(task, timeout, max_redirects=30, user_agent=None, max_body_size=None):
     url = to_unicode(task.data['url'], 'ignore')
     is_recheck = bool(task.data.get('recheck'))
 
@@ -18,9 +22,25 @@ def get_redirect_history_from_task(task, timeout, max_redirects=30, user_agent=N
         task.task_id, url, task.data["url_id"], is_recheck
     ))
 
-    history_types, history_urls, counters = get_redirect_history(
-        url, timeout, max_redirects, user_agent
-    )
+    chain = get_redirect_chain(url, timeout, max_redirects, user_agent, max_body_size)
+    log_downloaded(task, chain)
+    return make_task_result(task, *chain.result())
+
+
+def log_downloaded(task, chain):
+    logger.info(u'Task id={} downloaded {} bytes in {} requests'.format(
+        task.task_id, chain.received, len(chain.history_types) + 1
+    ))
+
+
+def make_task_result(task, history_types, history_urls, counters):
+    """
+    Результат проверки задачи: перепроверка во входной очереди или данные для выходной.
+
+    :return: нужно ли положить данные во входную очередь, данные
+    :rtype: tuple
+    """
+    is_recheck = bool(task.data.get('recheck'))
     if 'ERROR' in history_types and not is_recheck:
         task.data['recheck'] = True
         data = task.data
@@ -38,7 +58,52 @@ def get_redirect_history_from_task(task, timeout, max_redirects=30, user_agent=N
     return is_input, data
 
 
-def worker(config, parent_pid):
+def take_task(tube, prefetched, count, timeout):
+    """
+    Берет задачу из трубы.
+
+    При count > 1 задачи берутся пачками по count штук через queue.take_batch
+    и отдаются из локального буфера prefetched.
+    """
+    if count <= 1:
+        return tube.take(timeout)
+
+    if not prefetched:
+        prefetched.extend(take_batch(tube, count, timeout))
+
+    return prefetched.popleft() if prefetched else None
+
+
+def finish_task(task, result, input_tube, output_tube, config):
+    """
+    Кладет результат проверки в очередь и подтверждает задачу.
+    """
+    if result:
+        is_input, data = result
+        if is_input:
+            input_tube.put(
+                data,
+                delay=config.RECHECK_DELAY,
+                pri=task.meta()['pri']
+            )
+        else:
+            output_tube.put(data)
+        logger.debug(u'Task id={} data:{}'.format(task.task_id, data))
+    try:
+        task.ack()
+        logger.info(u'Task id={} done'.format(task.task_id))
+    except DatabaseError as e:
+        logger.info('Task ack fail')
+        logger.exception(e)
+
+
+def get_tubes(config):
+    """
+    Подключается к входной и выходной очередям.
+
+    :return: входная труба, выходная труба
+    :rtype: tuple
+    """
     input_tube = get_tube(
         host=config.INPUT_QUEUE_HOST,
         port=config.INPUT_QUEUE_PORT,
@@ -64,36 +129,118 @@ def worker(config, parent_pid):
         space=output_tube.queue.space,
         name=output_tube.opt['tube']
     ))
+    return input_tube, output_tube
+
+
+def worker(config, parent_pid, generation=None):
+    """
+    Обрабатывает задачи, пока жив родительский процесс.
+
+    :param generation: общий с родителем счетчик поколений (multiprocessing.Value);
+        когда родитель его увеличивает, обработчик дорабатывает текущую задачу и завершается
+    """
+    input_tube, output_tube = get_tubes(config)
+    load_counter_types(config.EXTRA_COUNTER_TYPES)
 
     parent_proc = '/proc/{}'.format(parent_pid)
+    prefetched = deque()
+    started_generation = generation.value if generation is not None else None
 
     # run while parent is alive
     while os.path.exists(parent_proc):
-        task = input_tube.take(config.QUEUE_TAKE_TIMEOUT)
+        if generation is not None and generation.value != started_generation:
+            logger.info('Config reloaded. exiting')
+            break
+
+        task = take_task(input_tube, prefetched, config.QUEUE_PREFETCH_COUNT, config.QUEUE_TAKE_TIMEOUT)
         if task:
             logger.info(u'Starting task id={}.'.format(task.task_id))
             result = get_redirect_history_from_task(
                 task,
                 config.HTTP_TIMEOUT,
                 config.MAX_REDIRECTS,
-                config.USER_AGENT
+                config.USER_AGENT,
+                config.MAX_BODY_SIZE
             )
-            if result:
-                is_input, data = result
-                if is_input:
-                    input_tube.put(
-                        data,
-                        delay=config.RECHECK_DELAY,
-                        pri=task.meta()['pri']
-                    )
-                else:
-                    output_tube.put(data)
-                logger.debug(u'Task id={} data:{}'.format(task.task_id, data))
-            try:
-                task.ack()
-                logger.info(u'Task id={} done'.format(task.task_id))
-            except DatabaseError as e:
-                logger.info('Task ack fail')
-                logger.exception(e)
+            finish_task(task, result, input_tube, output_tube, config)
     else:
         logger.info('Parent is dead. exiting')
+
+    for task in prefetched:
+        task.release()
+
+    # процесс multiprocessing завершается через os._exit, записи асинхронного лога надо дописать сейчас
+    shutdown_logging()
+
+
+def start_task(checker, task):
+    """
+    Добавляет урл задачи в MultiChecker.
+    """
+    url = to_unicode(task.data['url'], 'ignore')
+    logger.info(u'Task id={} url={} url_id={} is_recheck={}'.format(
+        task.task_id, url, task.data["url_id"], bool(task.data.get('recheck'))
+    ))
+    checker.add(task, url)
+
+
+def multi_worker(config, parent_pid, generation=None):
+    """
+    Обрабатывает до CONCURRENT_CHAINS задач одновременно, пока жив родительский процесс.
+
+    Запросы всех задач выполняются в одном потоке через pycurl.CurlMulti:
+    цепочка редиректов каждой задачи продвигается, как только приходит ответ,
+    задача подтверждается, когда ее цепочка закончена, и на ее место сразу берется новая.
+
+    :param generation: общий с родителем счетчик поколений (multiprocessing.Value);
+        когда родитель его увеличивает, обработчик перестает брать задачи,
+        дорабатывает начатые и завершается
+    """
+    input_tube, output_tube = get_tubes(config)
+    load_counter_types(config.EXTRA_COUNTER_TYPES)
+
+    checker = MultiChecker(
+        config.CONCURRENT_CHAINS,
+        config.HTTP_TIMEOUT,
+        config.MAX_REDIRECTS,
+        config.USER_AGENT,
+        config.MAX_BODY_SIZE
+    )
+    parent_proc = '/proc/{}'.format(parent_pid)
+    started_generation = generation.value if generation is not None else None
+    stopping = False
+    next_poll = 0
+
+    # run while parent is alive
+    while os.path.exists(parent_proc):
+        if not stopping and generation is not None and generation.value != started_generation:
+            logger.info('Config reloaded. finishing {} task(s)'.format(len(checker)))
+            stopping = True
+
+        if stopping and not len(checker):
+            logger.info('Config reloaded. exiting')
+            break
+
+        free = checker.free_count()
+        # пока есть запросы в работе, очередь только опрашивается: ждать надо сеть;
+        # после неполного ответа следующий опрос не раньше чем через QUEUE_TAKE_TIMEOUT
+        if free and not stopping and (not len(checker) or time.time() >= next_poll):
+            take_timeout = NO_WAIT if len(checker) else config.QUEUE_TAKE_TIMEOUT
+            tasks = take_batch(input_tube, free, take_timeout)
+            if len(tasks) < free:
+                next_poll = time.time() + config.QUEUE_TAKE_TIMEOUT
+            for task in tasks:
+                start_task(checker, task)
+
+        for task, chain in checker.perform(config.QUEUE_TAKE_TIMEOUT):
+            log_downloaded(task, chain)
+            result = make_task_result(task, *chain.result())
+            finish_task(task, result, input_tube, output_tube, config)
+    else:
+        logger.info('Parent is dead. exiting')
+
+    for task in checker.drain():
+        task.release()
+
+    # процесс multiprocessing завершается через os._exit, записи асинхронного лога надо дописать сейчас
+    shutdown_logging()
@@ -6,20 +6,38 @@ import json
 import logging
 import os
 import signal
+import socket
 import sys
+import time
 from logging.config import dictConfig
 from threading import current_thread
+from urlparse import urlsplit
 
 import gevent
 from gevent import Greenlet
 from gevent import queue as gevent_queue
 from gevent import sleep
 from gevent.monkey import patch_all
-from gevent.pool import Pool
 import requests
 import tarantool
 import tarantool_queue
 
+from lib.adaptive_limit import AdaptiveLimit
+from lib.circuit_breaker import STATE_CLOSED, CircuitBreaker
+from lib.coalescer import Coalescer
+from lib.fair_lock import FairLock
+from lib.host_scheduler import HostScheduler
+from lib.metrics import Metrics
+from lib.payload import build_body, load_json_encoder
+from lib.queue_ext import TubeSet, ack_batch, bury_batch, lock_connection, release_untaken, take_batch
+from lib.resident_pool import ResidentPool
+from lib.resizable_pool import ResizablePool
+from lib.retry_policy import ACTION_ACK, ACTION_BURY, ACTION_RETRY, RetryPolicy, parse_retry_after
+from lib.session_pool import SessionPool
+from lib.timed_queue import TimedQueue
+from lib.ttr_guard import TtrGuard
+from lib.utils import apply_log_levels, reload_config
+
 SIGNAL_EXIT_CODE_OFFSET = 128
 """Коды выхода рассчитываются как 128 + номер сигнала"""
 
@@ -29,6 +47,36 @@ run_application = True
 exit_code = 0
 """Код возврата приложения"""
 
+reload_requested = False
+"""Флаг, выставляемый по SIGHUP: перечитать конфигурацию"""
+
+config_path = None
+"""Путь к файлу конфигурации"""
+
+RELOADABLE_KEYS = (
+    'WORKER_POOL_SIZE', 'HTTP_CONNECTION_TIMEOUT', 'QUEUE_TAKE_TIMEOUT', 'QUEUE_LONG_POLL_TIMEOUT',
+    'SLEEP', 'SLEEP_ON_FAIL', 'ACK_BATCH_SIZE', 'ACK_LAG_WARNING', 'DRAIN_TIMEOUT', 'WORKERS_SHUTDOWN_TIMEOUT',
+    'HOST_OVERFLOW_DELAY', 'SCHEDULER_MAX_PENDING', 'COALESCE_MAX_PENDING', 'CIRCUIT_BREAKER_RESET_TIMEOUT',
+    'LOGGING',
+)
+"""Настройки, применяемые по SIGHUP без перезапуска приложения"""
+
+INTAKE_POLLING = 'polling'
+INTAKE_EVENT = 'event'
+"""Режимы приема задач: опрос свободных обработчиков со сном или long-poll по освобождению"""
+
+BATCH_ACTIONS = {
+    ACTION_ACK: ack_batch,
+    ACTION_BURY: bury_batch,
+}
+"""Действия над задачами, которые можно выполнять пачкой"""
+
+RESPONSE_CHUNK_SIZE = 8192
+"""Размер порции, которыми читается тело ответа на уведомление, байты"""
+
+RESPONSE_LOG_SIZE = 512
+"""Сколько байт тела ответа с ошибкой попадает в лог"""
+
 logger = logging.getLogger('pusher')
 
 
@@ -41,43 +89,381 @@ def notification_worker(task, task_queue, *args, **kwargs):
     :param task_queue: очередь для обработанных задач
     :type task_queue: gevent.queue.Queue
     :param args:
-    :param kwargs:
+    :param kwargs: параметры запроса; session_pool — пул keep-alive сессий,
+        observers — объекты с методом record(url, elapsed, status_code),
+        которым сообщается результат запроса, retry_policy — политика повторов
+        (без нее любой ответ подтверждает задачу, а ошибка запроса хоронит ее),
+        dumps — JSON-кодировщик данных задач без готового тела,
+        max_response_size — сколько байт ответа дочитывать (см. send_notification)
     """
+    session_pool = kwargs.pop('session_pool', None)
+    observers = kwargs.pop('observers', ())
+    retry_policy = kwargs.pop('retry_policy', None)
+    dumps = kwargs.pop('dumps', json.dumps)
+
     try:
         current_thread().name = "pusher.worker#{task_id}".format(task_id=task.task_id)
 
-        data = task.data.copy()
-
-        url = data.pop('callback_url')
-        data['id'] = task.task_id
+        try:
+            url, body = build_body(task, dumps)
+        except ValueError as exc:
+            logger.exception(exc)
+            task_queue.put((task, ACTION_BURY))
+            return
 
         logger.info('Send data to callback url [{url}].'.format(url=url))
 
-        response = requests.post(
-            url, data=json.dumps(data), *args, **kwargs
+        response = send_notification(url, body, session_pool, observers, RESPONSE_LOG_SIZE, *args, **kwargs)
+
+        put_response_result(task_queue, task, response.status_code, response.headers, retry_policy)
+    except requests.RequestException as exc:
+        logger.exception(exc)
+        put_error_result(task_queue, task, retry_policy)
+
+
+def notification_batch_worker(tasks, task_queue, url, *args, **kwargs):
+    """
+    Обработчик пачки задач с одним урлом: отправляет их уведомления одним запросом.
+
+    Тело запроса — JSON-массив тел уведомлений задач. Если сервер ответил 2xx и JSON-массивом
+    кодов той же длины, каждая задача завершается по своему коду, иначе все задачи
+    завершаются по коду ответа.
+
+    :param tasks: задачи
+    :type tasks: list
+    :param task_queue: очередь для обработанных задач
+    :type task_queue: gevent.queue.Queue
+    :param url: урл уведомления
+    :type url: basestring
+    :param kwargs: параметры запроса, как у notification_worker
+    """
+    session_pool = kwargs.pop('session_pool', None)
+    observers = kwargs.pop('observers', ())
+    retry_policy = kwargs.pop('retry_policy', None)
+    dumps = kwargs.pop('dumps', json.dumps)
+
+    try:
+        current_thread().name = "pusher.batch#{task_id}".format(task_id=tasks[0].task_id)
+
+        bodies = []
+        valid_tasks = []
+        for task in tasks:
+            try:
+                bodies.append(build_body(task, dumps)[1])
+            except ValueError as exc:
+                logger.exception(exc)
+                task_queue.put((task, ACTION_BURY))
+                continue
+            valid_tasks.append(task)
+
+        tasks = valid_tasks
+        if not tasks:
+            return
+
+        body = '[{items}]'.format(items=','.join(bodies))
+
+        logger.info('Send {count} notifications to callback url [{url}].'.format(count=len(tasks), url=url))
+
+        response = send_notification(url, body, session_pool, observers, None, *args, **kwargs)
+
+        for task, status_code in zip(tasks, get_batch_status_codes(response, len(tasks))):
+            put_response_result(task_queue, task, status_code, response.headers, retry_policy)
+    except requests.RequestException as exc:
+        logger.exception(exc)
+        for task in tasks:
+            put_error_result(task_queue, task, retry_policy)
+
+
+def send_notification(url, body, session_pool, observers, keep_size, *args, **kwargs):
+    """
+    Отправляет POST запрос уведомления и сообщает его результат observers.
+
+    Тело ответа читается потоком (см. read_response): в response.content остаются
+    только первые keep_size байт. Начало тела ответа с кодом 4xx или 5xx пишется в лог.
+
+    :param url: урл уведомления
+    :type url: basestring
+    :param body: тело запроса
+    :type body: str
+    :param session_pool: пул keep-alive сессий
+    :type session_pool: SessionPool
+    :param observers: объекты с методом record(url, elapsed, status_code, received)
+    :type observers: list
+    :param keep_size: сколько байт тела ответа сохранить, None — до max_response_size
+    :type keep_size: int
+    :param kwargs: параметры запроса; max_response_size — сколько байт ответа
+        дочитывать, None — без ограничения
+
+    :rtype: requests.Response
+    """
+    max_size = kwargs.pop('max_response_size', None)
+    post = session_pool.get(url).post if session_pool else requests.post
+
+    started_at = time.time()
+    status_code = None
+    received = 0
+    try:
+        response = post(
+            url, data=body, stream=True, *args, **kwargs
         )
+        status_code = response.status_code
+        received, truncated = read_response(response, max_size, max_size if keep_size is None else keep_size)
+    finally:
+        for observer in observers:
+            observer.record(url, time.time() - started_at, status_code, received)
+
+    logger.info('Callback url [{url}] response status code={status_code}.'.format(
+        url=url, status_code=status_code
+    ))
+    if truncated:
+        logger.warning('Callback url [{url}] response is larger than {size} bytes, connection is dropped.'.format(
+            url=url, size=max_size
+        ))
+    if status_code >= 400:
+        logger.info('Callback url [{url}] response body: {body!r}.'.format(
+            url=url, body=response.content[:RESPONSE_LOG_SIZE]
+        ))
+
+    return response
+
+
+def read_response(response, max_size=None, keep_size=None):
+    """
+    Читает тело ответа порциями, сохраняя только его начало.
+
+    Соединение с полностью прочитанным ответом возвращается в пул сессий.
+    Ответ длиннее max_size байт не дочитывается, а его соединение закрывается:
+    в пуле не должно оставаться соединений с недочитанным ответом.
+    Сохраненное начало тела становится response.content.
+
+    :param response: ответ на запрос с stream=True
+    :type response: requests.Response
+    :param max_size: сколько байт читать, None — до конца
+    :type max_size: int
+    :param keep_size: сколько байт сохранить, None — все прочитанные
+    :type keep_size: int
+
+    :return: количество прочитанных байт и признак того, что ответ не дочитан
+    :rtype: tuple
+    """
+    kept = []
+    kept_size = 0
+    received = 0
+    truncated = False
+
+    for chunk in response.iter_content(RESPONSE_CHUNK_SIZE):
+        received += len(chunk)
+        if keep_size is None or kept_size < keep_size:
+            part = chunk if keep_size is None else chunk[:keep_size - kept_size]
+            kept.append(part)
+            kept_size += len(part)
+        if max_size is not None and received > max_size:
+            truncated = True
+            break
+
+    if truncated:
+        connection = getattr(response.raw, '_connection', None)
+        if connection is not None:
+            connection.close()
+    response.close()
+
+    response._content = ''.join(kept)
+    response._content_consumed = True
+    return received, truncated
+
+
+def get_batch_status_codes(response, count):
+    """
+    Коды результата для каждого уведомления пачки.
+
+    :param response: ответ на запрос с пачкой уведомлений
+    :type response: requests.Response
+    :param count: количество уведомлений в пачке
+    :type count: int
+
+    :rtype: list
+    """
+    if 200 <= response.status_code < 300:
+        try:
+            results = response.json()
+        except ValueError:
+            results = None
+
+        if isinstance(results, list) and len(results) == count and all(
+                isinstance(status_code, int) for status_code in results):
+            return results
+
+    return [response.status_code] * count
+
+
+def put_response_result(task_queue, task, status_code, headers, retry_policy):
+    """
+    Ставит в очередь обработанных задач действие по коду ответа.
 
-        logger.info('Callback url [{url}] response status code={status_code}.'.format(
-            url=url, status_code=response.status_code
+    Без retry_policy любой ответ подтверждает задачу.
+    """
+    if retry_policy is None:
+        task_queue.put((task, ACTION_ACK))
+        return
+
+    action_name = retry_policy.classify(status_code)
+    if action_name == ACTION_RETRY:
+        retry_after = parse_retry_after(headers.get('Retry-After'))
+        task_queue.put((task, ACTION_RETRY, {'retry_after': retry_after}))
+    else:
+        task_queue.put((task, action_name))
+
+
+def put_error_result(task_queue, task, retry_policy):
+    """
+    Ставит в очередь обработанных задач действие для неудавшегося запроса.
+
+    Без retry_policy задача хоронится.
+    """
+    if retry_policy is None:
+        task_queue.put((task, ACTION_BURY))
+    else:
+        task_queue.put((task, ACTION_RETRY, {'retry_after': None}))
+
+
+def get_task_attempt(task):
+    """
+    Номер текущей попытки обработки задачи (сколько раз задачу брали из очереди).
+
+    Задачи, возвращенные без обработки через Dispatcher.release, в попытки не входят.
+
+    Для задач из queue.take_batch берется из метаданных, полученных при взятии,
+    для остальных запрашивается queue.meta.
+
+    :rtype: int
+    """
+    taken_meta = getattr(task, 'taken_meta', None)
+    if taken_meta:
+        return taken_meta['ctaken']
+    return task.meta()['ctaken']
+
+
+def get_queue_wait(task):
+    """
+    Сколько задача пробыла в очереди от постановки до взятия, секунды.
+
+    Считается по метаданным, полученным при взятии через queue.take_batch.
+
+    :return: время ожидания или None, если метаданных нет
+    :rtype: float
+    """
+    taken_meta = getattr(task, 'taken_meta', None)
+    if not taken_meta:
+        return None
+    return max(0, taken_meta['now'] - taken_meta['created']) / 1000000.0
+
+
+def resolve_retry(task, retry_after, retry_policy):
+    """
+    Выбирает, вернуть задачу в очередь с задержкой или похоронить ее.
+
+    :param task: задача
+    :type task: tarantool_queue.Task
+    :param retry_after: задержка, запрошенная сервером
+    :type retry_after: float
+    :param retry_policy: политика повторов
+    :type retry_policy: RetryPolicy
+
+    :return: кортеж (имя действия, параметры действия)
+    :rtype: tuple
+    """
+    try:
+        attempt = get_task_attempt(task)
+    except tarantool.DatabaseError as exc:
+        logger.exception(exc)
+        attempt = 1
+
+    if not retry_policy.should_retry(attempt):
+        logger.warning('Task#{task_id} failed {attempt} time(s), bury it.'.format(
+            task_id=task.task_id, attempt=attempt
         ))
+        return ACTION_BURY, {}
 
-        task_queue.put((task, 'ack'))
-    except requests.RequestException as exc:
+    delay = retry_policy.delay(attempt, retry_after)
+    logger.info('Retry task#{task_id} in {delay} second(s), attempt {attempt}.'.format(
+        task_id=task.task_id, delay=delay, attempt=attempt
+    ))
+    return 'release', {'delay': delay}
+
+
+def finish_tasks_batch(action_name, tasks):
+    """
+    Подтверждает или хоронит пачку задач одним запросом к tarantool.queue.
+
+    Ошибки по отдельным задачам логируются и не мешают обработке остальных.
+
+    :param action_name: имя действия (ack или bury)
+    :type action_name: str
+    :param tasks: задачи одной очереди
+    :type tasks: list
+    """
+    logger.debug('{name} {count} task(s) in batch.'.format(
+        name=action_name.capitalize(), count=len(tasks)
+    ))
+
+    for task in tasks:
+        task.modified = True
+
+    try:
+        errors = BATCH_ACTIONS[action_name](tasks[0].queue, [task.task_id for task in tasks])
+    except tarantool.DatabaseError as exc:
         logger.exception(exc)
-        task_queue.put((task, 'bury'))
+        return
+
+    for task_id, message in errors.iteritems():
+        logger.error('Can not {name} task#{task_id}: {message}'.format(
+            name=action_name, task_id=task_id, message=message
+        ))
 
 
-def done_with_processed_tasks(task_queue):
-    """f
+def done_with_processed_tasks(task_queue, batch_size=1, retry_policy=None, metrics=None):
+    """
     Удаляет завешенные задачи.
 
-    :param task_queue: очередь, хранящая кортежи (объект задачи, имя действия)
+    При batch_size > 1 задачи подтверждаются и хоронятся пачками не больше batch_size,
+    неполные пачки отправляются в конце вызова.
+    Задачи с действием retry возвращаются в очередь с задержкой или хоронятся по retry_policy.
+
+    :param task_queue: очередь, хранящая кортежи (объект задачи, имя действия[, параметры действия])
+    :param batch_size: максимальный размер пачки
+    :type batch_size: int
+    :param retry_policy: политика повторов
+    :type retry_policy: RetryPolicy
+    :param metrics: метрики, в которых считаются исходы задач по хостам
+    :type metrics: Metrics
     """
     logger.debug('Send info about finished tasks to queue.')
 
+    batches = {}
+
     for _ in xrange(task_queue.qsize()):
         try:
-            task, action_name = task_queue.get_nowait()
+            item = task_queue.get_nowait()
+            task, action_name = item[:2]
+            params = item[2] if len(item) > 2 else {}
+
+            if action_name == ACTION_RETRY:
+                action_name, params = resolve_retry(task, params.get('retry_after'), retry_policy)
+
+            if metrics is not None:
+                metrics.inc(
+                    'pusher_tasks_finished_total',
+                    host=get_task_host(task),
+                    outcome=ACTION_RETRY if action_name == 'release' else action_name
+                )
+
+            if batch_size > 1 and action_name in BATCH_ACTIONS:
+                batch = batches.setdefault(action_name, [])
+                batch.append(task)
+
+                if len(batch) >= batch_size:
+                    finish_tasks_batch(action_name, batches.pop(action_name))
+                continue
 
             logger.debug('{name} task#{task_id}.'.format(
                 name=action_name.capitalize(),
@@ -85,12 +471,65 @@ def done_with_processed_tasks(task_queue):
             ))
 
             try:
-                getattr(task, action_name)()
+                getattr(task, action_name)(**params)
             except tarantool.DatabaseError as exc:
                 logger.exception(exc)
         except gevent_queue.Empty:
             break
 
+    for action_name, batch in batches.iteritems():
+        finish_tasks_batch(action_name, batch)
+
+
+def run_acker(task_queue, config, retry_policy=None, metrics=None):
+    """
+    Завершает обработанные задачи в tarantool.queue по мере их появления.
+
+    Работает, пока приложение не остановлено. Если завершенные задачи ждут
+    дольше config.ACK_LAG_WARNING секунд, пишет предупреждение.
+
+    :param task_queue: очередь обработанных задач
+    :type task_queue: TimedQueue
+    :param config: конфигурация
+    :type config: Config
+    :param retry_policy: политика повторов
+    :type retry_policy: RetryPolicy
+    :param metrics: метрики
+    :type metrics: Metrics
+    """
+    current_thread().name = 'pusher.acker'
+
+    while run_application:
+        try:
+            task_queue.peek(timeout=config.SLEEP)
+        except gevent_queue.Empty:
+            continue
+
+        done_with_processed_tasks(task_queue, config.ACK_BATCH_SIZE, retry_policy, metrics)
+
+        if task_queue.last_wait > config.ACK_LAG_WARNING:
+            logger.warning('Ack lag is {lag:.2f}s, {count} processed task(s) are waiting.'.format(
+                lag=task_queue.last_wait, count=task_queue.qsize()
+            ))
+
+
+def run_toucher(dispatcher, config):
+    """
+    Продлевает ttr долгих задач, пока приложение не остановлено.
+
+    Сроки проверяются каждые config.TTR_TOUCH_MARGIN / 2 секунд.
+
+    :param dispatcher: диспетчер задач с ttr_guard
+    :type dispatcher: Dispatcher
+    :param config: конфигурация
+    :type config: Config
+    """
+    current_thread().name = 'pusher.toucher'
+
+    while run_application:
+        dispatcher.touch_expiring()
+        sleep(config.TTR_TOUCH_MARGIN / 2.0)
+
 
 def stop_handler(signum):
     """
@@ -110,21 +549,663 @@ def stop_handler(signum):
     exit_code = SIGNAL_EXIT_CODE_OFFSET + signum
 
 
-def main_loop(config):
+def reload_handler(signum):
+    """
+    Обработчик SIGHUP: конфигурация перечитывается в основном цикле.
+
+    :param signum: номер сигнала
+    :type signum: int
+    """
+    global reload_requested
+
+    logger.info('Got signal #{signum}, reload config.'.format(signum=signum))
+
+    reload_requested = True
+
+
+def apply_reload(config, dispatcher=None):
+    """
+    Перечитывает файл конфигурации и применяет изменяемые на ходу настройки.
+
+    Значения из RELOADABLE_KEYS обновляются в config на месте и читаются
+    при следующем использовании; пул обработчиков меняет размер сразу, запущенные
+    обработчики дорабатывают, автомат breaker получает новое время отключения хостов.
+    Если файл не читается, остается старая конфигурация.
+
+    :param config: конфигурация
+    :type config: Config
+    :param dispatcher: диспетчер задач, если пул обработчиков уже создан
+    :type dispatcher: Dispatcher
+
+    :return: словарь измененных ключей и их новых значений
+    :rtype: dict
+    """
+    global reload_requested
+    reload_requested = False
+
+    try:
+        changed = reload_config(config, config_path, RELOADABLE_KEYS)
+    except Exception as exc:
+        logger.exception(exc)
+        return {}
+
+    logger.info('Config reloaded, changed: {keys}.'.format(keys=', '.join(sorted(changed)) or 'nothing'))
+
+    if 'LOGGING' in changed:
+        apply_log_levels(config.LOGGING)
+
+    if dispatcher is not None and 'WORKER_POOL_SIZE' in changed:
+        dispatcher.resize(config.WORKER_POOL_SIZE)
+
+    if dispatcher is not None and dispatcher.breaker is not None and 'CIRCUIT_BREAKER_RESET_TIMEOUT' in changed:
+        dispatcher.breaker.reset_timeout = config.CIRCUIT_BREAKER_RESET_TIMEOUT
+
+    return changed
+
+
+def get_task_host(task):
+    """
+    Хост урла, на который задача отправляет уведомление.
+
+    :rtype: str
+    """
+    return urlsplit(task.data.get('callback_url', '')).netloc
+
+
+class Dispatcher(object):
+    """
+    Раздает взятые из очереди задачи обработчикам пула.
+
+    Если задан планировщик по хостам, задачи сначала попадают в очередь хоста
+    и запускаются по кругу между хостами с учетом лимита запросов на хост.
+    Задачи для хостов, отключенных автоматом breaker, возвращаются в очередь с задержкой.
+    Задачи с урлами из coalescer копятся в пачки и отправляются одним запросом на пачку,
+    минуя очереди хостов.
+    С ttr_guard задачи, которые не успеют обработаться до возврата в очередь по ttr,
+    сразу возвращаются в очередь, а таймаут запроса ограничивается сроком задачи.
+    """
+
+    def __init__(self, worker_pool, task_queue, config, session_pool, scheduler=None, limiter=None,
+                 retry_policy=None, breaker=None, coalescer=None, metrics=None, ttr_guard=None):
+        """
+        :param worker_pool: пул обработчиков
+        :type worker_pool: gevent.pool.Pool
+        :param task_queue: очередь для обработанных задач
+        :type task_queue: gevent.queue.Queue
+        :param config: конфигурация
+        :type config: Config
+        :param session_pool: пул keep-alive сессий
+        :type session_pool: SessionPool
+        :param scheduler: планировщик задач по хостам
+        :type scheduler: HostScheduler
+        :param limiter: адаптивный лимит одновременных запросов
+        :type limiter: AdaptiveLimit
+        :param retry_policy: политика повторов
+        :type retry_policy: RetryPolicy
+        :param breaker: автоматы отключения хостов
+        :type breaker: CircuitBreaker
+        :param coalescer: группировщик задач в пачки по урлу
+        :type coalescer: Coalescer
+        :param metrics: метрики запросов и взятых задач
+        :type metrics: Metrics
+        :param ttr_guard: контроль сроков задач
+        :type ttr_guard: TtrGuard
+        """
+        self.worker_pool = worker_pool
+        self.task_queue = task_queue
+        self.config = config
+        self.session_pool = session_pool
+        self.scheduler = scheduler
+        self.limiter = limiter
+        self.retry_policy = retry_policy
+        self.breaker = breaker
+        self.coalescer = coalescer
+        self.metrics = metrics
+        self.ttr_guard = ttr_guard
+        self.dumps = load_json_encoder(config.JSON_ENCODER)
+        self.observers = [observer for observer in (limiter, breaker, metrics) if observer is not None]
+
+    def resize(self, size):
+        """
+        Меняет размер пула обработчиков и верхнюю границу адаптивного лимита.
+
+        :type size: int
+        """
+        logger.info('Resize worker pool to {size}.'.format(size=size))
+        self.worker_pool.resize(size)
+
+        if self.limiter is not None:
+            self.limiter.max_limit = size
+            self.limiter.limit = min(self.limiter.limit, size)
+
+    def free_workers(self):
+        """
+        Количество обработчиков, которые можно запустить с учетом адаптивного лимита.
+
+        :rtype: int
+        """
+        free = self.worker_pool.free_count()
+        if self.limiter is not None:
+            free = min(free, max(0, self.limiter.limit - len(self.worker_pool)))
+        return free
+
+    def free_count(self):
+        """
+        Количество задач, которое сейчас можно взять из очереди.
+
+        :rtype: int
+        """
+        if self.scheduler is None:
+            count = self.free_workers()
+        else:
+            count = max(0, self.config.SCHEDULER_MAX_PENDING - len(self.scheduler))
+
+        if self.coalescer is not None:
+            count = min(count, max(0, self.config.COALESCE_MAX_PENDING - len(self.coalescer)))
+        return count
+
+    def record_take(self, count):
+        """
+        Учитывает в метриках запрос задач из tarantool.queue.
+
+        :param count: сколько задач получено, 0 — запрос завершился по таймауту
+        :type count: int
+        """
+        if self.metrics is None:
+            return
+
+        if count:
+            self.metrics.inc('pusher_tasks_taken_total', count)
+        else:
+            self.metrics.inc('pusher_take_timeouts_total')
+
+    def wait_available(self):
+        """
+        Ждет освобождения обработчика.
+        """
+        self.worker_pool.wait_available()
+
+    def start(self, task, on_done=None):
+        """
+        Запускает обработчик задачи в пуле.
+
+        :param task: задача
+        :type task: tarantool_queue.Task
+        :param on_done: функция без аргументов, вызываемая после обработки
+        """
+        self.spawn(notification_worker, task, on_done=on_done)
+
+    def spawn(self, run, item, args=(), on_done=None):
+        """
+        Запускает обработчик с параметрами запроса: новый greenlet в пуле
+        или задание для постоянных обработчиков ResidentPool.
+
+        :param run: обработчик
+        :param item: задача или пачка задач
+        :param args: дополнительные позиционные аргументы обработчика
+        :type args: tuple
+        :param on_done: функция без аргументов, вызываемая после обработки
+        """
+        timeout = self.config.HTTP_CONNECTION_TIMEOUT
+        if self.ttr_guard is not None:
+            tasks = item if isinstance(item, list) else [item]
+            timeout = self.ttr_guard.timeout(tasks, timeout)
+            self.ttr_guard.track(tasks)
+            on_done = self.untrack_on_done(tasks, on_done)
+
+        kwargs = {
+            'timeout': timeout,
+            'verify': False,
+            'session_pool': self.session_pool,
+            'observers': self.observers,
+            'retry_policy': self.retry_policy,
+            'dumps': self.dumps,
+            'max_response_size': self.config.RESPONSE_MAX_SIZE,
+        }
+
+        if isinstance(self.worker_pool, ResidentPool):
+            if self.ttr_guard is not None:
+                run = self.check_ttr_on_start(run)
+            self.worker_pool.submit(run, (item, self.task_queue) + args, kwargs, on_done)
+            return
+
+        worker = Greenlet(run, item, self.task_queue, *args, **kwargs)
+        if on_done is not None:
+            worker.link(lambda _: on_done())
+        self.worker_pool.add(worker)
+        worker.start()
+
+    def check_ttr_on_start(self, run):
+        """
+        Задание ResidentPool может ждать в буфере, поэтому сроки задач проверяются
+        заново, когда обработчик берет задание: не успевающие задачи возвращаются в очередь,
+        а таймаут запроса ограничивается оставшимся временем.
+
+        :return: обработчик с проверкой сроков задач
+        """
+        def run_checked(item, task_queue, *args, **kwargs):
+            tasks = item if isinstance(item, list) else [item]
+            # возвращенные в очередь задачи продлевать уже нельзя
+            self.ttr_guard.untrack(tasks)
+            admitted = self.skip_expiring(tasks)
+            if not admitted:
+                return
+
+            self.ttr_guard.track(admitted)
+            kwargs['timeout'] = self.ttr_guard.timeout(admitted, self.config.HTTP_CONNECTION_TIMEOUT)
+            run(admitted if isinstance(item, list) else item, task_queue, *args, **kwargs)
+        return run_checked
+
+    def untrack_on_done(self, tasks, on_done):
+        """
+        :return: on_done, перед которым задачи перестают продлеваться
+        """
+        def done():
+            self.ttr_guard.untrack(tasks)
+            if on_done is not None:
+                on_done()
+        return done
+
+    def release(self, task, delay):
+        """
+        Возвращает необработанную задачу в tarantool.queue с задержкой.
+
+        Взятие не засчитывается в попытки (см. get_task_attempt).
+        """
+        try:
+            release_untaken(task, delay)
+        except tarantool.DatabaseError as exc:
+            logger.exception(exc)
+
+    def skip_expiring(self, tasks):
+        """
+        Возвращает в tarantool.queue без задержки задачи, которые не успеют
+        обработаться до срока (см. TtrGuard.can_finish).
+
+        :param tasks: задачи
+        :type tasks: list
+
+        :return: задачи, которые можно запускать
+        :rtype: list
+        """
+        if self.ttr_guard is None:
+            return tasks
+
+        now = time.time()
+        admitted = []
+        for task in tasks:
+            if self.ttr_guard.can_finish(task, now):
+                admitted.append(task)
+                continue
+
+            logger.info('Task id={task_id} has {left:.1f}s left, release it.'.format(
+                task_id=task.task_id, left=self.ttr_guard.time_left(task, now)
+            ))
+            self.release(task, 0)
+            if self.metrics is not None:
+                self.metrics.inc('pusher_tasks_skipped_total')
+        return admitted
+
+    def touch_expiring(self):
+        """
+        Продлевает ttr запущенных задач, срок которых подходит к концу.
+        """
+        for task in self.ttr_guard.expiring():
+            logger.debug('Touch task id={task_id}.'.format(task_id=task.task_id))
+            try:
+                task.touch()
+            except tarantool.DatabaseError as exc:
+                logger.warning('Can not touch task id={task_id}: {exc}'.format(task_id=task.task_id, exc=exc))
+                self.ttr_guard.untrack([task])
+                continue
+
+            if self.metrics is not None:
+                self.metrics.inc('pusher_task_touches_total')
+
+    def launch(self, task, host=None, on_done=None):
+        """
+        Запускает обработку задачи, если хост не отключен автоматом.
+
+        :param task: задача
+        :type task: tarantool_queue.Task
+        :param host: хост урла задачи, если уже известен
+        :type host: str
+        :param on_done: функция без аргументов, вызываемая после обработки
+
+        :return: False, если задача возвращена в очередь
+        :rtype: bool
+        """
+        if not self.skip_expiring([task]):
+            return False
+
+        if self.breaker is not None:
+            if host is None:
+                host = get_task_host(task)
+
+            if self.reject_open_circuit(host, [task]):
+                return False
+
+        self.start(task, on_done)
+        return True
+
+    def launch_batch(self, url, tasks):
+        """
+        Запускает отправку пачки задач одним запросом, если хост не отключен автоматом.
+
+        :param url: урл уведомления
+        :type url: basestring
+        :param tasks: задачи
+        :type tasks: list
+
+        :return: False, если задачи возвращены в очередь
+        :rtype: bool
+        """
+        tasks = self.skip_expiring(tasks)
+        if not tasks:
+            return False
+
+        if self.breaker is not None and self.reject_open_circuit(urlsplit(url).netloc, tasks):
+            return False
+
+        self.spawn(notification_batch_worker, tasks, (url,))
+        return True
+
+    def reject_open_circuit(self, host, tasks):
+        """
+        Возвращает задачи в очередь, если хост отключен автоматом.
+
+        :return: True, если задачи возвращены в очередь
+        :rtype: bool
+        """
+        if self.breaker.allow(host):
+            return False
+
+        delay = self.breaker.retry_delay(host) or self.config.CIRCUIT_BREAKER_RESET_TIMEOUT
+        for task in tasks:
+            logger.info('Circuit for host [{host}] is open, release task id={task_id} for {delay:.1f}s.'.format(
+                host=host, task_id=task.task_id, delay=delay
+            ))
+            self.release(task, delay)
+        return True
+
+    def dispatch(self, task):
+        """
+        Запускает обработку задачи или ставит ее в очередь хоста.
+
+        Задача, не поместившаяся в очередь своего хоста, возвращается
+        в tarantool.queue с задержкой config.HOST_OVERFLOW_DELAY.
+
+        :param task: задача
+        :type task: tarantool_queue.Task
+        """
+        logger.info('Start worker for task id={task_id}.'.format(task_id=task.task_id))
+
+        if self.metrics is not None:
+            queue_wait = get_queue_wait(task)
+            if queue_wait is not None:
+                self.metrics.observe('pusher_queue_wait_seconds', queue_wait)
+
+        if self.coalescer is not None:
+            url = task.data.get('callback_url')
+            if self.coalescer.accepts(url):
+                self.coalescer.add(url, task)
+                self.run_coalesced()
+                return
+
+        if self.scheduler is None:
+            self.launch(task)
+            return
+
+        host = get_task_host(task)
+
+        if not self.scheduler.push(host, task):
+            logger.info('Host [{host}] queue is full, release task id={task_id}.'.format(
+                host=host, task_id=task.task_id
+            ))
+            self.release(task, self.config.HOST_OVERFLOW_DELAY)
+            return
+
+        self.run_scheduled()
+
+    def run_scheduled(self):
+        """
+        Запускает задачи из очередей хостов, пока есть свободные обработчики.
+        """
+        if self.scheduler is None:
+            return
+
+        while self.free_workers():
+            scheduled = self.scheduler.pop()
+            if scheduled is None:
+                break
+
+            host, task = scheduled
+            if not self.launch(task, host, on_done=lambda host=host: self.scheduler.release(host)):
+                self.scheduler.release(host)
+
+    def run_coalesced(self):
+        """
+        Запускает отправку готовых пачек, пока есть свободные обработчики.
+        """
+        if self.coalescer is None:
+            return
+
+        while self.free_workers():
+            batch = self.coalescer.pop_ready()
+            if batch is None:
+                break
+
+            url, tasks = batch
+            self.launch_batch(url, tasks)
+
+    def pop_unstarted(self):
+        """
+        Забирает взятые задачи, обработка которых еще не начиналась:
+        из очередей хостов, накапливаемых пачек и буфера ResidentPool.
+
+        Для заданий из буфера ResidentPool вызывается их on_done, как после обработки:
+        задачи перестают продлеваться, а место хоста в планировщике освобождается.
+
+        :rtype: list
+        """
+        tasks = []
+        if self.scheduler is not None:
+            tasks.extend(self.scheduler.drain())
+        if self.coalescer is not None:
+            tasks.extend(self.coalescer.drain())
+        if isinstance(self.worker_pool, ResidentPool):
+            for _, args, _, callback in self.worker_pool.drain():
+                item = args[0]
+                tasks.extend(item if isinstance(item, list) else [item])
+                if callback is not None:
+                    callback()
+        return tasks
+
+    def drain(self, timeout):
+        """
+        Завершает работу без повторной доставки задач.
+
+        Не начатые задачи сразу возвращаются в tarantool.queue без задержки,
+        запущенные обработчики дорабатывают не дольше timeout секунд,
+        а их результаты отправляются в tarantool.queue по мере готовности, чтобы
+        обработчики не ждали места в очереди обработанных задач.
+
+        :param timeout: время ожидания обработчиков, секунды
+        :type timeout: float
+
+        :return: True, если все обработчики завершились
+        :rtype: bool
+        """
+        unstarted = self.pop_unstarted()
+        if unstarted:
+            logger.info('Release {count} unstarted task(s).'.format(count=len(unstarted)))
+        for task in unstarted:
+            self.release(task, 0)
+
+        deadline = time.time() + timeout
+        while len(self.worker_pool):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            logger.info('Wait for {count} running worker(s).'.format(count=len(self.worker_pool)))
+            self.finish_processed()
+            if self.ttr_guard is not None:
+                self.touch_expiring()
+            self.worker_pool.join(timeout=min(self.config.SLEEP, remaining))
+
+        self.finish_processed()
+
+        if len(self.worker_pool):
+            logger.warning('{count} worker(s) did not finish in {timeout}s.'.format(
+                count=len(self.worker_pool), timeout=timeout
+            ))
+            return False
+        return True
+
+    def finish_processed(self):
+        """
+        Завершает обработанные задачи в tarantool.queue.
+        """
+        done_with_processed_tasks(self.task_queue, self.config.ACK_BATCH_SIZE, self.retry_policy, self.metrics)
+
+
+def take_tasks_polling(tube, dispatcher, config):
+    """
+    Берет по задаче на каждый свободный обработчик с таймаутом config.QUEUE_TAKE_TIMEOUT.
+
+    При config.QUEUE_TAKE_BATCH задачи для всех свободных обработчиков берутся одним запросом.
+    """
+    free_workers_count = dispatcher.free_count()
+
+    logger.debug('Pool has {count} free workers.'.format(count=free_workers_count))
+
+    if config.QUEUE_TAKE_BATCH:
+        if free_workers_count:
+            tasks = take_batch(tube, free_workers_count, config.QUEUE_TAKE_TIMEOUT)
+            dispatcher.record_take(len(tasks))
+            for task in tasks:
+                dispatcher.dispatch(task)
+        return
+
+    for number in xrange(free_workers_count):
+        logger.debug('Get task from tube for worker#{number}.'.format(number=number))
+
+        task = tube.take(config.QUEUE_TAKE_TIMEOUT)
+        dispatcher.record_take(1 if task else 0)
+
+        if not task:
+            break
+
+        dispatcher.dispatch(task)
+
+
+def take_task_event(tube, dispatcher, config):
+    """
+    Ждет освобождения обработчика и сразу берет для него задачу long-poll запросом.
+
+    Освободившийся greenlet получает следующую задачу без ожидания config.SLEEP,
+    а новая задача в пустой очереди отдается сразу после ее появления.
+    Не дольше config.QUEUE_LONG_POLL_TIMEOUT, чтобы завершенные задачи не ждали подтверждения.
+    При config.QUEUE_TAKE_BATCH одним запросом берутся задачи для всех свободных обработчиков.
+
+    После сигнала остановки задачи не берутся, а пришедшие на уже начатый
+    long-poll запрос возвращаются в очередь.
+    """
+    dispatcher.wait_available()
+    if not run_application:
+        return
+
+    dispatcher.run_scheduled()
+    dispatcher.run_coalesced()
+
+    free_count = dispatcher.free_count()
+    if not free_count:
+        sleep(config.SLEEP)
+        return
+
+    if config.QUEUE_TAKE_BATCH:
+        tasks = take_batch(tube, free_count, config.QUEUE_LONG_POLL_TIMEOUT)
+    else:
+        task = tube.take(config.QUEUE_LONG_POLL_TIMEOUT)
+        tasks = [task] if task else []
+
+    dispatcher.record_take(len(tasks))
+    for task in tasks:
+        if run_application:
+            dispatcher.dispatch(task)
+        else:
+            dispatcher.release(task, 0)
+
+
+def register_gauges(metrics, dispatcher):
+    """
+    Регистрирует в метриках текущее состояние пула обработчиков, очередей и автоматов.
+
+    :param metrics: метрики
+    :type metrics: Metrics
+    :param dispatcher: диспетчер задач
+    :type dispatcher: Dispatcher
+    """
+    processed_task_queue = dispatcher.task_queue
+
+    metrics.gauge('pusher_workers_busy', lambda: len(dispatcher.worker_pool))
+    metrics.gauge('pusher_workers_free', dispatcher.free_workers)
+    metrics.gauge('pusher_processed_queue_size', processed_task_queue.qsize)
+    metrics.gauge('pusher_ack_lag_seconds', processed_task_queue.oldest_wait)
+    metrics.gauge('pusher_ack_lag_max_seconds', processed_task_queue.recent_max_wait)
+
+    if dispatcher.scheduler is not None:
+        metrics.gauge('pusher_scheduler_pending', lambda: len(dispatcher.scheduler))
+
+    if dispatcher.coalescer is not None:
+        metrics.gauge('pusher_coalescer_pending', lambda: len(dispatcher.coalescer))
+
+    if dispatcher.limiter is not None:
+        metrics.gauge('pusher_adaptive_limit', lambda: dispatcher.limiter.limit)
+
+    if dispatcher.breaker is not None:
+        metrics.gauge('pusher_circuits_not_closed', lambda: sum(
+            1 for state in dispatcher.breaker.states().itervalues() if state != STATE_CLOSED
+        ))
+
+
+def main_loop(config, metrics=None):
     """
     Основной цикл приложения.
 
     :param config: конфигурация
     :type config: Config
+    :param metrics: метрики, которые отдает сервер метрик (см. serve_metrics)
+    :type metrics: Metrics
 
     Алгоритм:
      * Открываем соединение с tarantool.queue, использую config.QUEUE_* настройки.
-     * Создаем пул обработчиков.
+       При config.QUEUE_TUBES задачи берутся из нескольких труб пропорционально весам
+       или, при config.QUEUE_TUBES_STRICT_PRIORITY, строго по порядку труб (см. TubeSet).
+     * Создаем пул обработчиков: greenlet на задачу или, при config.RESIDENT_WORKERS,
+       постоянные greenlet с буфером на config.WORKER_BUFFER_SIZE задач.
      * Создаем очередь куда обработчики будут помещать выполненные задачи.
+     * Создаем пул keep-alive сессий, общий для всех обработчиков.
      * Пока количество обработчиков <= config.WORKER_POOL_SIZE, берем задачу из tarantool.queue
-       и запускаем greenlet для ее обработки.
-     * Посылаем уведомления о том, что задачи завершены в tarantool.queue.
-     * Спим config.SLEEP секунд.
+       и запускаем greenlet для ее обработки (см. config.QUEUE_INTAKE_MODE).
+       При config.HOST_CONCURRENCY_LIMIT задачи проходят через очереди хостов,
+       при config.ADAPTIVE_POOL число обработчиков подстраивается под задержку и ошибки ответов.
+     * При config.TTR_MIN_REMAINING не запускаем задачи, которые не успеют обработаться
+       до возврата в очередь по ttr, и ограничиваем таймаут запроса сроком задачи;
+       при config.TTR_TOUCH_MARGIN продлеваем ttr долгих задач отдельным greenlet.
+     * Посылаем уведомления о том, что задачи завершены в tarantool.queue
+       (при config.ACKER_ENABLED — отдельным greenlet, как только задачи обработаны;
+       очередь обработанных задач ограничена config.PROCESSED_QUEUE_SIZE, и заполненная
+       очередь задерживает обработчики, а с ними и прием новых задач).
+     * Запускаем задачи из очередей хостов на освободившихся обработчиках.
+     * Закрываем простаивающие сессии.
+     * Спим config.SLEEP секунд (только в режиме polling).
+     * По SIGHUP перечитываем конфигурацию и меняем размер пула (см. apply_reload).
+     * После сигнала остановки перестаем брать задачи, возвращаем в очередь не начатые,
+       ждем запущенные обработчики не дольше config.DRAIN_TIMEOUT секунд и завершаем
+       обработанные задачи.
+
+    Если метрики переданы, в них учитываются запросы уведомлений и состояние диспетчера.
     """
     logger.info('Connect to queue server on {host}:{port} space #{space}.'.format(
         host=config.QUEUE_HOST, port=config.QUEUE_PORT, space=config.QUEUE_SPACE
@@ -133,52 +1214,144 @@ def main_loop(config):
         host=config.QUEUE_HOST, port=config.QUEUE_PORT, space=config.QUEUE_SPACE
     )
 
-    logger.info('Use tube [{tube}], take timeout={take_timeout}.'.format(
-        tube=config.QUEUE_TUBE,
-        take_timeout=config.QUEUE_TAKE_TIMEOUT
-    ))
+    if config.QUEUE_TUBES:
+        tube = TubeSet(queue, config.QUEUE_TUBES, config.QUEUE_TUBES_STRICT_PRIORITY)
+        logger.info('Use tubes [{tubes}]{strict}, take timeout={take_timeout}.'.format(
+            tubes=', '.join('{}:{}'.format(name, weight) for name, weight in tube.tubes),
+            strict=' by strict priority' if tube.strict_priority else '',
+            take_timeout=config.QUEUE_TAKE_TIMEOUT
+        ))
+    else:
+        logger.info('Use tube [{tube}], take timeout={take_timeout}.'.format(
+            tube=config.QUEUE_TUBE,
+            take_timeout=config.QUEUE_TAKE_TIMEOUT
+        ))
+        tube = queue.tube(config.QUEUE_TUBE)
 
-    tube = queue.tube(config.QUEUE_TUBE)
+    if config.RESIDENT_WORKERS:
+        logger.info('Start {size} resident workers, buffer size={buffer_size}.'.format(
+            size=config.WORKER_POOL_SIZE, buffer_size=config.WORKER_BUFFER_SIZE
+        ))
+        worker_pool = ResidentPool(config.WORKER_POOL_SIZE, config.WORKER_BUFFER_SIZE)
+        worker_pool.start()
+    else:
+        logger.info('Create worker pool[{size}].'.format(size=config.WORKER_POOL_SIZE))
+        worker_pool = ResizablePool(config.WORKER_POOL_SIZE)
 
-    logger.info('Create worker pool[{size}].'.format(size=config.WORKER_POOL_SIZE))
-    worker_pool = Pool(config.WORKER_POOL_SIZE)
+    processed_task_queue = TimedQueue(config.PROCESSED_QUEUE_SIZE or None)
 
-    processed_task_queue = gevent_queue.Queue()
+    acker = None
+    if config.ACKER_ENABLED:
+        logger.info('Start acker, processed queue size={size}.'.format(size=config.PROCESSED_QUEUE_SIZE))
+    if config.ACKER_ENABLED or config.TTR_TOUCH_MARGIN:
+        lock_connection(queue, FairLock())
 
-    logger.info('Run main loop. Worker pool size={count}. Sleep time is {sleep}.'.format(
-        count=config.WORKER_POOL_SIZE, sleep=config.SLEEP
+    logger.info('Create session pool, {size} connection(s) per host, idle timeout={timeout}.'.format(
+        size=config.HTTP_POOL_SIZE, timeout=config.HTTP_POOL_IDLE_TIMEOUT
     ))
+    session_pool = SessionPool(config.HTTP_POOL_SIZE, config.HTTP_POOL_IDLE_TIMEOUT)
 
-    while run_application:
-        free_workers_count = worker_pool.free_count()
+    scheduler = None
+    if config.HOST_CONCURRENCY_LIMIT:
+        logger.info('Limit callback host concurrency to {limit}, host queue size={size}.'.format(
+            limit=config.HOST_CONCURRENCY_LIMIT, size=config.HOST_QUEUE_SIZE
+        ))
+        scheduler = HostScheduler(config.HOST_CONCURRENCY_LIMIT, config.HOST_QUEUE_SIZE)
+
+    limiter = None
+    if config.ADAPTIVE_POOL:
+        logger.info('Adapt concurrency between {min} and {max}, latency target={latency}s.'.format(
+            min=config.ADAPTIVE_POOL_MIN_SIZE, max=config.WORKER_POOL_SIZE,
+            latency=config.ADAPTIVE_LATENCY_TARGET
+        ))
+        limiter = AdaptiveLimit(
+            config.ADAPTIVE_POOL_MIN_SIZE,
+            config.WORKER_POOL_SIZE,
+            config.ADAPTIVE_LATENCY_TARGET,
+            config.ADAPTIVE_MAX_ERROR_RATE
+        )
 
-        logger.debug('Pool has {count} free workers.'.format(count=free_workers_count))
+    retry_policy = None
+    if config.RETRY_MAX_ATTEMPTS:
+        logger.info('Retry failed notifications up to {attempts} time(s), delay {base}..{max}s.'.format(
+            attempts=config.RETRY_MAX_ATTEMPTS, base=config.RETRY_BASE_DELAY, max=config.RETRY_MAX_DELAY
+        ))
+        retry_policy = RetryPolicy(config.RETRY_MAX_ATTEMPTS, config.RETRY_BASE_DELAY, config.RETRY_MAX_DELAY)
+
+    breaker = None
+    if config.CIRCUIT_BREAKER_THRESHOLD:
+        breaker = CircuitBreaker(
+            config.CIRCUIT_BREAKER_THRESHOLD,
+            config.CIRCUIT_BREAKER_RESET_TIMEOUT,
+            config.CIRCUIT_BREAKER_PROBES
+        )
 
-        for number in xrange(free_workers_count):
-            logger.debug('Get task from tube for worker#{number}.'.format(number=number))
+    coalescer = None
+    if config.COALESCE_CALLBACK_URLS:
+        logger.info('Coalesce notifications for {count} callback url(s), window {window}s, up to {size} per request.'.format(
+            count=len(config.COALESCE_CALLBACK_URLS), window=config.COALESCE_WINDOW, size=config.COALESCE_MAX_SIZE
+        ))
+        coalescer = Coalescer(config.COALESCE_CALLBACK_URLS, config.COALESCE_WINDOW, config.COALESCE_MAX_SIZE)
 
-            task = tube.take(config.QUEUE_TAKE_TIMEOUT)
+    ttr_guard = None
+    toucher = None
+    if config.TTR_MIN_REMAINING or config.TTR_TOUCH_MARGIN:
+        logger.info('Skip tasks with less than {min}s left, touch running tasks {margin}s before ttr.'.format(
+            min=config.TTR_MIN_REMAINING, margin=config.TTR_TOUCH_MARGIN
+        ))
+        ttr_guard = TtrGuard(config.TTR_MIN_REMAINING, config.TTR_TOUCH_MARGIN)
 
-            if task:
-                logger.info('Start worker#{number} for task id={task_id}.'.format(
-                    task_id=task.task_id, number=number
-                ))
+    dispatcher = Dispatcher(
+        worker_pool, processed_task_queue, config, session_pool, scheduler, limiter, retry_policy, breaker,
+        coalescer, metrics, ttr_guard
+    )
 
-                worker = Greenlet(
-                    notification_worker,
-                    task,
-                    processed_task_queue,
-                    timeout=config.HTTP_CONNECTION_TIMEOUT,
-                    verify=False
-                )
-                worker_pool.add(worker)
-                worker.start()
+    if metrics is not None:
+        register_gauges(metrics, dispatcher)
 
-        done_with_processed_tasks(processed_task_queue)
+    if config.ACKER_ENABLED:
+        acker = gevent.spawn(run_acker, processed_task_queue, config, retry_policy, metrics)
 
-        sleep(config.SLEEP)
-    else:
-        logger.info('Stop application loop.')
+    if ttr_guard is not None and config.TTR_TOUCH_MARGIN:
+        toucher = gevent.spawn(run_toucher, dispatcher, config)
+
+    logger.info('Run main loop. Worker pool size={count}. Sleep time is {sleep}. Intake mode is {mode}.'.format(
+        count=config.WORKER_POOL_SIZE, sleep=config.SLEEP, mode=config.QUEUE_INTAKE_MODE
+    ))
+
+    try:
+        while run_application:
+            if reload_requested:
+                apply_reload(config, dispatcher)
+
+            if config.QUEUE_INTAKE_MODE == INTAKE_EVENT:
+                take_task_event(tube, dispatcher, config)
+            else:
+                take_tasks_polling(tube, dispatcher, config)
+
+            if acker is None:
+                dispatcher.finish_processed()
+
+            dispatcher.run_scheduled()
+            dispatcher.run_coalesced()
+
+            session_pool.evict_idle()
+
+            if config.QUEUE_INTAKE_MODE != INTAKE_EVENT:
+                sleep(config.SLEEP)
+        else:
+            logger.info('Stop application loop.')
+            if acker is not None:
+                acker.join()
+            dispatcher.drain(config.DRAIN_TIMEOUT)
+            session_pool.close()
+    finally:
+        if acker is not None:
+            acker.kill()
+        if toucher is not None:
+            toucher.kill()
+        if isinstance(worker_pool, ResidentPool):
+            worker_pool.kill()
 
 """ repeate """
 def parse_cmd_args(args):
@@ -213,6 +1386,14 @@ def parse_cmd_args(args):
         dest='pidfile',
         help='Path to pidfile.'
     )
+    parser.add_argument(
+        '-w',
+        '--workers',
+        dest='workers',
+        type=int,
+        default=1,
+        help='Number of worker processes.'
+    )
 
     return parser.parse_args(args=args)
 
@@ -274,12 +1455,16 @@ def load_config_from_pyfile(filepath):
 def install_signal_handlers():
     """
     Устанавливает обработчики системных сигналов.
+
+    SIGTERM, SIGINT и SIGQUIT останавливают приложение, SIGHUP перечитывает конфигурацию.
     """
     logger.info('Install signal handlers.')
 
-    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGHUP, signal.SIGQUIT):
+    for signum in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
         gevent.signal(signum, stop_handler, signum)
 
+    gevent.signal(signal.SIGHUP, reload_handler, signal.SIGHUP)
+
 
 def create_pidfile(pidfile_path):
     pid = str(os.getpid())
@@ -287,15 +1472,237 @@ def create_pidfile(pidfile_path):
         f.write(pid)
 
 
+def serve_metrics(config):
+    """
+    Запускает HTTP-сервер метрик на config.METRICS_HOST:config.METRICS_PORT
+    в том же gevent hub.
+
+    Если порт занять не удалось, приложение работает без метрик.
+
+    :param config: конфигурация
+    :type config: Config
+
+    :return: метрики и запущенный сервер или (None, None)
+    :rtype: tuple
+    """
+    from gevent.pywsgi import WSGIServer
+
+    logger.info('Serve metrics on {host}:{port}.'.format(host=config.METRICS_HOST, port=config.METRICS_PORT))
+    metrics = Metrics()
+    metrics_server = WSGIServer((config.METRICS_HOST, config.METRICS_PORT), metrics.wsgi_app, log=None)
+    try:
+        metrics_server.start()
+    except socket.error as exc:
+        logger.error('Can not serve metrics on {host}:{port}, run without metrics.'.format(
+            host=config.METRICS_HOST, port=config.METRICS_PORT
+        ))
+        logger.exception(exc)
+        return None, None
+    return metrics, metrics_server
+
+
+def run_main_loop(config):
+    """
+    Выполняет основной цикл, пока приложение не остановлено.
+
+    В случае возникновения ошибки в цикле засыпает на config.SLEEP_ON_FAIL секунд.
+    При config.METRICS_PORT сервер метрик запускается один раз, поэтому счетчики
+    не сбрасываются при перезапуске цикла.
+    """
+    metrics, metrics_server = None, None
+    if config.METRICS_PORT:
+        metrics, metrics_server = serve_metrics(config)
+
+    try:
+        while run_application:
+            try:
+                main_loop(config, metrics)
+            except Exception as exc:
+                logger.error(
+                    'Error in main loop. Go to sleep on {} second(s).'.format(config.SLEEP_ON_FAIL)
+                )
+                logger.exception(exc)
+
+                sleep(config.SLEEP_ON_FAIL)
+        else:
+            logger.info('Stop application loop in main.')
+    finally:
+        if metrics_server is not None:
+            metrics_server.stop()
+
+
+def watch_parent(parent_pid, interval):
+    """
+    Останавливает дочерний процесс, если родительский процесс завершился.
+
+    :param parent_pid: pid родительского процесса
+    :type parent_pid: int
+    :param interval: период проверки, секунды
+    :type interval: float
+    """
+    global run_application
+
+    while run_application:
+        if os.getppid() != parent_pid:
+            logger.error('Parent process #{pid} is dead, stop.'.format(pid=parent_pid))
+            run_application = False
+            return
+        sleep(interval)
+
+
+def spawn_child(config, number):
+    """
+    Запускает дочерний процесс с собственным основным циклом.
+
+    Обработчики сигналов наследуются от родителя, соединения с очередью
+    и пул обработчиков создаются в main_loop уже после fork.
+    Метрики процесс отдает на порту config.METRICS_PORT + number.
+
+    :param config: конфигурация
+    :type config: Config
+    :param number: номер дочернего процесса
+    :type number: int
+
+    :return: pid дочернего процесса (в родителе)
+    :rtype: int
+    """
+    parent_pid = os.getpid()
+    pid = os.fork()
+    if pid:
+        return pid
+
+    code = 1
+    try:
+        current_thread().name = 'pusher.main#{number}'.format(number=number)
+        if config.METRICS_PORT:
+            config.METRICS_PORT += number
+        gevent.spawn(watch_parent, parent_pid, config.SLEEP_ON_FAIL)
+        run_main_loop(config)
+        code = exit_code
+    finally:
+        logging.shutdown()
+        os._exit(code)
+
+
+def reap_children(children):
+    """
+    Забирает статусы завершившихся дочерних процессов.
+
+    :param children: словарь pid -> номер дочернего процесса, из него удаляются завершившиеся
+    :type children: dict
+
+    :return: номера завершившихся дочерних процессов
+    :rtype: list
+    """
+    finished = []
+    for pid in children.keys():
+        try:
+            reaped_pid, status = os.waitpid(pid, os.WNOHANG)
+        except OSError as exc:
+            logger.exception(exc)
+            reaped_pid, status = pid, None
+
+        if reaped_pid:
+            number = children.pop(pid)
+            logger.warning('Worker process #{number} (pid={pid}) exited with status {status}.'.format(
+                number=number, pid=pid, status=status
+            ))
+            finished.append(number)
+    return finished
+
+
+def stop_children(children, signum, timeout):
+    """
+    Передает сигнал остановки дочерним процессам и ждет их завершения.
+
+    Процессы, не завершившиеся за timeout секунд, убиваются SIGKILL.
+
+    :param children: словарь pid -> номер дочернего процесса
+    :type children: dict
+    :param signum: номер сигнала
+    :type signum: int
+    :param timeout: время ожидания, секунды
+    :type timeout: float
+    """
+    for pid in children:
+        try:
+            os.kill(pid, signum)
+        except OSError as exc:
+            logger.exception(exc)
+
+    deadline = time.time() + timeout
+    while children and time.time() < deadline:
+        reap_children(children)
+        if children:
+            sleep(0.1)
+
+    for pid in children:
+        logger.error('Worker process pid={pid} did not stop in time, kill it.'.format(pid=pid))
+        try:
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+        except OSError as exc:
+            logger.exception(exc)
+
+
+def run_prefork(config, workers_count):
+    """
+    Запускает workers_count дочерних процессов с основным циклом и следит за ними.
+
+    Завершившийся процесс перезапускается не раньше чем через config.SLEEP_ON_FAIL секунд.
+    Сигнал остановки, полученный родителем, передается дочерним процессам.
+    По SIGHUP родитель перечитывает конфигурацию и передает SIGHUP дочерним процессам.
+
+    :param config: конфигурация
+    :type config: Config
+    :param workers_count: количество дочерних процессов
+    :type workers_count: int
+    """
+    logger.info('Run {count} worker processes.'.format(count=workers_count))
+
+    children = {}
+    restart_at = dict.fromkeys(xrange(workers_count), 0)
+
+    while run_application:
+        now = time.time()
+        for number, start_time in restart_at.items():
+            if start_time <= now:
+                pid = spawn_child(config, number)
+                logger.info('Started worker process #{number} (pid={pid}).'.format(number=number, pid=pid))
+                children[pid] = number
+                del restart_at[number]
+
+        for number in reap_children(children):
+            restart_at[number] = now + config.SLEEP_ON_FAIL
+
+        if reload_requested:
+            apply_reload(config)
+            for pid in children:
+                try:
+                    os.kill(pid, signal.SIGHUP)
+                except OSError as exc:
+                    logger.exception(exc)
+
+        sleep(config.SLEEP)
+
+    signum = exit_code - SIGNAL_EXIT_CODE_OFFSET if exit_code else signal.SIGTERM
+    stop_children(children, signum, config.WORKERS_SHUTDOWN_TIMEOUT)
+    logger.info('Stop application loop in main.')
+
+
 def main(argv):
     """
     Точка входа в приложение.
 
     В случае возникновения ошибки в приложении, оно засыпает на config.SLEEP_ON_FAIL секунд.
+    С --workers N основной цикл выполняется в N дочерних процессах, а процесс
+    приложения следит за ними.
 
     :param argv: агрументы командной строки.
     :type argv: list
     """
+    global config_path
+
     args = parse_cmd_args(argv[1:])
 
     if args.daemon:
@@ -304,9 +1711,8 @@ def main(argv):
     if args.pidfile:
         create_pidfile(args.pidfile)
 
-    config = load_config_from_pyfile(
-        os.path.realpath(os.path.expanduser(args.config))
-    )
+    config_path = os.path.realpath(os.path.expanduser(args.config))
+    config = load_config_from_pyfile(config_path)
 
     patch_all()
 
@@ -316,18 +1722,10 @@ def main(argv):
 
     install_signal_handlers()
 
-    while run_application:
-        try:
-            main_loop(config)
-        except Exception as exc:
-            logger.error(
-                'Error in main loop. Go to sleep on {} second(s).'.format(config.SLEEP_ON_FAIL)
-            )
-            logger.exception(exc)
-
-            sleep(config.SLEEP_ON_FAIL)
+    if args.workers > 1:
+        run_prefork(config, args.workers)
     else:
-        logger.info('Stop application loop in main.')
+        run_main_loop(config)
 
     return exit_code
 
@@ -2,26 +2,106 @@
 # coding: utf-8
 import logging
 import os
+import signal
 import sys
 from logging.config import dictConfig
-from multiprocessing import active_children
+from multiprocessing import Value, active_children
 from time import sleep
 
-from lib.utils import (check_network_status, create_pidfile, daemonize,
-                       load_config_from_pyfile, parse_cmd_args, spawn_workers)
-from lib.worker import worker
+from lib.utils import (apply_log_levels, check_network_status, create_pidfile, daemonize,
+                       load_config_from_pyfile, parse_cmd_args, reload_config, spawn_workers)
+from lib.worker import multi_worker, worker
 
 logger = logging.getLogger('redirect_checker')
 
 run_checker = True
 
+reload_requested = False
+"""Флаг, выставляемый по SIGHUP: перечитать конфигурацию и перезапустить обработчиков"""
+
+config_path = None
+"""Путь к файлу конфигурации"""
+
+RELOADABLE_KEYS = (
+    'WORKER_POOL_SIZE', 'QUEUE_TAKE_TIMEOUT', 'QUEUE_PREFETCH_COUNT', 'CONCURRENT_CHAINS', 'SLEEP',
+    'HTTP_TIMEOUT', 'MAX_REDIRECTS', 'MAX_BODY_SIZE', 'RECHECK_DELAY', 'USER_AGENT', 'CHECK_URL',
+    'EXTRA_COUNTER_TYPES', 'LOGGING',
+)
+"""Настройки, применяемые по SIGHUP без перезапуска приложения"""
+
+
+def reload_handler(signum, frame):
+    global reload_requested
+    reload_requested = True
+
+
+def install_signal_handlers():
+    """
+    По SIGHUP перечитывается конфигурация.
+
+    Прерванные сигналом системные вызовы перезапускаются, чтобы SIGHUP
+    не обрывал запросы обработчиков, унаследовавших обработчик сигнала.
+    """
+    signal.signal(signal.SIGHUP, reload_handler)
+    signal.siginterrupt(signal.SIGHUP, False)
+
+
+def get_worker_target(config):
+    """
+    :return: функция обработчика: по одному урлу или CONCURRENT_CHAINS урлов одновременно
+    """
+    return multi_worker if config.CONCURRENT_CHAINS else worker
+
+
+def reload_workers(config, generation, parent_pid):
+    """
+    Перечитывает конфигурацию и заменяет обработчиков новыми.
+
+    Старые обработчики дорабатывают начатые задачи и завершаются,
+    новые запускаются сразу, поэтому задачи в работе не теряются.
+    Если файл конфигурации не читается, продолжаем работать со старой.
+
+    :param config: конфигурация, изменяется на месте
+    :param generation: счетчик поколений обработчиков
+    :type generation: multiprocessing.Value
+    :param parent_pid: pid основного процесса
+    :type parent_pid: int
+    """
+    global reload_requested
+    reload_requested = False
+
+    try:
+        changed = reload_config(config, config_path, RELOADABLE_KEYS)
+    except Exception as exc:
+        logger.exception(exc)
+        return
+
+    logger.info(u'Config reloaded, changed: {}. Restarting workers.'.format(', '.join(sorted(changed)) or 'nothing'))
+
+    if 'LOGGING' in changed:
+        apply_log_levels(config.LOGGING)
+
+    generation.value += 1
+    spawn_workers(
+        num=config.WORKER_POOL_SIZE,
+        target=get_worker_target(config),
+        args=(config,),
+        parent_pid=parent_pid,
+        generation=generation
+    )
+
+
 def main_loop(config):
     logger.info(
         u'Run main loop. Worker pool size={}. Sleep time is {}.'.format(
             config.WORKER_POOL_SIZE, config.SLEEP
         ))
     parent_pid = os.getpid()
+    generation = Value('i', 0, lock=False)
     while run_checker:
+        if reload_requested:
+            reload_workers(config, generation, parent_pid)
+
         if check_network_status(config.CHECK_URL, config.HTTP_TIMEOUT):
             required_workers_count = config.WORKER_POOL_SIZE - len(
                 active_children())
@@ -30,9 +110,10 @@ def main_loop(config):
                     'Spawning {} workers'.format(required_workers_count))
                 spawn_workers(
                     num=required_workers_count,
-                    target=worker,
+                    target=get_worker_target(config),
                     args=(config,),
-                    parent_pid=parent_pid
+                    parent_pid=parent_pid,
+                    generation=generation
                 )
         else:
             logger.critical('Network is down. stopping workers')
@@ -43,6 +124,8 @@ def main_loop(config):
 
 
 def main(argv):
+    global config_path
+
     args = parse_cmd_args(argv[1:])
 
     if args.daemon:
@@ -51,10 +134,10 @@ def main(argv):
     if args.pidfile:
         create_pidfile(args.pidfile)
 
-    config = load_config_from_pyfile(
-        os.path.realpath(os.path.expanduser(args.config))
-    )
+    config_path = os.path.realpath(os.path.expanduser(args.config))
+    config = load_config_from_pyfile(config_path)
     dictConfig(config.LOGGING)
+    install_signal_handlers()
     main_loop(config)
 
     return config.EXIT_CODE
@@ -7,6 +7,9 @@ from source import lib
 
 
 class LibInitTestCase(unittest.TestCase):
+    def setUp(self):
+        lib.curl_pool.clear()
+
     #to_unicode(val, errors='strict')
         #positive_tests
     def test_to_unicode_isinstance(self):
@@ -46,40 +49,25 @@ class LibInitTestCase(unittest.TestCase):
         content = "not meta"
         url = 'url'
 
-        with mock.patch('source.lib.BeautifulSoup.find', mock.Mock(return_value=None)):
-            self.assertEquals(None, lib.check_for_meta(content, url))
+        self.assertEquals(None, lib.check_for_meta(content, url))
 
     def test_check_for_meta_not_content(self):
-        content = "meta: not content"
+        content = '<meta http-equiv="refresh">'
         url = 'url'
-        result = mock.MagicMock()
 
-        with mock.patch('source.lib.BeautifulSoup.find', mock.Mock(return_value=result)):
-            self.assertEquals(None, lib.check_for_meta(content, url))
+        self.assertEquals(None, lib.check_for_meta(content, url))
 
     def test_check_for_meta_not_http_equiv(self):
-        content = "meta: name = refresh content=content"
+        content = '<meta name="refresh" content="0; url=http://redirect-url.ru">'
         url = 'url'
-        result = mock.MagicMock()
-        result.attrs = {
-            'content': 'content',
-            'name': 'refresh',
-        }
 
-        with mock.patch('source.lib.BeautifulSoup.find', mock.Mock(return_value=result)):
-            self.assertEquals(None, lib.check_for_meta(content, url))
+        self.assertEquals(None, lib.check_for_meta(content, url))
 
     def test_check_for_meta_not_refresh(self):
-        content = "meta: http-equiv=Content-Type content=content"
+        content = '<meta http-equiv="Content-Type" content="0; url=http://redirect-url.ru">'
         url = 'url'
-        result = mock.MagicMock()
-        result.attrs = {
-            'content': 'content',
-            'http-equiv': 'Content-Type',
-        }
 
-        with mock.patch('source.lib.BeautifulSoup.find', mock.Mock(return_value=result)):
-            self.assertEquals(None, lib.check_for_meta(content, url))
+        self.assertEquals(None, lib.check_for_meta(content, url))
 
     def test_check_for_meta_len_splitted_not_equals_2(self):
         content = '<meta http-equiv="ReFresh" content="content">'
@@ -176,6 +164,39 @@ class LibInitTestCase(unittest.TestCase):
             with mock.patch('pycurl.Curl', mock.Mock(return_value=curl)):
                 self.assertEquals((content, None), lib.make_pycurl_request(url, timeout, useragent))
 
+    def test_make_pycurl_request_reuses_handle(self):
+        curl = mock.MagicMock()
+        curl.getinfo = mock.Mock(return_value=None)
+        with mock.patch('pycurl.Curl', mock.Mock(return_value=curl)) as Curl:
+            lib.make_pycurl_request('http://url.ru', 30)
+            lib.make_pycurl_request('http://url.ru/next', 30)
+        self.assertEqual(1, Curl.call_count)
+        self.assertEqual(2, curl.reset.call_count)
+        self.assertFalse(curl.close.called)
+
+    def test_make_pycurl_request_releases_handle_on_error(self):
+        curl = mock.MagicMock()
+        curl.perform = mock.Mock(side_effect=lib.pycurl.error(7, 'Failed to connect'))
+        with mock.patch('pycurl.Curl', mock.Mock(return_value=curl)):
+            self.assertRaises(lib.pycurl.error, lib.make_pycurl_request, 'http://url.ru', 30)
+        self.assertEqual([curl], lib.curl_pool.idle)
+
+    def test_make_pycurl_request_aborted_by_body(self):
+        body = lib.BodyBuffer(lib.StringIO(), max_size=3)
+        curl = mock.MagicMock()
+        curl.getinfo = mock.Mock(side_effect=lambda info: {
+            curl.REDIRECT_URL: None, curl.EFFECTIVE_URL: 'http://url.ru/a/b'
+        }[info])
+
+        def perform():
+            body.header('HTTP/1.1 302 Found\r\n')
+            body.header('Location: c\r\n')
+            body.write('abcdef')
+            raise lib.pycurl.error(23, 'Failed writing body')
+        curl.perform = perform
+        with mock.patch('pycurl.Curl', mock.Mock(return_value=curl)):
+            self.assertEquals(('abc', u'http://url.ru/a/c'), lib.make_pycurl_request('http://url.ru/a/b', 30, body=body))
+
     #get_url(url, timeout, user_agent=None)
         #positive_tests
     def test_get_url_not_redirect(self):
@@ -343,6 +364,41 @@ class LibInitTestCase(unittest.TestCase):
         self.assertEquals([url, redirect_url, redirect_url], history_urls)
         self.assertEquals(counters, return_counters)
 
+    #RedirectChain(url, max_redirects=30)
+    def test_redirect_chain_advances_hop_by_hop(self):
+        chain = lib.RedirectChain('http://url.ru')
+        self.assertFalse(chain.finished)
+        chain.add_hop('http://redirect-url.ru', 'http_status', None)
+        self.assertEquals('http://redirect-url.ru', chain.url)
+        self.assertFalse(chain.finished)
+        chain.add_hop(None, None, 'content')
+        self.assertTrue(chain.finished)
+        with mock.patch('source.lib.get_counters', mock.Mock(return_value=['counter'])):
+            self.assertEquals(
+                (['http_status'], ['http://url.ru', 'http://redirect-url.ru'], ['counter']), chain.result()
+            )
+
+    def test_redirect_chain_ok_url_is_finished(self):
+        chain = lib.RedirectChain('http://www.odnoklassniki.ru/')
+        self.assertTrue(chain.finished)
+        self.assertEquals(([], ['http://www.odnoklassniki.ru/'], []), chain.result())
+
+    def test_redirect_chain_max_redirects(self):
+        chain = lib.RedirectChain('http://url.ru', max_redirects=2)
+        chain.add_hop('http://url.ru/1', 'http_status', None)
+        self.assertFalse(chain.finished)
+        chain.add_hop('http://url.ru/2', 'http_status', None)
+        self.assertTrue(chain.finished)
+
+    def test_get_redirect_chain_counts_received_bytes(self):
+        def get_url(url, timeout, user_agent, body):
+            body.received = 10
+            return (None, None, 'content') if url == 'http://url.ru/next' else ('http://url.ru/next', 'http_status', '')
+        with mock.patch('source.lib.get_url', mock.Mock(side_effect=get_url)) as get_url_mock:
+            chain = lib.get_redirect_chain('http://url.ru', 30, max_body_size=100)
+        self.assertEquals(20, chain.received)
+        self.assertEquals(100, get_url_mock.call_args[1]['body'].max_size)
+
     #prepare_url(url)
         #positive_tests
     def test_prepare_url_none(self):
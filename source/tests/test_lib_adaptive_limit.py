@@ -0,0 +1,51 @@
+import unittest
+import mock
+from source.lib.adaptive_limit import AdaptiveLimit
+
+
+class LibAdaptiveLimitTestCase(unittest.TestCase):
+    def get_limit(self):
+        return AdaptiveLimit(min_limit=2, max_limit=4, latency_target=1.0, max_error_rate=0.1)
+
+    def test_starts_from_min_limit(self):
+        self.assertEqual(2, self.get_limit().limit)
+
+    def test_grows_additively_up_to_max(self):
+        limit = self.get_limit()
+        for _ in xrange(20):
+            limit.record('url', 0.1, 200)
+        self.assertEqual(4, limit.limit)
+
+    def test_window_equals_limit(self):
+        limit = self.get_limit()
+        limit.record('url', 0.1, 200)
+        self.assertEqual(2, limit.limit)
+        limit.record('url', 0.1, 200)
+        self.assertEqual(3, limit.limit)
+        self.assertEqual(0, limit.samples)
+
+    def test_shrinks_on_latency(self):
+        limit = self.get_limit()
+        limit.limit = 4
+        for _ in xrange(4):
+            limit.record('url', 2.0, 200)
+        self.assertEqual(3, limit.limit)
+
+    def test_shrinks_on_errors_but_not_below_min(self):
+        limit = self.get_limit()
+        for status_code in (None, 503, 429, None, 500, None):
+            limit.record('url', 0.1, status_code)
+        self.assertEqual(2, limit.limit)
+
+    def test_client_errors_are_not_failures(self):
+        limit = self.get_limit()
+        limit.record('url', 0.1, 404)
+        limit.record('url', 0.1, 400)
+        self.assertEqual(3, limit.limit)
+
+    def test_adjust_without_samples(self):
+        limit = self.get_limit()
+        with mock.patch('source.lib.adaptive_limit.logger', mock.Mock()) as logger:
+            limit.adjust()
+        self.assertEqual(2, limit.limit)
+        self.assertFalse(logger.info.called)
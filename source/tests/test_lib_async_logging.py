@@ -0,0 +1,102 @@
+# coding: utf-8
+import logging
+import unittest
+import mock
+from StringIO import StringIO
+from source.lib.async_logging import AsyncStreamHandler, SamplingFilter, SamplingRule
+from source.lib.utils import load_config_from_pyfile
+
+
+def make_record(msg, level=logging.INFO):
+    return logging.makeLogRecord({'msg': msg, 'levelno': level, 'levelname': logging.getLevelName(level)})
+
+
+class LibAsyncLoggingTestCase(unittest.TestCase):
+    def get_handler(self, buffer_size=10):
+        stream = StringIO()
+        handler = AsyncStreamHandler(stream, buffer_size=buffer_size)
+        return handler, stream
+
+    def test_emit_only_buffers_and_starts_writer_once(self):
+        handler, stream = self.get_handler()
+        with mock.patch('source.lib.async_logging._start_new_thread', mock.Mock()) as start_new_thread:
+            handler.emit(make_record('first'))
+            handler.emit(make_record('second'))
+        start_new_thread.assert_called_once_with(handler._run, (handler.pid,))
+        self.assertEqual('', stream.getvalue())
+        handler.flush()
+        self.assertEqual(u'first\nsecond\n', stream.getvalue())
+
+    def test_writer_restarts_after_fork(self):
+        handler, stream = self.get_handler()
+        with mock.patch('source.lib.async_logging._start_new_thread', mock.Mock()) as start_new_thread:
+            with mock.patch('source.lib.async_logging.os.getpid', mock.Mock(return_value=1)):
+                handler.emit(make_record('parent'))
+            with mock.patch('source.lib.async_logging.os.getpid', mock.Mock(return_value=2)):
+                handler.emit(make_record('child'))
+        self.assertEqual(2, start_new_thread.call_count)
+        handler.flush()
+        self.assertEqual(u'child\n', stream.getvalue())
+
+    def test_full_buffer_drops_records(self):
+        handler, stream = self.get_handler(buffer_size=2)
+        with mock.patch('source.lib.async_logging._start_new_thread', mock.Mock()):
+            for number in xrange(5):
+                handler.emit(make_record('record {}'.format(number)))
+        handler.flush()
+        self.assertEqual(
+            u'record 0\nrecord 1\n3 log record(s) dropped, buffer is full.\n', stream.getvalue()
+        )
+
+    def test_closed_handler_writes_synchronously(self):
+        handler, stream = self.get_handler()
+        handler.close()
+        handler.emit(make_record('late'))
+        self.assertEqual(u'late\n', stream.getvalue())
+
+    def test_writes_utf8_str_and_unicode(self):
+        handler, stream = self.get_handler()
+        handler.write_records([make_record('\xd1\x84'), make_record(u'ф')])
+        self.assertEqual(u'ф\nф\n', stream.getvalue())
+
+    def test_writer_stops_when_closed(self):
+        handler, stream = self.get_handler()
+        handler.pid = 1
+        handler.buffer.append(make_record('queued'))
+
+        def close(interval):
+            handler.closed = True
+
+        with mock.patch('source.lib.async_logging._sleep', mock.Mock(side_effect=close)):
+            handler._run(1)
+        self.assertEqual(u'queued\n', stream.getvalue())
+
+    def test_sampling_rule_every(self):
+        rule = SamplingRule('x', every=3)
+        self.assertEqual([False, False, True, False, False, True], [rule.allow() for _ in xrange(6)])
+
+    def test_sampling_rule_per_second(self):
+        rule = SamplingRule('x', per_second=2)
+        with mock.patch('source.lib.async_logging.time.time', mock.Mock(return_value=100)):
+            self.assertEqual([True, True, False], [rule.allow() for _ in xrange(3)])
+        with mock.patch('source.lib.async_logging.time.time', mock.Mock(return_value=101)):
+            self.assertTrue(rule.allow())
+
+    def test_sampling_filter_applies_first_matching_rule(self):
+        sampling_filter = SamplingFilter([{'match': 'Task id=', 'every': 2}, {'match': 'Task', 'every': 100}])
+        self.assertEqual(
+            [False, True], [sampling_filter.filter(make_record('Task id=1 done')) for _ in xrange(2)]
+        )
+        self.assertTrue(sampling_filter.filter(make_record('Other message')))
+
+    def test_pusher_config_samples_only_status_lines(self):
+        config = load_config_from_pyfile('source/config/pusher_config.py')
+        sampling_filter = SamplingFilter(config.LOGGING['filters']['per_task']['rules'])
+        rule = sampling_filter.rules[0]
+        self.assertTrue(rule.matches('Callback url [http://a.ru/?x=[1]] response status code=200.'))
+        self.assertFalse(rule.matches("Callback url [http://a.ru/] response body: 'error'."))
+
+    def test_sampling_filter_keeps_warnings(self):
+        sampling_filter = SamplingFilter([{'match': 'Task', 'every': 100}], level='WARNING')
+        self.assertTrue(sampling_filter.filter(make_record('Task failed', logging.WARNING)))
+        self.assertFalse(sampling_filter.filter(make_record('Task done')))
@@ -0,0 +1,59 @@
+import unittest
+from StringIO import StringIO
+from source.lib.body_buffer import BodyBuffer, is_html
+
+
+class LibBodyBufferTestCase(unittest.TestCase):
+    def test_is_html(self):
+        self.assertTrue(is_html(None))
+        self.assertTrue(is_html('text/html; charset=utf-8'))
+        self.assertTrue(is_html('Application/XHTML+xml'))
+        self.assertFalse(is_html('application/octet-stream'))
+        self.assertFalse(is_html('image/png'))
+
+    def test_writes_whole_body_without_limit(self):
+        body = BodyBuffer(StringIO())
+        self.assertIsNone(body.write('abc'))
+        self.assertIsNone(body.write('def'))
+        self.assertEqual('abcdef', body.getvalue())
+        self.assertEqual(6, body.received)
+        self.assertFalse(body.aborted)
+
+    def test_truncates_and_aborts_at_max_size(self):
+        body = BodyBuffer(StringIO(), max_size=4)
+        self.assertIsNone(body.write('abc'))
+        self.assertEqual(0, body.write('def'))
+        self.assertEqual('abcd', body.getvalue())
+        self.assertEqual(6, body.received)
+        self.assertTrue(body.truncated)
+        self.assertTrue(body.aborted)
+
+    def test_body_of_max_size_is_not_truncated(self):
+        body = BodyBuffer(StringIO(), max_size=3)
+        self.assertIsNone(body.write('abc'))
+        self.assertFalse(body.aborted)
+
+    def test_skips_non_html(self):
+        body = BodyBuffer(StringIO())
+        body.header('HTTP/1.1 200 OK\r\n')
+        body.header('Content-Type: application/octet-stream\r\n')
+        self.assertEqual(0, body.write('\0' * 10))
+        self.assertEqual('', body.getvalue())
+        self.assertEqual(10, body.received)
+        self.assertTrue(body.skipped)
+
+    def test_new_response_resets_headers(self):
+        body = BodyBuffer(StringIO())
+        body.header('HTTP/1.1 100 Continue\r\n')
+        body.header('Content-Type: image/png\r\n')
+        body.header('HTTP/1.1 200 OK\r\n')
+        self.assertIsNone(body.write('<html>'))
+
+    def test_location_of_redirect(self):
+        body = BodyBuffer(StringIO())
+        body.header('HTTP/1.1 302 Found\r\n')
+        body.header('Location: /next\r\n')
+        self.assertEqual('/next', body.location)
+        body.header('HTTP/1.1 200 OK\r\n')
+        body.header('Location: /ignored\r\n')
+        self.assertIsNone(body.location)
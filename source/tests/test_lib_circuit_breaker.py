@@ -0,0 +1,81 @@
+import unittest
+import mock
+from source.lib import circuit_breaker
+from source.lib.circuit_breaker import CircuitBreaker
+
+
+class LibCircuitBreakerTestCase(unittest.TestCase):
+    def get_breaker(self):
+        return CircuitBreaker(failure_threshold=2, reset_timeout=10, probe_count=1)
+
+    def open_host(self, breaker):
+        breaker.record('http://down.ru/a', 1.0, None)
+        breaker.record('http://down.ru/b', 1.0, 503)
+
+    def test_closed_by_default(self):
+        breaker = self.get_breaker()
+        self.assertTrue(breaker.allow('down.ru'))
+        self.assertEqual(0, breaker.retry_delay('down.ru'))
+        self.assertEqual({}, breaker.states())
+
+    def test_opens_after_threshold(self):
+        breaker = self.get_breaker()
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=100)):
+            breaker.record('http://down.ru/a', 1.0, 500)
+            self.assertTrue(breaker.allow('down.ru'))
+            breaker.record('http://down.ru/b', 1.0, 429)
+            self.assertFalse(breaker.allow('down.ru'))
+        self.assertEqual({'down.ru': circuit_breaker.STATE_OPEN}, breaker.states())
+        self.assertTrue(breaker.allow('up.ru'))
+
+    def test_success_resets_failures(self):
+        breaker = self.get_breaker()
+        breaker.record('http://down.ru/a', 1.0, None)
+        breaker.record('http://down.ru/a', 1.0, 404)
+        breaker.record('http://down.ru/a', 1.0, None)
+        self.assertTrue(breaker.allow('down.ru'))
+
+    def test_retry_delay_while_open(self):
+        breaker = self.get_breaker()
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=100)):
+            self.open_host(breaker)
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=104)):
+            self.assertEqual(6, breaker.retry_delay('down.ru'))
+
+    def test_half_open_allows_limited_probes(self):
+        breaker = self.get_breaker()
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=100)):
+            self.open_host(breaker)
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=110)):
+            self.assertTrue(breaker.allow('down.ru'))
+            self.assertFalse(breaker.allow('down.ru'))
+        self.assertEqual({'down.ru': circuit_breaker.STATE_HALF_OPEN}, breaker.states())
+
+    def test_probe_success_closes(self):
+        breaker = self.get_breaker()
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=100)):
+            self.open_host(breaker)
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=110)):
+            breaker.allow('down.ru')
+            breaker.record('http://down.ru/a', 0.1, 200)
+            self.assertTrue(breaker.allow('down.ru'))
+        self.assertEqual({}, breaker.states())
+
+    def test_probe_failure_reopens(self):
+        breaker = self.get_breaker()
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=100)):
+            self.open_host(breaker)
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=110)):
+            breaker.allow('down.ru')
+            breaker.record('http://down.ru/a', 0.1, None)
+            self.assertFalse(breaker.allow('down.ru'))
+            self.assertEqual(10, breaker.retry_delay('down.ru'))
+
+    def test_lost_probe_is_replaced_after_reset_timeout(self):
+        breaker = self.get_breaker()
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=100)):
+            self.open_host(breaker)
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=110)):
+            self.assertTrue(breaker.allow('down.ru'))
+        with mock.patch('source.lib.circuit_breaker.time.time', mock.Mock(return_value=120)):
+            self.assertTrue(breaker.allow('down.ru'))
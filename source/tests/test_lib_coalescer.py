@@ -0,0 +1,46 @@
+import unittest
+import mock
+from source.lib.coalescer import Coalescer
+
+
+class LibCoalescerTestCase(unittest.TestCase):
+    def get_coalescer(self):
+        return Coalescer(['http://a.ru/', 'http://b.ru/'], window=1, max_size=2)
+
+    def test_accepts_only_configured_urls(self):
+        coalescer = self.get_coalescer()
+        self.assertTrue(coalescer.accepts('http://a.ru/'))
+        self.assertFalse(coalescer.accepts('http://c.ru/'))
+
+    def test_batch_is_not_ready_within_window(self):
+        coalescer = self.get_coalescer()
+        with mock.patch('source.lib.coalescer.time.time', mock.Mock(return_value=100)):
+            coalescer.add('http://a.ru/', 1)
+            self.assertIsNone(coalescer.pop_ready())
+        self.assertEqual(1, len(coalescer))
+
+    def test_batch_is_ready_after_window(self):
+        coalescer = self.get_coalescer()
+        with mock.patch('source.lib.coalescer.time.time', mock.Mock(return_value=100)):
+            coalescer.add('http://a.ru/', 1)
+        with mock.patch('source.lib.coalescer.time.time', mock.Mock(return_value=101)):
+            self.assertEqual(('http://a.ru/', [1]), coalescer.pop_ready())
+            self.assertIsNone(coalescer.pop_ready())
+        self.assertEqual(0, len(coalescer))
+
+    def test_full_batch_is_ready_at_once_and_rest_waits(self):
+        coalescer = self.get_coalescer()
+        with mock.patch('source.lib.coalescer.time.time', mock.Mock(return_value=100)):
+            for item in xrange(3):
+                coalescer.add('http://b.ru/', item)
+            self.assertEqual(('http://b.ru/', [0, 1]), coalescer.pop_ready())
+            self.assertIsNone(coalescer.pop_ready())
+        self.assertEqual(1, len(coalescer))
+
+    def test_drain(self):
+        coalescer = self.get_coalescer()
+        coalescer.add('http://a.ru/', 1)
+        coalescer.add('http://b.ru/', 2)
+        self.assertEqual([1, 2], sorted(coalescer.drain()))
+        self.assertEqual(0, len(coalescer))
+        self.assertIsNone(coalescer.pop_ready())
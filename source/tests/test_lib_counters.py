@@ -0,0 +1,71 @@
+# -*- coding: utf-8 -*-
+import itertools
+import re
+import unittest
+from source import lib
+from source.lib.counters import CounterDetector, lower_pattern
+
+SNIPPETS = [
+    '<script src="http://www.google-analytics.com/ga.js"></script>',
+    '<script src="//MC.Yandex.RU/metrika/watch.js"></script>',
+    '<img src="//top-fwz1.mail.ru/counter?id=1">',
+    '<a href="http://top.mail.ru/jump?from=1">',
+    '<img src="//googleads.g.doubleclick.net/pagead/viewthroughconversion/1/">',
+    '<script src="//a1.vdna-assets.com/analytics.js"></script>',
+    '<img src="//counter.yadro.ru/hit?t=1">',
+    '<img src="http://counter.rambler.ru/top100.cnt?1">',
+    '<p>top-fwz1.mail.ru/counter.yadro.ru/hit</p>',
+    'google-analytics.com/ga.j',
+    '<p>\n</p>',
+    'Текст страницы',
+]
+
+
+def old_get_counters(content):
+    counters = []
+    for counter_name, pattern in lib.COUNTER_TYPES:
+        if re.match(re.compile(r'.*' + pattern + '.*', re.I + re.S), content):
+            counters.append(counter_name)
+    return counters
+
+
+class LibCountersTestCase(unittest.TestCase):
+    def test_same_result_as_regexp_per_counter(self):
+        detector = CounterDetector(lib.COUNTER_TYPES)
+        for size in xrange(3):
+            for snippets in itertools.permutations(SNIPPETS, size):
+                content = '<html>\n' + '\n'.join(snippets) + '</html>'
+                self.assertEquals(old_get_counters(content), detector.find(content), content)
+
+    def test_counters_in_types_order(self):
+        detector = CounterDetector([('A', r'aaa'), ('B', r'bbb'), ('A', r'ccc')])
+        self.assertEquals(['A', 'B', 'A'], detector.find('ccc bbb aaa'))
+
+    def test_counters_at_same_position(self):
+        detector = CounterDetector([('SHORT', r'abc'), ('LONG', r'abcdef')])
+        self.assertEquals(['SHORT', 'LONG'], detector.find('xx abcdef'))
+
+    def test_alternation_in_pattern(self):
+        detector = CounterDetector([('A', r'foo|bar'), ('B', r'baz')])
+        self.assertEquals(['A'], detector.find('bar'))
+        self.assertEquals(['B'], detector.find('baz'))
+
+    def test_case_insensitive(self):
+        detector = CounterDetector([('A', r'Counter\.RU/\S+')])
+        self.assertEquals(['A'], detector.find('COUNTER.ru/hit'))
+        self.assertEquals([], detector.find('counter.ru/ hit'))
+
+    def test_no_counter_types(self):
+        self.assertEquals([], CounterDetector().find('google-analytics.com/ga.js'))
+
+    def test_lower_pattern_keeps_escapes(self):
+        self.assertEquals(r'abc\S\W\.', lower_pattern(r'ABC\S\W\.'))
+
+    def test_load_counter_types_adds_extra(self):
+        try:
+            lib.load_counter_types([('EXTRA', r'counter\.example\.com')])
+            self.assertEquals(['YA_METRICA', 'EXTRA'],
+                              lib.get_counters('mc.yandex.ru/metrika/watch.js counter.example.com'))
+        finally:
+            lib.load_counter_types()
+        self.assertEquals([], lib.get_counters('counter.example.com'))
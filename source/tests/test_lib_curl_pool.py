@@ -0,0 +1,48 @@
+import unittest
+import mock
+from source.lib.curl_pool import CurlPool
+
+
+class LibCurlPoolTestCase(unittest.TestCase):
+    def test_released_handle_is_reset_and_reused(self):
+        pool = CurlPool(size=1)
+        with mock.patch('pycurl.Curl', mock.Mock(side_effect=lambda: mock.Mock())) as Curl:
+            curl = pool.acquire()
+            pool.release(curl)
+            self.assertIs(curl, pool.acquire())
+        curl.reset.assert_called_once_with()
+        self.assertEqual(1, Curl.call_count)
+
+    def test_extra_handles_are_closed(self):
+        pool = CurlPool(size=1)
+        with mock.patch('pycurl.Curl', mock.Mock(side_effect=lambda: mock.Mock())):
+            first, second = pool.acquire(), pool.acquire()
+        pool.release(first)
+        pool.release(second)
+        self.assertEqual([first], pool.idle)
+        second.close.assert_called_once_with()
+
+    def test_zero_size_closes_every_handle(self):
+        pool = CurlPool(size=0)
+        curl = mock.Mock()
+        pool.release(curl)
+        curl.close.assert_called_once_with()
+        self.assertEqual([], pool.idle)
+
+    def test_inherited_handles_are_not_used_after_fork(self):
+        pool = CurlPool(size=2)
+        inherited = mock.Mock()
+        pool.release(inherited)
+        pool.pid = -1
+        with mock.patch('pycurl.Curl', mock.Mock(return_value=mock.Mock())) as Curl:
+            self.assertIs(Curl.return_value, pool.acquire())
+        self.assertEqual([inherited], pool.inherited)
+        self.assertFalse(inherited.close.called)
+
+    def test_clear(self):
+        pool = CurlPool()
+        curl = mock.Mock()
+        pool.release(curl)
+        pool.clear()
+        curl.close.assert_called_once_with()
+        self.assertEqual([], pool.idle)
@@ -0,0 +1,37 @@
+import unittest
+import gevent
+from source.lib.fair_lock import FairLock
+
+
+class LibFairLockTestCase(unittest.TestCase):
+    def test_waiters_get_lock_in_order(self):
+        lock = FairLock()
+        order = []
+
+        def hog():
+            for _ in xrange(3):
+                with lock:
+                    order.append('hog')
+                    gevent.sleep(0.001)
+
+        def waiter():
+            with lock:
+                order.append('waiter')
+
+        lock.acquire()
+        greenlets = [gevent.spawn(hog), gevent.spawn(waiter)]
+        gevent.sleep(0)
+        lock.release()
+        gevent.joinall(greenlets, timeout=1)
+        self.assertEqual(['hog', 'waiter', 'hog', 'hog'], order)
+        self.assertFalse(lock.locked)
+
+    def test_killed_waiter_leaves_queue(self):
+        lock = FairLock()
+        lock.acquire()
+        waiter = gevent.spawn(lock.acquire)
+        gevent.sleep(0)
+        waiter.kill()
+        self.assertEqual(0, len(lock.waiters))
+        lock.release()
+        self.assertFalse(lock.locked)
@@ -0,0 +1,48 @@
+import unittest
+from source.lib.host_scheduler import HostScheduler
+
+
+class LibHostSchedulerTestCase(unittest.TestCase):
+    def test_round_robin_between_hosts(self):
+        scheduler = HostScheduler(host_limit=10, host_queue_size=10)
+        scheduler.push('a', 'a1')
+        scheduler.push('a', 'a2')
+        scheduler.push('a', 'a3')
+        scheduler.push('b', 'b1')
+        order = [scheduler.pop()[1] for _ in xrange(4)]
+        self.assertEqual(['a1', 'b1', 'a2', 'a3'], order)
+        self.assertIsNone(scheduler.pop())
+        self.assertEqual(0, len(scheduler))
+
+    def test_host_limit(self):
+        scheduler = HostScheduler(host_limit=1, host_queue_size=10)
+        scheduler.push('slow', 's1')
+        scheduler.push('slow', 's2')
+        scheduler.push('fast', 'f1')
+        self.assertEqual(('slow', 's1'), scheduler.pop())
+        self.assertEqual(('fast', 'f1'), scheduler.pop())
+        self.assertIsNone(scheduler.pop())
+        scheduler.release('slow')
+        self.assertEqual(('slow', 's2'), scheduler.pop())
+
+    def test_host_queue_size(self):
+        scheduler = HostScheduler(host_limit=1, host_queue_size=2)
+        self.assertTrue(scheduler.push('a', 1))
+        self.assertTrue(scheduler.push('a', 2))
+        self.assertFalse(scheduler.push('a', 3))
+        self.assertTrue(scheduler.push('b', 4))
+        self.assertEqual(3, len(scheduler))
+
+    def test_release_unknown_host(self):
+        scheduler = HostScheduler(host_limit=1, host_queue_size=2)
+        scheduler.release('a')
+        self.assertEqual({}, scheduler.in_flight)
+
+    def test_drain(self):
+        scheduler = HostScheduler(host_limit=1, host_queue_size=5)
+        scheduler.push('a', 1)
+        scheduler.push('b', 2)
+        scheduler.push('a', 3)
+        self.assertEqual([1, 3, 2], scheduler.drain())
+        self.assertEqual(0, len(scheduler))
+        self.assertIsNone(scheduler.pop())
@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import itertools
+import re
+import unittest
+from urlparse import urljoin
+from bs4 import BeautifulSoup
+from source import lib
+from source.lib.meta_refresh import find_meta_refresh
+
+FRAGMENTS = [
+    '<meta http-equiv="refresh" content="0; url=http://redirect-url.ru/">',
+    "<META HTTP-EQUIV='Refresh' CONTENT='5;URL=/relative?a=1&amp;b=2'/>",
+    '<meta content="0;url=next.html" http-equiv=refresh>',
+    '<meta http-equiv="refresh" content="10">',
+    '<meta http-equiv="refresh" content="0; url=">',
+    '<meta http-equiv="refresh" content="0; url=\'http://quoted.ru\'">',
+    '<meta http-equiv="refresh" content="0; url=http://a.ru; url=http://b.ru">',
+    '<meta http-equiv="refresh" content="0; url=http://xn--80a.ru/путь">',
+    '<meta http-equiv="x" http-equiv="refresh" content="0; url=http://dup.ru">',
+    '<meta charset="utf-8">',
+    '<meta name="description" content="0; url=http://not-redirect.ru">',
+    '<meta http-equiv="Content-Type" content="text/html; charset=utf-8">',
+    '<meta http-equiv>',
+    '<title>Страница</title>',
+    '<script>var s = "<meta http-equiv=refresh content=\'0;url=http://script.ru\'>";</script>',
+    '<!-- <meta http-equiv="refresh" content="0; url=http://comment.ru"> -->',
+    '<link rel="stylesheet" href="style.css">',
+]
+
+
+def old_check_for_meta(content, url):
+    soup = BeautifulSoup(content, "html.parser")
+    result = soup.find("meta")
+    if result and 'content' in result.attrs:
+        for attr, value in result.attrs.items():
+            if attr == 'http-equiv' and value.lower() == 'refresh':
+                splitted = result['content'].split(";")
+                if len(splitted) != 2:
+                    return
+                wait, text = splitted
+                text = text.strip()
+                m = re.search(r"url\s*=\s*['\"]?([^'\"]+)", text, re.I)
+                if m:
+                    meta_url = m.groups()[0]
+                    return urljoin(url, lib.to_unicode(meta_url, 'ignore'))
+
+
+def is_refresh(fragment):
+    return fragment.lower().startswith('<meta') and 'refresh' in fragment.lower()
+
+
+class LibMetaRefreshTestCase(unittest.TestCase):
+    def test_same_result_as_beautiful_soup_on_first_meta(self):
+        url = 'http://url.ru/path/page.html'
+        pages = [
+            ('utf8', '<html><head>{}</head><body>text</body></html>'),
+            ('cp1251', '<html><head>{}</head><body><meta charset="windows-1251"></body></html>'),
+        ]
+        for size in xrange(1, 3):
+            for fragments in itertools.permutations(FRAGMENTS, size):
+                metas = [fragment for fragment in fragments if fragment.lower().startswith('<meta')]
+                if metas and not is_refresh(metas[0]):
+                    continue
+                for charset, page in pages:
+                    content = page.format(''.join(fragments)).decode('utf8').encode(charset)
+                    expected = old_check_for_meta(content, url)
+                    self.assertEquals(expected, lib.check_for_meta(content, url), content)
+
+    def test_declared_charset(self):
+        content = (
+            u'<html><head><meta http-equiv="Content-Type" content="text/html; charset=windows-1251">'
+            u'<meta http-equiv="refresh" content="0;url=http://x.ru/привет"></head></html>'
+        ).encode('cp1251')
+        self.assertEquals(u'0;url=http://x.ru/привет', find_meta_refresh(content))
+
+    def test_byte_order_mark(self):
+        content = u'<meta http-equiv="refresh" content="0;url=http://x.ru/привет">'.encode('utf-16')
+        self.assertEquals(u'0;url=http://x.ru/привет', find_meta_refresh(content))
+
+    def test_unknown_declared_charset_falls_back_to_utf8(self):
+        content = u'<meta charset="x-unknown"><meta http-equiv="refresh" content="0;url=/привет">'.encode('utf8')
+        self.assertEquals(u'0;url=/привет', find_meta_refresh(content))
+
+    def test_finds_refresh_after_other_meta(self):
+        content = (
+            '<html><head><meta charset="utf-8"><meta name="viewport" content="width=device-width">'
+            '<meta http-equiv="refresh" content="0; url=http://redirect-url.ru/"></head></html>'
+        )
+        self.assertIsNone(old_check_for_meta(content, 'http://url.ru'))
+        self.assertEquals(u'http://redirect-url.ru/', lib.check_for_meta(content, 'http://url.ru'))
+
+    def test_stops_at_end_of_head(self):
+        content = '<html><head></head><body><meta http-equiv="refresh" content="0; url=http://late.ru"></body>'
+        self.assertIsNone(find_meta_refresh(content))
+
+    def test_without_head(self):
+        content = '<p>text</p><meta http-equiv="refresh" content="0; url=http://url.ru">'
+        self.assertEquals('0; url=http://url.ru', find_meta_refresh(content))
+
+    def test_stops_at_first_refresh(self):
+        content = (
+            '<meta http-equiv="refresh" content="5">'
+            '<meta http-equiv="refresh" content="0; url=http://second.ru">'
+        )
+        self.assertEquals('5', find_meta_refresh(content))
+
+    def test_broken_html(self):
+        self.assertIsNone(find_meta_refresh(u'<html><head><!x- <meta http-equiv="refresh" content="0; url=a">'))
@@ -0,0 +1,59 @@
+import unittest
+import mock
+from source.lib.metrics import Metrics
+
+
+class LibMetricsTestCase(unittest.TestCase):
+    def test_counter_by_labels(self):
+        metrics = Metrics()
+        metrics.inc('tasks_total', outcome='ack')
+        metrics.inc('tasks_total', 2, outcome='ack')
+        metrics.inc('tasks_total', outcome='bury')
+        text = metrics.render()
+        self.assertIn('# TYPE tasks_total counter\n', text)
+        self.assertIn('tasks_total{outcome="ack"} 3\n', text)
+        self.assertIn('tasks_total{outcome="bury"} 1\n', text)
+
+    def test_histogram_is_cumulative(self):
+        metrics = Metrics(buckets=(0.1, 1.0))
+        metrics.observe('latency', 0.05)
+        metrics.observe('latency', 0.5)
+        metrics.observe('latency', 5)
+        text = metrics.render()
+        self.assertIn('latency_bucket{le="0.1"} 1\n', text)
+        self.assertIn('latency_bucket{le="1.0"} 2\n', text)
+        self.assertIn('latency_bucket{le="+Inf"} 3\n', text)
+        self.assertIn('latency_sum 5.55\n', text)
+        self.assertIn('latency_count 3\n', text)
+
+    def test_gauge_is_computed_on_render(self):
+        metrics = Metrics()
+        value = mock.Mock(return_value=7)
+        metrics.gauge('busy', value)
+        self.assertFalse(value.called)
+        self.assertIn('busy 7\n', metrics.render())
+
+    def test_record_by_host(self):
+        metrics = Metrics(buckets=(1.0,))
+        metrics.record('http://a.ru/path', 0.5, 200, 120)
+        metrics.record('http://a.ru/other', 2, None)
+        text = metrics.render()
+        self.assertIn('pusher_callback_response_bytes_total{host="a.ru"} 120\n', text)
+        self.assertIn('pusher_callback_latency_seconds_count{host="a.ru"} 2\n', text)
+        self.assertIn('pusher_callback_responses_total{host="a.ru",status="200"} 1\n', text)
+        self.assertIn('pusher_callback_responses_total{host="a.ru",status="error"} 1\n', text)
+
+    def test_label_values_are_escaped(self):
+        metrics = Metrics()
+        metrics.inc('total', host='a"b')
+        self.assertIn('total{host="a\\"b"} 1\n', metrics.render())
+
+    def test_wsgi_app(self):
+        metrics = Metrics()
+        metrics.inc('total')
+        start_response = mock.Mock()
+        body = ''.join(metrics.wsgi_app({}, start_response))
+        self.assertEqual('# TYPE total counter\ntotal 1\n', body)
+        status, headers = start_response.call_args[0]
+        self.assertEqual('200 OK', status)
+        self.assertIn(('Content-Length', str(len(body))), headers)
@@ -0,0 +1,111 @@
+import unittest
+import mock
+import pycurl
+from source.lib.multi_checker import MultiChecker
+
+
+def make_curl(redirect_url=None):
+    curl = mock.Mock()
+    curl.getinfo.return_value = redirect_url
+    return curl
+
+
+class LibMultiCheckerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.multi = mock.Mock()
+        self.multi.timeout.return_value = -1
+        self.multi.perform.return_value = (0, 0)
+        self.multi.info_read.return_value = (0, [], [])
+        patcher = mock.patch('pycurl.CurlMulti', mock.Mock(return_value=self.multi))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = mock.patch('source.lib.multi_checker.curl_pool', mock.Mock())
+        self.curl_pool = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_add_starts_request(self):
+        curl = make_curl()
+        self.curl_pool.acquire.return_value = curl
+        checker = MultiChecker(size=3, timeout=5)
+        checker.add('task', 'http://url.ru')
+        self.multi.add_handle.assert_called_once_with(curl)
+        curl.setopt.assert_any_call(curl.URL, 'http://url.ru')
+        curl.setopt.assert_any_call(curl.FOLLOWLOCATION, False)
+        self.assertEqual(1, len(checker))
+        self.assertEqual(2, checker.free_count())
+
+    def test_ok_url_finishes_without_request(self):
+        checker = MultiChecker(size=1, timeout=5)
+        checker.add('task', 'http://www.odnoklassniki.ru/')
+        self.assertFalse(self.multi.add_handle.called)
+        self.assertEqual(0, checker.free_count())
+        [(item, chain)] = checker.perform(0.1)
+        self.assertEqual('task', item)
+        self.assertEqual(([], ['http://www.odnoklassniki.ru/'], []), chain.result())
+        self.assertFalse(self.multi.select.called)
+
+    def test_chain_advances_on_redirect(self):
+        first, second = make_curl('http://redirect-url.ru'), make_curl()
+        self.curl_pool.acquire.side_effect = [first, second]
+        checker = MultiChecker(size=1, timeout=5)
+        checker.add('task', 'http://url.ru')
+
+        self.multi.info_read.return_value = (0, [first], [])
+        self.assertEqual([], checker.perform(0.1))
+        self.multi.remove_handle.assert_called_once_with(first)
+        self.curl_pool.release.assert_called_once_with(first)
+        self.multi.add_handle.assert_called_with(second)
+
+        self.multi.info_read.return_value = (0, [second], [])
+        [(item, chain)] = checker.perform(0.1)
+        self.assertEqual(['http_status'], chain.history_types)
+        self.assertEqual(['http://url.ru', 'http://redirect-url.ru'], chain.history_urls)
+        self.assertEqual(0, len(checker))
+
+    def test_failed_request_is_error_hop(self):
+        curl = make_curl()
+        self.curl_pool.acquire.return_value = curl
+        checker = MultiChecker(size=1, timeout=5)
+        checker.add('task', 'http://url.ru')
+        self.multi.info_read.return_value = (0, [], [(curl, pycurl.E_OPERATION_TIMEOUTED, 'timeout')])
+        with mock.patch('source.lib.multi_checker.logger', mock.Mock()) as logger:
+            [(item, chain)] = checker.perform(0.1)
+        self.assertTrue(logger.error.called)
+        self.assertEqual(['ERROR'], chain.history_types)
+        self.curl_pool.release.assert_called_once_with(curl)
+
+    def test_transfer_aborted_by_body_is_not_error(self):
+        curl = make_curl()
+        self.curl_pool.acquire.return_value = curl
+        checker = MultiChecker(size=1, timeout=5, max_body_size=2)
+        checker.add('task', 'http://url.ru')
+        dict(call[0] for call in curl.setopt.call_args_list)[curl.WRITEFUNCTION]('abcdef')
+        self.multi.info_read.return_value = (0, [], [(curl, pycurl.E_WRITE_ERROR, 'Failed writing body')])
+        [(item, chain)] = checker.perform(0.1)
+        self.assertEqual([], chain.history_types)
+        self.assertEqual('ab', chain.content)
+        self.assertEqual(6, chain.received)
+
+    def test_perform_waits_no_longer_than_curl_timeout(self):
+        self.curl_pool.acquire.return_value = make_curl()
+        self.multi.timeout.return_value = 20
+        checker = MultiChecker(size=1, timeout=5)
+        checker.add('task', 'http://url.ru')
+        checker.perform(0.1)
+        self.multi.select.assert_called_once_with(0.02)
+
+    def test_perform_repeats_while_call_multi_perform(self):
+        self.multi.perform.side_effect = [(pycurl.E_CALL_MULTI_PERFORM, 1), (0, 1)]
+        checker = MultiChecker(size=1, timeout=5)
+        checker.perform(0)
+        self.assertEqual(2, self.multi.perform.call_count)
+
+    def test_drain_returns_active_items(self):
+        curl = make_curl()
+        self.curl_pool.acquire.return_value = curl
+        checker = MultiChecker(size=2, timeout=5)
+        checker.add('task', 'http://url.ru')
+        self.assertEqual(['task'], checker.drain())
+        self.multi.remove_handle.assert_called_once_with(curl)
+        self.curl_pool.release.assert_called_once_with(curl)
+        self.assertEqual(0, len(checker))
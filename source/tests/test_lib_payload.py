@@ -0,0 +1,43 @@
+# coding: utf-8
+import json
+import unittest
+import mock
+from source.lib import payload
+
+
+class LibPayloadTestCase(unittest.TestCase):
+    def test_splice_id(self):
+        self.assertEqual('{"a": 1,"id":"42"}', payload.splice_id('{"a": 1} ', '42'))
+        self.assertEqual('{"id":42}', payload.splice_id('{ }', 42))
+
+    def test_splice_id_rejects_existing_key(self):
+        self.assertRaises(ValueError, payload.splice_id, '{"a": 1, "id": 1}', 7)
+        self.assertRaises(ValueError, payload.splice_id, '{"\\u0069d" : 1}', 7)
+
+    def test_splice_id_allows_nested_id(self):
+        body = payload.splice_id('{"user": {"id": 1}, "text": "\\"id\\": 2"}', 7)
+        self.assertEqual({'user': {'id': 1}, 'text': '"id": 2', 'id': 7}, json.loads(body))
+
+    def test_splice_id_encodes_unicode(self):
+        body = payload.splice_id(u'{"text": "привет"}', 1)
+        self.assertIsInstance(body, str)
+        self.assertEqual({'text': u'привет', 'id': 1}, json.loads(body))
+
+    def test_splice_id_rejects_non_object(self):
+        self.assertRaises(ValueError, payload.splice_id, '[1, 2]', 1)
+
+    def test_build_body_raw(self):
+        task = mock.Mock(task_id=5, data={'callback_url': 'URL', payload.RAW_BODY_KEY: '{"a":1}'})
+        self.assertEqual(('URL', '{"a":1,"id":5}'), payload.build_body(task))
+
+    def test_build_body_legacy(self):
+        data = {'callback_url': 'URL', 'a': 1}
+        task = mock.Mock(task_id=5, data=data)
+        dumps = mock.Mock(return_value='encoded')
+        self.assertEqual(('URL', 'encoded'), payload.build_body(task, dumps))
+        dumps.assert_called_once_with({'a': 1, 'id': 5})
+        self.assertEqual({'callback_url': 'URL', 'a': 1}, data)
+
+    def test_load_json_encoder(self):
+        self.assertIs(json.dumps, payload.load_json_encoder('json'))
+        self.assertRaises(ImportError, payload.load_json_encoder, 'no_such_json_module')
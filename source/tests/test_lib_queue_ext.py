@@ -0,0 +1,99 @@
+import struct
+import unittest
+import mock
+from source.lib import queue_ext
+
+
+class LibQueueExtTestCase(unittest.TestCase):
+    def setUp(self):
+        self.queue = mock.Mock()
+        self.queue.space = 0
+
+    def test_ack_batch_all_ok(self):
+        self.queue.tnt.call = mock.Mock(return_value=[('id1', 'ok'), ('id2', 'ok')])
+        self.assertEqual({}, queue_ext.ack_batch(self.queue, ['id1', 'id2']))
+        self.queue.tnt.call.assert_called_once_with('queue.ack_batch', ('0', 'id1', 'id2'))
+
+    def test_bury_batch_reports_failed_ids(self):
+        self.queue.tnt.call = mock.Mock(return_value=[
+            ('id1', 'ok'),
+            ('id2', 'error', 'Task not found'),
+        ])
+        self.assertEqual({'id2': 'Task not found'}, queue_ext.bury_batch(self.queue, ['id1', 'id2']))
+        self.queue.tnt.call.assert_called_once_with('queue.bury_batch', ('0', 'id1', 'id2'))
+
+    def test_release_untaken(self):
+        task = mock.Mock(task_id='id1', queue=self.queue, modified=False)
+        queue_ext.release_untaken(task, 5)
+        self.queue.tnt.call.assert_called_once_with('queue.release_untaken', ('0', 'id1', '5'))
+        self.assertTrue(task.modified)
+        self.assertFalse(task.release.called)
+
+    def test_take_batch(self):
+        def pack(value):
+            return struct.pack('<q', value)
+
+        tube = mock.Mock()
+        tube.queue = self.queue
+        tube.opt = {'tube': 'name'}
+        self.queue.tnt.call = mock.Mock(return_value=[
+            ('id1', 'name', 'taken', pack(60), pack(1), pack(100), pack(30), pack(2), pack(10), 'data'),
+        ])
+        tasks = queue_ext.take_batch(tube, 5, 1)
+        self.queue.tnt.call.assert_called_once_with('queue.take_batch', ('0', 'name', '5', '1'))
+        self.assertEqual(1, len(tasks))
+        task = tasks[0]
+        self.assertEqual('id1', task.task_id)
+        self.assertEqual('data', task.raw_data)
+        self.assertEqual({
+            'event': 60, 'created': 1, 'ttl': 100, 'ttr': 30, 'ctaken': 2, 'now': 10
+        }, task.taken_meta)
+
+    def test_take_batch_timeout(self):
+        tube = mock.Mock()
+        tube.queue = self.queue
+        tube.opt = {'tube': 'name'}
+        self.queue.tnt.call = mock.Mock(return_value=[])
+        self.assertEqual([], queue_ext.take_batch(tube, 5, 1))
+
+    def test_take_any(self):
+        self.queue.tnt.call = mock.Mock(return_value=[])
+        self.assertEqual([], queue_ext.take_any(self.queue, [('a', 2), ('b', 1)], 3, 1))
+        self.queue.tnt.call.assert_called_once_with('queue.take_any', ('0', '3', '1', 'a', '2', 'b', '1'))
+
+    def test_tube_set_allocates_by_weights(self):
+        tubes = queue_ext.TubeSet(self.queue, [('a', 3), ('b', 1)])
+        self.assertEqual([('a', 3), ('b', 1)], tubes.allocate(4))
+        self.assertEqual([('a', 2), ('b', 0)], tubes.allocate(2))
+
+    def test_tube_set_keeps_proportion_for_single_slots(self):
+        tubes = queue_ext.TubeSet(self.queue, [('a', 2), ('b', 1)])
+        taken = [name for _ in xrange(6) for name, share in tubes.allocate(1) if share]
+        self.assertEqual(4, taken.count('a'))
+        self.assertEqual(2, taken.count('b'))
+
+    def test_tube_set_strict_priority(self):
+        tubes = queue_ext.TubeSet(self.queue, [('a', 1), ('b', 0)], strict_priority=True)
+        self.assertEqual([('a', 5), ('b', 5)], tubes.allocate(5))
+
+    def test_tube_set_skips_zero_weight(self):
+        tubes = queue_ext.TubeSet(self.queue, [('a', 1), ('b', 0)])
+        self.assertEqual(['a'], tubes.names)
+        self.assertRaises(ValueError, queue_ext.TubeSet, self.queue, [('a', 0)])
+
+    def test_take_batch_from_tube_set(self):
+        self.queue.tnt.call = mock.Mock(return_value=[])
+        tubes = queue_ext.TubeSet(self.queue, [('a', 1), ('b', 1)])
+        self.assertIsNone(tubes.take(1))
+        self.assertEqual([], queue_ext.take_batch(tubes, 2, 1))
+        self.queue.tnt.call.assert_called_with('queue.take_any', ('0', '2', '1', 'a', '1', 'b', '1'))
+
+    def test_lock_connection(self):
+        call = mock.Mock(return_value='response')
+        self.queue.tnt.call = call
+        lock = mock.MagicMock()
+        queue_ext.lock_connection(self.queue, lock)
+        self.assertEqual('response', self.queue.tnt.call('queue.ack', ('0', 'id1')))
+        call.assert_called_once_with('queue.ack', ('0', 'id1'))
+        lock.__enter__.assert_called_once_with()
+        self.assertTrue(lock.__exit__.called)
@@ -0,0 +1,118 @@
+import unittest
+import gevent
+import mock
+from source.lib.resident_pool import ResidentPool
+
+
+class LibResidentPoolTestCase(unittest.TestCase):
+    def test_runs_jobs_on_resident_greenlets(self):
+        pool = ResidentPool(size=2, buffer_size=2)
+        pool.start()
+        results = []
+        callback = mock.Mock()
+        for number in xrange(4):
+            pool.submit(results.append, (number,), callback=callback)
+        gevent.sleep(0)
+        self.assertEqual([0, 1, 2, 3], results)
+        self.assertEqual(4, callback.call_count)
+        self.assertEqual(2, len(pool.greenlets))
+        pool.kill()
+
+    def test_free_count_includes_buffer(self):
+        pool = ResidentPool(size=2, buffer_size=3)
+        self.assertEqual(5, pool.free_count())
+        pool.submit(mock.Mock())
+        pool.submit(mock.Mock())
+        self.assertEqual(2, len(pool))
+        self.assertEqual(3, pool.free_count())
+
+    def test_job_exception_is_logged_and_worker_survives(self):
+        pool = ResidentPool(size=1, buffer_size=1)
+        pool.start()
+        job = mock.Mock()
+        with mock.patch('source.lib.resident_pool.logger', mock.Mock()) as logger:
+            pool.submit(mock.Mock(side_effect=ValueError))
+            pool.submit(job)
+            gevent.sleep(0)
+        self.assertTrue(logger.exception.called)
+        self.assertTrue(job.called)
+        self.assertEqual(0, len(pool))
+        pool.kill()
+
+    def test_wait_available_blocks_until_job_done(self):
+        pool = ResidentPool(size=1, buffer_size=0)
+        pool.start()
+        pool.submit(gevent.sleep, (0.01,))
+        gevent.sleep(0)
+        self.assertEqual(0, pool.free_count())
+        with gevent.Timeout(1):
+            pool.wait_available()
+        self.assertEqual(1, pool.free_count())
+        pool.kill()
+
+    def test_kill_drops_buffered_jobs(self):
+        pool = ResidentPool(size=1, buffer_size=2)
+        job = mock.Mock()
+        pool.submit(job)
+        pool.kill()
+        pool.start()
+        gevent.sleep(0)
+        self.assertFalse(job.called)
+        pool.kill()
+
+    def test_drain_returns_unstarted_jobs(self):
+        pool = ResidentPool(size=1, buffer_size=2)
+        job = mock.Mock()
+        pool.submit(job, ('task',))
+        self.assertEqual([(job, ('task',), {}, None)], pool.drain())
+        self.assertEqual(0, len(pool))
+        pool.start()
+        gevent.sleep(0)
+        self.assertFalse(job.called)
+        pool.kill()
+
+    def test_join_waits_for_running_jobs(self):
+        pool = ResidentPool(size=1, buffer_size=1)
+        pool.start()
+        pool.submit(gevent.sleep, (0.01,))
+        pool.submit(gevent.sleep, (0.01,))
+        with gevent.Timeout(1):
+            pool.join()
+        self.assertEqual(0, len(pool))
+        pool.kill()
+
+    def test_join_timeout(self):
+        pool = ResidentPool(size=1, buffer_size=0)
+        pool.start()
+        pool.submit(gevent.sleep, (1,))
+        gevent.sleep(0)
+        pool.join(timeout=0.01)
+        self.assertEqual(1, len(pool))
+        pool.kill()
+
+    def test_resize_up_starts_workers(self):
+        pool = ResidentPool(size=1, buffer_size=0)
+        pool.start()
+        pool.resize(3)
+        self.assertEqual(3, len(pool.greenlets))
+        self.assertEqual(3, pool.free_count())
+        for number in xrange(3):
+            pool.submit(gevent.sleep, (0.01,))
+        gevent.sleep(0)
+        self.assertEqual(3, pool.busy)
+        pool.kill()
+
+    def test_resize_down_stops_idle_and_retires_busy_workers(self):
+        pool = ResidentPool(size=3, buffer_size=0)
+        pool.start()
+        pool.submit(gevent.sleep, (0.01,))
+        gevent.sleep(0)
+        pool.resize(1)
+        gevent.sleep(0)
+        self.assertEqual(1, pool.busy)
+        with gevent.Timeout(1):
+            pool.join()
+        gevent.sleep(0)
+        alive = [number for number, greenlet in enumerate(pool.greenlets) if not greenlet.dead]
+        self.assertEqual([0], alive)
+        pool.kill()
@@ -0,0 +1,28 @@
+import unittest
+import gevent
+from source.lib.resizable_pool import ResizablePool
+
+
+class LibResizablePoolTestCase(unittest.TestCase):
+    def test_resize_up_wakes_waiting_spawn(self):
+        pool = ResizablePool(1)
+        pool.spawn(gevent.sleep, 1)
+        waiter = gevent.spawn(pool.spawn, gevent.sleep, 0)
+        gevent.sleep(0)
+        self.assertFalse(waiter.ready())
+        pool.resize(2)
+        with gevent.Timeout(1):
+            waiter.join()
+        self.assertTrue(waiter.successful())
+        pool.kill()
+
+    def test_resize_down_keeps_running_greenlets(self):
+        pool = ResizablePool(3)
+        greenlets = [pool.spawn(gevent.sleep, 0.01) for _ in xrange(3)]
+        pool.resize(1)
+        self.assertEqual(3, len(pool))
+        self.assertEqual(0, pool.free_count())
+        with gevent.Timeout(1):
+            pool.wait_available()
+        self.assertTrue(all(greenlet.ready() for greenlet in greenlets))
+        self.assertEqual(1, pool.free_count())
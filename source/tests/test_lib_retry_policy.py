@@ -0,0 +1,43 @@
+import unittest
+import mock
+from source.lib import retry_policy
+from source.lib.retry_policy import RetryPolicy, parse_retry_after
+
+
+class LibRetryPolicyTestCase(unittest.TestCase):
+    def get_policy(self):
+        return RetryPolicy(max_attempts=3, base_delay=5, max_delay=30)
+
+    def test_classify(self):
+        policy = self.get_policy()
+        self.assertEqual(retry_policy.ACTION_ACK, policy.classify(200))
+        self.assertEqual(retry_policy.ACTION_ACK, policy.classify(302))
+        self.assertEqual(retry_policy.ACTION_BURY, policy.classify(404))
+        self.assertEqual(retry_policy.ACTION_RETRY, policy.classify(429))
+        self.assertEqual(retry_policy.ACTION_RETRY, policy.classify(503))
+        self.assertEqual(retry_policy.ACTION_RETRY, policy.classify(None))
+
+    def test_delay_grows_exponentially_up_to_max(self):
+        policy = self.get_policy()
+        self.assertEqual([5, 10, 20, 30], [policy.delay(attempt) for attempt in xrange(1, 5)])
+
+    def test_delay_uses_retry_after(self):
+        policy = self.get_policy()
+        self.assertEqual(7, policy.delay(1, retry_after=7))
+        self.assertEqual(30, policy.delay(1, retry_after=3600))
+
+    def test_should_retry(self):
+        policy = self.get_policy()
+        self.assertTrue(policy.should_retry(2))
+        self.assertFalse(policy.should_retry(3))
+
+    def test_parse_retry_after_seconds(self):
+        self.assertEqual(120.0, parse_retry_after(' 120 '))
+
+    def test_parse_retry_after_http_date(self):
+        with mock.patch('source.lib.retry_policy.time.time', mock.Mock(return_value=784111717)):
+            self.assertEqual(60, parse_retry_after('Sun, 06 Nov 1994 08:49:37 GMT'))
+
+    def test_parse_retry_after_invalid(self):
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after('soon'))
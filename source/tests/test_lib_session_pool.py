@@ -0,0 +1,50 @@
+import unittest
+import mock
+from source.lib.session_pool import SessionPool
+
+
+class LibSessionPoolTestCase(unittest.TestCase):
+    def test_get_reuses_session_for_same_host(self):
+        pool = SessionPool(pool_size=2, idle_timeout=60)
+        first = pool.get('http://host.ru/callback/1')
+        second = pool.get('http://host.ru/callback/2')
+        self.assertIs(first, second)
+
+    def test_get_separates_hosts_and_schemes(self):
+        pool = SessionPool(pool_size=2, idle_timeout=60)
+        plain = pool.get('http://host.ru/')
+        secure = pool.get('https://host.ru/')
+        other = pool.get('http://other.ru/')
+        self.assertEqual(3, len(set([id(plain), id(secure), id(other)])))
+
+    def test_adapter_pool_size(self):
+        pool = SessionPool(pool_size=7, idle_timeout=60)
+        session = pool.get('https://host.ru/')
+        adapter = session.get_adapter('https://host.ru/')
+        self.assertEqual(7, adapter._pool_maxsize)
+
+    def test_evict_idle(self):
+        pool = SessionPool(pool_size=2, idle_timeout=60)
+        with mock.patch('source.lib.session_pool.time.time', mock.Mock(return_value=100)):
+            old = pool.get('http://old.ru/')
+        with mock.patch('source.lib.session_pool.time.time', mock.Mock(return_value=150)):
+            pool.get('http://fresh.ru/')
+        old.close = mock.Mock()
+        with mock.patch('source.lib.session_pool.time.time', mock.Mock(return_value=170)):
+            self.assertEqual(1, pool.evict_idle())
+        old.close.assert_called_once_with()
+        self.assertEqual([('http', 'fresh.ru')], pool.sessions.keys())
+
+    def test_evict_idle_nothing_to_close(self):
+        pool = SessionPool(pool_size=2, idle_timeout=60)
+        pool.get('http://host.ru/')
+        self.assertEqual(0, pool.evict_idle())
+        self.assertEqual(1, len(pool.sessions))
+
+    def test_close(self):
+        pool = SessionPool(pool_size=2, idle_timeout=60)
+        session = pool.get('http://host.ru/')
+        session.close = mock.Mock()
+        pool.close()
+        session.close.assert_called_once_with()
+        self.assertEqual({}, pool.sessions)
@@ -0,0 +1,43 @@
+import unittest
+import mock
+from source.lib.timed_queue import TimedQueue
+
+
+class LibTimedQueueTestCase(unittest.TestCase):
+    def test_measures_wait(self):
+        queue = TimedQueue()
+        with mock.patch('source.lib.timed_queue.time.time', mock.Mock(return_value=100)):
+            queue.put('a')
+            queue.put('b')
+        with mock.patch('source.lib.timed_queue.time.time', mock.Mock(return_value=103)):
+            self.assertEqual(3, queue.oldest_wait())
+            self.assertEqual('a', queue.peek())
+            self.assertEqual('a', queue.get_nowait())
+            self.assertEqual(3, queue.recent_max_wait())
+            self.assertEqual(3, queue.recent_max_wait())
+        self.assertEqual(3, queue.last_wait)
+        self.assertEqual(1, queue.qsize())
+
+    def test_max_wait_window(self):
+        with mock.patch('source.lib.timed_queue.time.time', mock.Mock(return_value=0)):
+            queue = TimedQueue()
+            queue.put('a')
+        with mock.patch('source.lib.timed_queue.time.time', mock.Mock(return_value=5)):
+            queue.get_nowait()
+        with mock.patch('source.lib.timed_queue.time.time', mock.Mock(return_value=70)):
+            queue.put('b')
+            queue.get_nowait()
+            self.assertEqual(5, queue.recent_max_wait())
+        with mock.patch('source.lib.timed_queue.time.time', mock.Mock(return_value=125)):
+            self.assertEqual(0, queue.recent_max_wait())
+        with mock.patch('source.lib.timed_queue.time.time', mock.Mock(return_value=300)):
+            self.assertEqual(0, queue.recent_max_wait())
+
+    def test_empty_queue_has_no_wait(self):
+        self.assertEqual(0, TimedQueue().oldest_wait())
+
+    def test_bounded(self):
+        queue = TimedQueue(1)
+        queue.put_nowait('a')
+        self.assertTrue(queue.full())
+        self.assertEqual(['a'], [queue.copy().get_nowait()])
@@ -0,0 +1,75 @@
+import unittest
+import mock
+from source.lib.queue_ext import MetaTask
+from source.lib.ttr_guard import TtrGuard
+
+
+def make_task(task_id=1, ttr_left=10, ttl_left=100, ttr=10):
+    taken_meta = {
+        'event': ttr_left * 1000000, 'created': 0, 'ttl': ttl_left * 1000000,
+        'ttr': ttr * 1000000, 'ctaken': 1, 'now': 0
+    }
+    with mock.patch('source.lib.queue_ext.time.time', mock.Mock(return_value=100)):
+        return MetaTask(mock.Mock(), taken_meta=taken_meta, task_id=task_id)
+
+
+class LibTtrGuardTestCase(unittest.TestCase):
+    def test_time_left_uses_ttr_without_touch(self):
+        guard = TtrGuard(2)
+        self.assertEqual(7, guard.time_left(make_task(ttr_left=10), now=103))
+
+    def test_time_left_uses_ttl_with_touch(self):
+        guard = TtrGuard(2, touch_margin=5)
+        self.assertEqual(97, guard.time_left(make_task(ttr_left=10, ttl_left=100), now=103))
+
+    def test_time_left_unknown_for_plain_task(self):
+        guard = TtrGuard(2)
+        self.assertIsNone(guard.time_left(mock.Mock()))
+        self.assertTrue(guard.can_finish(mock.Mock()))
+
+    def test_can_finish(self):
+        guard = TtrGuard(2)
+        task = make_task(ttr_left=10)
+        self.assertTrue(guard.can_finish(task, now=105))
+        self.assertFalse(guard.can_finish(task, now=109))
+        self.assertFalse(guard.can_finish(task, now=111))
+
+    def test_can_finish_short_ttr_task(self):
+        guard = TtrGuard(2)
+        task = make_task(ttr_left=1, ttr=1)
+        self.assertTrue(guard.can_finish(task, now=100.5))
+        self.assertFalse(guard.can_finish(task, now=101))
+
+    def test_timeout_is_bounded_by_earliest_deadline(self):
+        guard = TtrGuard(2)
+        tasks = [make_task(1, ttr_left=10), make_task(2, ttr_left=4), mock.Mock()]
+        self.assertEqual(3, guard.timeout(tasks, 30, now=101))
+        self.assertEqual(30, guard.timeout([mock.Mock()], 30))
+
+    def test_track_only_with_touch(self):
+        task = make_task()
+        guard = TtrGuard(2)
+        guard.track([task])
+        self.assertEqual(0, len(guard))
+
+        guard = TtrGuard(2, touch_margin=5)
+        guard.track([task, mock.Mock()])
+        self.assertEqual(1, len(guard))
+        guard.untrack([task])
+        self.assertEqual(0, len(guard))
+
+    def test_expiring(self):
+        guard = TtrGuard(2, touch_margin=5)
+        soon, later, capped = make_task(1, ttr_left=3), make_task(2, ttr_left=30), make_task(3, ttr_left=3, ttl_left=3)
+        guard.track([soon, later, capped])
+        self.assertEqual([soon], guard.expiring(now=100))
+
+    def test_touch_moves_ttr_deadline(self):
+        task = make_task(ttr_left=3, ttl_left=15, ttr=10)
+        with mock.patch('source.lib.queue_ext.time.time', mock.Mock(return_value=102)):
+            task.touch()
+        task.queue._touch.assert_called_once_with(1)
+        self.assertEqual(112, task.ttr_deadline)
+        with mock.patch('source.lib.queue_ext.time.time', mock.Mock(return_value=110)):
+            task.touch()
+        self.assertEqual(115, task.ttr_deadline)
@@ -82,6 +82,27 @@ class LibUtilsTestCase(unittest.TestCase):
         self.assertEqual(result.TEST_KEY_4, '')
         self.assertFalse(hasattr(result, 'Test_Key_5'))
 
+    def test_reload_config_updates_only_given_keys(self):
+        config = utils.Config()
+        config.TEST_KEY_1 = 5
+        config.TEST_KEY_2 = 'test_value_2'
+        config.TEST_KEY_4 = 'old'
+        changed = utils.reload_config(config, 'source/tests/test_config.py', ('TEST_KEY_1', 'TEST_KEY_2', 'MISSING'))
+        self.assertEqual({'TEST_KEY_1': 1}, changed)
+        self.assertEqual(1, config.TEST_KEY_1)
+        self.assertEqual('old', config.TEST_KEY_4)
+        self.assertFalse(hasattr(config, 'MISSING'))
+
+    def test_apply_log_levels(self):
+        logger, root = mock.Mock(), mock.Mock()
+        with mock.patch('source.lib.utils.logging.getLogger', mock.Mock(side_effect=lambda *name: logger if name else root)):
+            utils.apply_log_levels({
+                'loggers': {'pusher': {'level': 'INFO'}, 'other': {'handlers': []}},
+                'root': {'level': 'WARNING'},
+            })
+        logger.setLevel.assert_called_once_with('INFO')
+        root.setLevel.assert_called_once_with('WARNING')
+
     #parse_cmd_args(args, app_description='')
     def test_parse_cmd_args(self):
         mock_args = 'args'
@@ -119,6 +140,12 @@ class LibUtilsTestCase(unittest.TestCase):
         assert Process.call_count == num
         self.assertTrue(Process.daemon)
 
+    def test_spawn_workers_passes_generation(self):
+        generation = mock.Mock()
+        with mock.patch('source.lib.utils.Process', mock.Mock()) as Process:
+            utils.spawn_workers(1, mock.Mock(), (), 42, generation)
+        self.assertEqual({'parent_pid': 42, 'generation': generation}, Process.call_args[1]['kwargs'])
+
     #check_network_status
         #positive_tests
     def test_check_network_status_true(self):
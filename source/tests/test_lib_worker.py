@@ -3,8 +3,14 @@ import mock
 from source.lib import worker
 
 
+def make_chain(result, received=0):
+    chain = mock.Mock(received=received, history_types=result[0])
+    chain.result.return_value = result
+    return chain
+
+
 class LibWorkerTestCase(unittest.TestCase):
-    # get_redirect_history_from_task(task, timeout, max_redirects=30, user_agent=None)
+    # get_redirect_history_from_task(task, timeout, max_redirects=30, user_agent=None, max_body_size=None)
     #positive_tests
     def test_get_redirect_history_from_task_error_and_not_recheck(self):
         task = mock.Mock()
@@ -19,11 +25,11 @@ class LibWorkerTestCase(unittest.TestCase):
         data_modified = task.data.copy()
         data_modified['recheck'] = True
         timeout = 3
-        with mock.patch('source.lib.worker.get_redirect_history',
-                        mock.Mock(return_value=return_value)) as get_redirect_history:
+        with mock.patch('source.lib.worker.get_redirect_chain',
+                        mock.Mock(return_value=make_chain(return_value))) as get_redirect_chain:
             self.assertEquals((is_input, data_modified), (worker.get_redirect_history_from_task(task, timeout)))
 
-        get_redirect_history.assert_called_once()
+        get_redirect_chain.assert_called_once()
 
     def test_get_redirect_history_from_task_else(self):
         task = mock.Mock()
@@ -40,7 +46,7 @@ class LibWorkerTestCase(unittest.TestCase):
             'check_type': 'normal'
         }
         timeout = 3
-        with mock.patch('source.lib.worker.get_redirect_history', mock.Mock(return_value=return_value)):
+        with mock.patch('source.lib.worker.get_redirect_chain', mock.Mock(return_value=make_chain(return_value))):
             self.assertEquals((is_input, data_modified), worker.get_redirect_history_from_task(task, timeout))
 
     def test_get_redirect_history_from_task_else_suspicious(self):
@@ -60,7 +66,7 @@ class LibWorkerTestCase(unittest.TestCase):
             'suspicious': task.data['suspicious']
         }
         timeout = 3
-        with mock.patch('source.lib.worker.get_redirect_history', mock.Mock(return_value=return_value)):
+        with mock.patch('source.lib.worker.get_redirect_chain', mock.Mock(return_value=make_chain(return_value))):
             self.assertEquals((is_input, data_modified), worker.get_redirect_history_from_task(task, timeout))
 
             #worker(config, parent_pid)
@@ -68,6 +74,7 @@ class LibWorkerTestCase(unittest.TestCase):
 
     def test_worker_dead_parent(self):
         config = mock.MagicMock()
+        config.QUEUE_PREFETCH_COUNT = 1
         parent_pid = 42
         tube = mock.MagicMock()
         input_tube = mock.MagicMock()
@@ -81,6 +88,7 @@ class LibWorkerTestCase(unittest.TestCase):
 
     def test_worker_not_task(self):
         config = mock.MagicMock()
+        config.QUEUE_PREFETCH_COUNT = 1
         parent_pid = 42
         tube = mock.MagicMock()
         tube.take = mock.Mock(return_value=None)
@@ -94,6 +102,7 @@ class LibWorkerTestCase(unittest.TestCase):
 
     def test_worker_not_result(self):
         config = mock.MagicMock()
+        config.QUEUE_PREFETCH_COUNT = 1
         parent_pid = 42
         tube = mock.MagicMock()
         with mock.patch('source.lib.worker.get_tube', mock.Mock(return_value=tube)):
@@ -108,6 +117,7 @@ class LibWorkerTestCase(unittest.TestCase):
 
     def test_worker_result_is_input(self):
         config = mock.MagicMock()
+        config.QUEUE_PREFETCH_COUNT = 1
         parent_pid = 42
         tube = mock.MagicMock()
         input_tube = mock.MagicMock()
@@ -125,6 +135,7 @@ class LibWorkerTestCase(unittest.TestCase):
 
     def test_worker_result_not_is_input(self):
         config = mock.MagicMock()
+        config.QUEUE_PREFETCH_COUNT = 1
         parent_pid = 42
         tube = mock.MagicMock()
         input_tube = mock.MagicMock()
@@ -144,6 +155,7 @@ class LibWorkerTestCase(unittest.TestCase):
     def test_worker_not_result_database_error(self):
         from source.lib.worker import DatabaseError
         config = mock.MagicMock()
+        config.QUEUE_PREFETCH_COUNT = 1
         parent_pid = 42
         tube = mock.MagicMock()
         task = mock.MagicMock()
@@ -157,4 +169,183 @@ class LibWorkerTestCase(unittest.TestCase):
                         worker.worker(config, parent_pid)
 
         self.assertFalse(logger.debug.called)
-        self.assertTrue(logger.exception.called)
\ No newline at end of file
+        self.assertTrue(logger.exception.called)
+
+    def test_take_task_without_prefetch(self):
+        tube = mock.Mock()
+        prefetched = worker.deque()
+        self.assertEqual(tube.take.return_value, worker.take_task(tube, prefetched, 1, 0.1))
+        tube.take.assert_called_once_with(0.1)
+
+    def test_take_task_prefetch(self):
+        tube = mock.Mock()
+        prefetched = worker.deque()
+        with mock.patch('source.lib.worker.take_batch', mock.Mock(return_value=['task1', 'task2'])) as take_batch:
+            self.assertEqual('task1', worker.take_task(tube, prefetched, 5, 0.1))
+            self.assertEqual('task2', worker.take_task(tube, prefetched, 5, 0.1))
+        take_batch.assert_called_once_with(tube, 5, 0.1)
+        self.assertFalse(tube.take.called)
+
+    def test_take_task_prefetch_empty(self):
+        prefetched = worker.deque()
+        with mock.patch('source.lib.worker.take_batch', mock.Mock(return_value=[])):
+            self.assertIsNone(worker.take_task(mock.Mock(), prefetched, 5, 0.1))
+
+    def test_worker_releases_prefetched_tasks_on_exit(self):
+        config = mock.MagicMock()
+        config.QUEUE_PREFETCH_COUNT = 3
+        tube = mock.MagicMock()
+        first, second = mock.MagicMock(), mock.MagicMock()
+        with mock.patch('source.lib.worker.get_tube', mock.Mock(return_value=tube)):
+            with mock.patch('os.path.exists', mock.Mock(side_effect=[True, False])):
+                with mock.patch('source.lib.worker.take_batch', mock.Mock(return_value=[first, second])):
+                    with mock.patch('source.lib.worker.get_redirect_history_from_task', mock.Mock(return_value=None)):
+                        worker.worker(config, 42)
+        first.ack.assert_called_once_with()
+        second.release.assert_called_once_with()
+        self.assertFalse(second.ack.called)
+
+    def test_worker_flushes_logging_on_exit(self):
+        with mock.patch('source.lib.worker.get_tube', mock.Mock(return_value=mock.MagicMock())):
+            with mock.patch('os.path.exists', mock.Mock(return_value=False)):
+                with mock.patch('source.lib.worker.shutdown_logging', mock.Mock()) as shutdown_logging:
+                    worker.worker(mock.MagicMock(), 42)
+        shutdown_logging.assert_called_once_with()
+
+    def test_worker_exits_on_new_generation_and_releases_prefetched(self):
+        config = mock.MagicMock()
+        config.QUEUE_PREFETCH_COUNT = 3
+        generation = mock.Mock(value=1)
+        first, second = mock.MagicMock(), mock.MagicMock()
+
+        def reload_after_first(task, *args):
+            generation.value = 2
+
+        with mock.patch('source.lib.worker.get_tube', mock.Mock(return_value=mock.MagicMock())):
+            with mock.patch('os.path.exists', mock.Mock(return_value=True)):
+                with mock.patch('source.lib.worker.take_batch', mock.Mock(return_value=[first, second])):
+                    with mock.patch('source.lib.worker.get_redirect_history_from_task',
+                                    mock.Mock(side_effect=reload_after_first)):
+                        with mock.patch('source.lib.worker.shutdown_logging', mock.Mock()):
+                            worker.worker(config, 42, generation)
+        first.ack.assert_called_once_with()
+        second.release.assert_called_once_with()
+        self.assertFalse(second.ack.called)
+
+    def test_multi_worker_completes_finished_chains_and_releases_active(self):
+        config = mock.MagicMock()
+        config.CONCURRENT_CHAINS = 2
+        config.QUEUE_TAKE_TIMEOUT = 0.1
+        input_tube, output_tube = mock.MagicMock(), mock.MagicMock()
+        done = mock.MagicMock(task_id=1, data={'url': 'http://done.ru', 'url_id': 1})
+        running = mock.MagicMock(task_id=2, data={'url': 'http://running.ru', 'url_id': 2})
+        chain = make_chain(([], ['http://done.ru'], []), received=100)
+        checker = mock.MagicMock()
+        checker.free_count.return_value = 2
+        checker.__len__.return_value = 0
+        checker.perform.return_value = [(done, chain)]
+        checker.drain.return_value = [running]
+        with mock.patch('source.lib.worker.get_tube', mock.Mock(side_effect=[input_tube, output_tube])):
+            with mock.patch('os.path.exists', mock.Mock(side_effect=[True, False])):
+                with mock.patch('source.lib.worker.take_batch', mock.Mock(return_value=[done, running])) as take:
+                    with mock.patch('source.lib.worker.MultiChecker', mock.Mock(return_value=checker)) as MultiChecker:
+                        with mock.patch('source.lib.worker.shutdown_logging', mock.Mock()):
+                            worker.multi_worker(config, 42)
+        MultiChecker.assert_called_once_with(
+            2, config.HTTP_TIMEOUT, config.MAX_REDIRECTS, config.USER_AGENT, config.MAX_BODY_SIZE
+        )
+        take.assert_called_once_with(input_tube, 2, 0.1)
+        self.assertEqual([mock.call(done, u'http://done.ru'), mock.call(running, u'http://running.ru')],
+                         checker.add.call_args_list)
+        output_tube.put.assert_called_once_with({
+            'url_id': 1, 'result': [[], ['http://done.ru'], []], 'check_type': 'normal'
+        })
+        done.ack.assert_called_once_with()
+        running.release.assert_called_once_with()
+        self.assertFalse(running.ack.called)
+
+    def test_multi_worker_finishes_active_chains_on_reload(self):
+        config = mock.MagicMock()
+        config.CONCURRENT_CHAINS = 2
+        generation = mock.Mock(value=0)
+        input_tube, output_tube = mock.MagicMock(), mock.MagicMock()
+        task = mock.MagicMock(task_id=1, data={'url': 'http://slow.ru', 'url_id': 1})
+        chain = make_chain(([], ['http://slow.ru'], []))
+        active = []
+        performed = [[], [(task, chain)]]
+
+        def perform(timeout):
+            finished = performed.pop(0)
+            if finished:
+                del active[:]
+            else:
+                generation.value += 1
+            return finished
+
+        checker = mock.MagicMock()
+        checker.free_count.side_effect = lambda: 2 - len(active)
+        checker.__len__.side_effect = lambda: len(active)
+        checker.add.side_effect = lambda item, url: active.append(item)
+        checker.perform.side_effect = perform
+        checker.drain.return_value = []
+        with mock.patch('source.lib.worker.get_tube', mock.Mock(side_effect=[input_tube, output_tube])):
+            with mock.patch('os.path.exists', mock.Mock(return_value=True)):
+                with mock.patch('source.lib.worker.take_batch', mock.Mock(return_value=[task])) as take:
+                    with mock.patch('source.lib.worker.MultiChecker', mock.Mock(return_value=checker)):
+                        with mock.patch('source.lib.worker.shutdown_logging', mock.Mock()):
+                            worker.multi_worker(config, 42, generation)
+        take.assert_called_once_with(input_tube, 2, config.QUEUE_TAKE_TIMEOUT)
+        self.assertEqual(2, checker.perform.call_count)
+        task.ack.assert_called_once_with()
+        self.assertFalse(task.release.called)
+
+    def test_multi_worker_polls_queue_while_chains_active(self):
+        config = mock.MagicMock()
+        config.CONCURRENT_CHAINS = 10
+        checker = mock.MagicMock()
+        checker.free_count.return_value = 3
+        checker.__len__.return_value = 7
+        checker.perform.return_value = []
+        checker.drain.return_value = []
+        tube = mock.MagicMock()
+        with mock.patch('source.lib.worker.get_tube', mock.Mock(return_value=tube)):
+            with mock.patch('os.path.exists', mock.Mock(side_effect=[True, False])):
+                with mock.patch('source.lib.worker.take_batch', mock.Mock(return_value=[])) as take:
+                    with mock.patch('source.lib.worker.MultiChecker', mock.Mock(return_value=checker)):
+                        with mock.patch('source.lib.worker.shutdown_logging', mock.Mock()):
+                            worker.multi_worker(config, 42)
+        take.assert_called_once_with(tube, 3, worker.NO_WAIT)
+
+    def test_multi_worker_limits_polls_while_chains_active(self):
+        config = mock.MagicMock()
+        config.QUEUE_TAKE_TIMEOUT = 0.1
+        checker = mock.MagicMock()
+        checker.free_count.return_value = 3
+        checker.__len__.return_value = 7
+        checker.perform.return_value = []
+        checker.drain.return_value = []
+        tube = mock.MagicMock()
+        with mock.patch('source.lib.worker.get_tube', mock.Mock(return_value=tube)):
+            with mock.patch('os.path.exists', mock.Mock(side_effect=[True, True, True, False])):
+                with mock.patch('source.lib.worker.time.time', mock.Mock(side_effect=[10, 10, 10.05, 10.1, 10.1])):
+                    with mock.patch('source.lib.worker.take_batch', mock.Mock(return_value=[])) as take:
+                        with mock.patch('source.lib.worker.MultiChecker', mock.Mock(return_value=checker)):
+                            with mock.patch('source.lib.worker.shutdown_logging', mock.Mock()):
+                                worker.multi_worker(config, 42)
+        self.assertEqual(2, take.call_count)
+        self.assertEqual(3, checker.perform.call_count)
+
+    def test_multi_worker_does_not_take_when_full(self):
+        config = mock.MagicMock()
+        checker = mock.MagicMock()
+        checker.free_count.return_value = 0
+        checker.perform.return_value = []
+        checker.drain.return_value = []
+        with mock.patch('source.lib.worker.get_tube', mock.Mock(return_value=mock.MagicMock())):
+            with mock.patch('os.path.exists', mock.Mock(side_effect=[True, False])):
+                with mock.patch('source.lib.worker.take_batch', mock.Mock()) as take:
+                    with mock.patch('source.lib.worker.MultiChecker', mock.Mock(return_value=checker)):
+                        with mock.patch('source.lib.worker.shutdown_logging', mock.Mock()):
+                            worker.multi_worker(config, 42)
+        self.assertFalse(take.called)
+        self.assertTrue(checker.perform.called)
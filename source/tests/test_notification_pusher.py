@@ -1,3 +1,5 @@
+import io
+import socket
 import unittest
 import mock
 import requests
@@ -5,8 +7,31 @@ from source.notification_pusher import create_pidfile
 from source.notification_pusher import install_signal_handlers
 from source.notification_pusher import notification_worker
 from source import notification_pusher
+from source.lib.circuit_breaker import CircuitBreaker
+from source.lib.coalescer import Coalescer
+from source.lib.host_scheduler import HostScheduler
+from source.lib.metrics import Metrics
+from source.lib.queue_ext import MetaTask
+from source.lib.resident_pool import ResidentPool
+from source.lib.retry_policy import RetryPolicy
+from source.lib.ttr_guard import TtrGuard
 from source.lib.utils import Config
+import gevent
 from gevent import queue as gevent_queue
+from gevent.pool import Pool
+
+
+class Raw(io.BytesIO):
+    def release_conn(self):
+        pass
+
+
+def make_response(status_code=200, content='', headers=None):
+    response = requests.Response()
+    response.status_code = status_code
+    response.raw = Raw(content)
+    response.headers.update(headers or {})
+    return response
 
 
 class TaskData:
@@ -16,6 +41,9 @@ class TaskData:
     def copy(self):
         return self.data
 
+    def get(self, key, default=None):
+        return self.data.get(key, default)
+
 
 class Task:
     def __init__(self, task_id, data):
@@ -23,6 +51,50 @@ class Task:
         self.data = TaskData(data)
 
 
+def assert_released_untaken(task, delay):
+    task.queue.tnt.call.assert_called_once_with(
+        'queue.release_untaken', (str(task.queue.space), str(task.task_id), str(delay))
+    )
+    assert not task.release.called
+
+
+def get_main_loop_config():
+    config = Config()
+    config.QUEUE_HOST = 'localhost'
+    config.QUEUE_PORT = 80
+    config.QUEUE_SPACE = 0
+    config.QUEUE_TUBE = 'name'
+    config.QUEUE_TUBES = []
+    config.QUEUE_TUBES_STRICT_PRIORITY = False
+    config.QUEUE_TAKE_TIMEOUT = 0
+    config.WORKER_POOL_SIZE = 1
+    config.SLEEP = 1
+    config.HTTP_CONNECTION_TIMEOUT = 2
+    config.HTTP_POOL_SIZE = 1
+    config.HTTP_POOL_IDLE_TIMEOUT = 60
+    config.QUEUE_INTAKE_MODE = notification_pusher.INTAKE_POLLING
+    config.QUEUE_LONG_POLL_TIMEOUT = 5
+    config.ACK_BATCH_SIZE = 1
+    config.QUEUE_TAKE_BATCH = False
+    config.HOST_CONCURRENCY_LIMIT = 0
+    config.ADAPTIVE_POOL = False
+    config.RETRY_MAX_ATTEMPTS = 0
+    config.CIRCUIT_BREAKER_THRESHOLD = 0
+    config.CIRCUIT_BREAKER_RESET_TIMEOUT = 30
+    config.COALESCE_CALLBACK_URLS = []
+    config.RESIDENT_WORKERS = False
+    config.ACKER_ENABLED = False
+    config.DRAIN_TIMEOUT = 0
+    config.RESPONSE_MAX_SIZE = 1024
+    config.TTR_MIN_REMAINING = 0
+    config.TTR_TOUCH_MARGIN = 0
+    config.PROCESSED_QUEUE_SIZE = 0
+    config.JSON_ENCODER = 'json'
+    config.METRICS_HOST = '127.0.0.1'
+    config.METRICS_PORT = 0
+    return config
+
+
 class NotificationPusherTestCase(unittest.TestCase):
     def test_create_pidfile_example(self):
         pid = 42
@@ -39,6 +111,8 @@ class NotificationPusherTestCase(unittest.TestCase):
         with mock.patch('gevent.signal', mock_signal):
                 install_signal_handlers()
         assert mock_signal.call_count == 4
+        mock_signal.assert_any_call(notification_pusher.signal.SIGHUP, notification_pusher.reload_handler,
+                                    notification_pusher.signal.SIGHUP)
 
     def test_notification_worker(self):
         task_queue = mock.Mock()
@@ -51,7 +125,7 @@ class NotificationPusherTestCase(unittest.TestCase):
             "callback_url": "URL",
             "id": 1
         })
-        response = mock.Mock()
+        response = make_response()
         with mock.patch.object(requests, 'post', mock.Mock(return_value=response)):
             notification_worker(task, task_queue)
         task_queue.put.assert_called_once_with((task, 'ack'))
@@ -73,6 +147,218 @@ class NotificationPusherTestCase(unittest.TestCase):
                 notification_worker(task, task_queue)
         task_queue.put.assert_called_once_with((task, 'bury'))
 
+    def test_notification_worker_uses_session_pool(self):
+        task_queue = mock.Mock()
+        task = Task(12, {
+            "callback_url": "URL",
+            "id": 1
+        })
+        task.data = TaskData({
+            "callback_url": "URL",
+            "id": 1
+        })
+        session_pool = mock.Mock()
+        session_pool.get.return_value.post.return_value = make_response()
+        with mock.patch.object(requests, 'post', mock.Mock()) as post:
+            notification_worker(task, task_queue, session_pool=session_pool)
+        session_pool.get.assert_called_once_with("URL")
+        self.assertTrue(session_pool.get.return_value.post.called)
+        self.assertFalse(post.called)
+        task_queue.put.assert_called_once_with((task, 'ack'))
+
+    def test_notification_worker_reports_to_observers(self):
+        task = Task(12, {})
+        task.data = TaskData({"callback_url": "URL"})
+        observer = mock.Mock()
+        response = make_response(503, 'Unavailable')
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=response)):
+            notification_worker(task, mock.Mock(), observers=[observer])
+        self.assertEqual(1, observer.record.call_count)
+        url, elapsed, status_code, received = observer.record.call_args[0]
+        self.assertEqual(("URL", 503, 11), (url, status_code, received))
+
+    def test_notification_worker_reports_exception_to_observers(self):
+        task = Task(12, {})
+        task.data = TaskData({"callback_url": "URL"})
+        observer = mock.Mock()
+        with mock.patch.object(requests, 'post', mock.Mock(side_effect=requests.ConnectionError)):
+            with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                notification_worker(task, mock.Mock(), observers=[observer])
+        self.assertIsNone(observer.record.call_args[0][2])
+
+    def test_notification_worker_retry_policy_classifies_response(self):
+        task = Task(12, {})
+        task.data = TaskData({"callback_url": "URL"})
+        task_queue = mock.Mock()
+        policy = mock.Mock()
+        policy.classify.return_value = 'bury'
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=make_response(404))):
+            notification_worker(task, task_queue, retry_policy=policy)
+        policy.classify.assert_called_once_with(404)
+        task_queue.put.assert_called_once_with((task, 'bury'))
+
+    def test_notification_worker_retry_passes_retry_after(self):
+        task = Task(12, {})
+        task.data = TaskData({"callback_url": "URL"})
+        task_queue = mock.Mock()
+        policy = mock.Mock()
+        policy.classify.return_value = 'retry'
+        response = make_response(503, headers={'Retry-After': '30'})
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=response)):
+            notification_worker(task, task_queue, retry_policy=policy)
+        task_queue.put.assert_called_once_with((task, 'retry', {'retry_after': 30.0}))
+
+    def test_notification_worker_retry_on_exception(self):
+        task = Task(12, {})
+        task.data = TaskData({"callback_url": "URL"})
+        task_queue = mock.Mock()
+        with mock.patch.object(requests, 'post', mock.Mock(side_effect=requests.ConnectionError)):
+            with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                notification_worker(task, task_queue, retry_policy=mock.Mock())
+        task_queue.put.assert_called_once_with((task, 'retry', {'retry_after': None}))
+
+    def test_notification_batch_worker_sends_array_and_acks_each(self):
+        tasks = [mock.Mock(task_id=i, data={'callback_url': 'URL', 'n': i}) for i in xrange(2)]
+        task_queue = mock.Mock()
+        response = make_response(200, 'ok')
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=response)) as post:
+            notification_pusher.notification_batch_worker(tasks, task_queue, 'URL')
+        self.assertEqual(
+            [{'n': 0, 'id': 0}, {'n': 1, 'id': 1}],
+            notification_pusher.json.loads(post.call_args[1]['data'])
+        )
+        self.assertEqual([mock.call((tasks[0], 'ack')), mock.call((tasks[1], 'ack'))], task_queue.put.call_args_list)
+
+    def test_notification_batch_worker_per_item_status_codes(self):
+        tasks = [mock.Mock(task_id=i, data={'callback_url': 'URL'}) for i in xrange(3)]
+        task_queue = mock.Mock()
+        response = make_response(200, '[200, 404, 503]')
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=response)):
+            notification_pusher.notification_batch_worker(
+                tasks, task_queue, 'URL', retry_policy=RetryPolicy(3, 1, 10)
+            )
+        self.assertEqual([
+            mock.call((tasks[0], 'ack')),
+            mock.call((tasks[1], 'bury')),
+            mock.call((tasks[2], 'retry', {'retry_after': None})),
+        ], task_queue.put.call_args_list)
+
+    def test_notification_batch_worker_exception(self):
+        tasks = [mock.Mock(task_id=i, data={'callback_url': 'URL'}) for i in xrange(2)]
+        task_queue = mock.Mock()
+        with mock.patch.object(requests, 'post', mock.Mock(side_effect=requests.ConnectionError)):
+            with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                notification_pusher.notification_batch_worker(tasks, task_queue, 'URL')
+        self.assertEqual([mock.call((tasks[0], 'bury')), mock.call((tasks[1], 'bury'))], task_queue.put.call_args_list)
+
+    def test_notification_worker_raw_body(self):
+        task = mock.Mock(task_id=12, data={'callback_url': 'URL', 'raw_body': '{"a": 1}'})
+        task_queue = mock.Mock()
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=make_response())) as post:
+            notification_worker(task, task_queue)
+        self.assertEqual('{"a": 1,"id":12}', post.call_args[1]['data'])
+        task_queue.put.assert_called_once_with((task, 'ack'))
+
+    def test_notification_worker_uses_encoder(self):
+        task = mock.Mock(task_id=12, data={'callback_url': 'URL', 'a': 1})
+        dumps = mock.Mock(return_value='encoded')
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=make_response())) as post:
+            notification_worker(task, mock.Mock(), dumps=dumps)
+        dumps.assert_called_once_with({'a': 1, 'id': 12})
+        self.assertEqual('encoded', post.call_args[1]['data'])
+
+    def test_notification_worker_buries_malformed_raw_body(self):
+        task = mock.Mock(task_id=12, data={'callback_url': 'URL', 'raw_body': 'oops'})
+        task_queue = mock.Mock()
+        with mock.patch.object(requests, 'post', mock.Mock()) as post:
+            with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                notification_worker(task, task_queue)
+        self.assertFalse(post.called)
+        task_queue.put.assert_called_once_with((task, 'bury'))
+
+    def test_notification_batch_worker_splices_raw_bodies(self):
+        tasks = [
+            mock.Mock(task_id=1, data={'callback_url': 'URL', 'raw_body': '{"n":1}'}),
+            mock.Mock(task_id=2, data={'callback_url': 'URL', 'raw_body': 'broken'}),
+            mock.Mock(task_id=3, data={'callback_url': 'URL', 'n': 3}),
+        ]
+        task_queue = mock.Mock()
+        response = make_response(200, 'ok')
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=response)) as post:
+            with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                notification_pusher.notification_batch_worker(tasks, task_queue, 'URL')
+        self.assertEqual('[{"n":1,"id":1},{"id": 3, "n": 3}]', post.call_args[1]['data'])
+        self.assertEqual([
+            mock.call((tasks[1], 'bury')),
+            mock.call((tasks[0], 'ack')),
+            mock.call((tasks[2], 'ack')),
+        ], task_queue.put.call_args_list)
+
+    def test_read_response_keeps_prefix(self):
+        response = make_response(200, 'x' * 20000)
+        self.assertEqual((20000, False), notification_pusher.read_response(response, 30000, 10))
+        self.assertEqual('x' * 10, response.content)
+
+    def test_read_response_drops_connection_of_large_response(self):
+        response = make_response(200, 'x' * 20000)
+        connection = mock.Mock()
+        response.raw._connection = connection
+        received, truncated = notification_pusher.read_response(response, 100)
+        self.assertTrue(truncated)
+        self.assertEqual(received, len(response.content))
+        connection.close.assert_called_once_with()
+
+    def test_notification_worker_logs_error_body_prefix(self):
+        task = Task(12, {})
+        task.data = TaskData({"callback_url": "URL"})
+        response = make_response(500, '<html>' + 'x' * 5000)
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=response)) as post:
+            with mock.patch('source.notification_pusher.logger', mock.Mock()) as logger:
+                notification_worker(task, mock.Mock(), max_response_size=1000)
+        self.assertTrue(post.call_args[1]['stream'])
+        self.assertNotIn('max_response_size', post.call_args[1])
+        self.assertEqual(notification_pusher.RESPONSE_LOG_SIZE, len(response.content))
+        self.assertTrue(logger.warning.called)
+        self.assertIn("'<html>xxx", logger.info.call_args[0][0])
+
+    def test_get_batch_status_codes_ignores_mismatched_body(self):
+        response = mock.Mock(status_code=200)
+        response.json.return_value = [200]
+        self.assertEqual([200, 200], notification_pusher.get_batch_status_codes(response, 2))
+        response = mock.Mock(status_code=500)
+        self.assertEqual([500, 500], notification_pusher.get_batch_status_codes(response, 2))
+        self.assertFalse(response.json.called)
+
+    def test_done_with_processed_tasks_retry_releases_with_delay(self):
+        task_queue = gevent_queue.Queue()
+        task = mock.Mock(task_id='id1', taken_meta={'ctaken': 2})
+        task_queue.put((task, 'retry', {'retry_after': None}))
+        policy = RetryPolicy(max_attempts=3, base_delay=5, max_delay=30)
+        notification_pusher.done_with_processed_tasks(task_queue, retry_policy=policy)
+        task.release.assert_called_once_with(delay=10)
+
+    def test_done_with_processed_tasks_retry_buries_after_max_attempts(self):
+        task_queue = gevent_queue.Queue()
+        task = mock.Mock(task_id='id1', taken_meta=None)
+        task.meta.return_value = {'ctaken': 3}
+        task_queue.put((task, 'retry', {'retry_after': None}))
+        policy = RetryPolicy(max_attempts=3, base_delay=5, max_delay=30)
+        with mock.patch('source.notification_pusher.logger', mock.Mock()):
+            notification_pusher.done_with_processed_tasks(task_queue, retry_policy=policy)
+        task.bury.assert_called_once_with()
+        self.assertFalse(task.release.called)
+
+    def test_done_with_processed_tasks_retry_meta_database_error(self):
+        import tarantool
+        task_queue = gevent_queue.Queue()
+        task = mock.Mock(task_id='id1', taken_meta=None)
+        task.meta.side_effect = tarantool.DatabaseError()
+        task_queue.put((task, 'retry', {'retry_after': 7}))
+        policy = RetryPolicy(max_attempts=3, base_delay=5, max_delay=30)
+        with mock.patch('source.notification_pusher.logger', mock.Mock()):
+            notification_pusher.done_with_processed_tasks(task_queue, retry_policy=policy)
+        task.release.assert_called_once_with(delay=7)
+
     def test_done_with_processed_tasks_all_well(self):
         task_queue = mock.Mock()
         task_queue.qsize = mock.Mock(return_value=1)
@@ -104,6 +390,60 @@ class NotificationPusherTestCase(unittest.TestCase):
         self.assertFalse(logger.exception.called)
         self.assertFalse(task.some_method.called)
 
+    def test_done_with_processed_tasks_records_outcomes_by_host(self):
+        task_queue = gevent_queue.Queue()
+        acked = mock.Mock(data={'callback_url': 'http://a.ru/'})
+        retried = mock.Mock(data={'callback_url': 'http://b.ru/'}, taken_meta={'ctaken': 1})
+        task_queue.put((acked, 'ack'))
+        task_queue.put((retried, 'retry', {'retry_after': None}))
+        metrics = Metrics()
+        notification_pusher.done_with_processed_tasks(task_queue, retry_policy=RetryPolicy(5, 1, 10), metrics=metrics)
+        text = metrics.render()
+        self.assertIn('pusher_tasks_finished_total{host="a.ru",outcome="ack"} 1\n', text)
+        self.assertIn('pusher_tasks_finished_total{host="b.ru",outcome="retry"} 1\n', text)
+        self.assertTrue(retried.release.called)
+
+    def test_done_with_processed_tasks_batches_by_action(self):
+        task_queue = gevent_queue.Queue()
+        queue = mock.Mock()
+        tasks = [mock.Mock(queue=queue, task_id='id{}'.format(i), modified=False) for i in xrange(5)]
+        task_queue.put((tasks[0], 'ack'))
+        task_queue.put((tasks[1], 'bury'))
+        task_queue.put((tasks[2], 'ack'))
+        task_queue.put((tasks[3], 'ack'))
+        task_queue.put((tasks[4], 'release'))
+        mock_ack_batch = mock.Mock(return_value={})
+        mock_bury_batch = mock.Mock(return_value={})
+        with mock.patch.dict(notification_pusher.BATCH_ACTIONS, {'ack': mock_ack_batch, 'bury': mock_bury_batch}):
+            notification_pusher.done_with_processed_tasks(task_queue, batch_size=2)
+        self.assertEqual([
+            mock.call(queue, ['id0', 'id2']),
+            mock.call(queue, ['id3']),
+        ], mock_ack_batch.call_args_list)
+        mock_bury_batch.assert_called_once_with(queue, ['id1'])
+        tasks[4].release.assert_called_once_with()
+        self.assertFalse(tasks[0].ack.called)
+        self.assertTrue(all(task.modified for task in tasks[:4]))
+
+    def test_finish_tasks_batch_logs_failed_ids(self):
+        task = mock.Mock(task_id='id1')
+        logger = mock.Mock()
+        mock_ack_batch = mock.Mock(return_value={'id1': 'Task not found'})
+        with mock.patch.dict(notification_pusher.BATCH_ACTIONS, {'ack': mock_ack_batch}):
+            with mock.patch('source.notification_pusher.logger', logger):
+                notification_pusher.finish_tasks_batch('ack', [task])
+        self.assertTrue(logger.error.called)
+
+    def test_finish_tasks_batch_database_error(self):
+        import tarantool
+        task = mock.Mock(task_id='id1')
+        logger = mock.Mock()
+        mock_bury_batch = mock.Mock(side_effect=tarantool.DatabaseError())
+        with mock.patch.dict(notification_pusher.BATCH_ACTIONS, {'bury': mock_bury_batch}):
+            with mock.patch('source.notification_pusher.logger', logger):
+                notification_pusher.finish_tasks_batch('bury', [task])
+        self.assertTrue(logger.exception.called)
+
     def test_stop_handler(self):
         signum = 3
         old_run_application = notification_pusher.run_application
@@ -115,15 +455,7 @@ class NotificationPusherTestCase(unittest.TestCase):
         notification_pusher.exit_code = old_exit_code
 
     def test_main_loop_task_is_not_exist(self):
-        config = Config()
-        config.QUEUE_HOST = 'localhost'
-        config.QUEUE_PORT = 80
-        config.QUEUE_SPACE = 0
-        config.QUEUE_TUBE = 'name'
-        config.QUEUE_TAKE_TIMEOUT = 0
-        config.WORKER_POOL_SIZE = 1
-        config.SLEEP = 1
-        config.HTTP_CONNECTION_TIMEOUT = 2
+        config = get_main_loop_config()
         queue = mock.MagicMock()
         tube = mock.MagicMock()
         queue.tube = mock.Mock(return_value=tube)
@@ -145,15 +477,7 @@ class NotificationPusherTestCase(unittest.TestCase):
         notification_pusher.run_application = initial_run_application
 
     def test_main_loop_task_is_exist(self):
-        config = Config()
-        config.QUEUE_HOST = 'localhost'
-        config.QUEUE_PORT = 80
-        config.QUEUE_SPACE = 0
-        config.QUEUE_TUBE = 'name'
-        config.QUEUE_TAKE_TIMEOUT = 0
-        config.WORKER_POOL_SIZE = 1
-        config.SLEEP = 1
-        config.HTTP_CONNECTION_TIMEOUT = 2
+        config = get_main_loop_config()
         queue = mock.MagicMock()
         tube = mock.MagicMock()
         queue.tube = mock.Mock(return_value=tube)
@@ -169,11 +493,695 @@ class NotificationPusherTestCase(unittest.TestCase):
         with mock.patch('source.notification_pusher.tarantool_queue.Queue', mock.Mock(return_value=queue)) as Queue:
             with mock.patch('source.notification_pusher.done_with_processed_tasks', mock_done_with_processed_tasks):
                 with mock.patch('source.notification_pusher.sleep', mock_sleep):
-                    notification_pusher.main_loop(config)
+                    with mock.patch('source.notification_pusher.Greenlet', mock.Mock()):
+                        notification_pusher.main_loop(config)
         mock_done_with_processed_tasks.assert_called_once()
         mock_sleep.assert_called_once_with(config.SLEEP)
         notification_pusher.run_application = initial_run_application
 
+    def test_main_loop_takes_from_tube_set(self):
+        config = get_main_loop_config()
+        config.QUEUE_TUBES = [('high', 3), ('low', 1)]
+        config.QUEUE_TAKE_BATCH = True
+        queue = mock.MagicMock()
+        initial_run_application = notification_pusher.run_application
+
+        def break_run(*args, **kwargs):
+            notification_pusher.run_application = False
+
+        notification_pusher.run_application = True
+        with mock.patch('source.notification_pusher.tarantool_queue.Queue', mock.Mock(return_value=queue)):
+            with mock.patch('source.notification_pusher.take_batch', mock.Mock(return_value=[])) as take_batch:
+                with mock.patch('source.notification_pusher.sleep', mock.Mock(side_effect=break_run)):
+                    notification_pusher.main_loop(config)
+        notification_pusher.run_application = initial_run_application
+
+        self.assertFalse(queue.tube.called)
+        tube = take_batch.call_args[0][0]
+        self.assertIsInstance(tube, notification_pusher.TubeSet)
+        self.assertEqual(['high', 'low'], tube.names)
+
+    def test_main_loop_resident_workers_are_killed_on_error(self):
+        config = get_main_loop_config()
+        config.RESIDENT_WORKERS = True
+        config.WORKER_BUFFER_SIZE = 3
+        queue = mock.MagicMock()
+        initial_run_application = notification_pusher.run_application
+        notification_pusher.run_application = True
+        with mock.patch('source.notification_pusher.tarantool_queue.Queue', mock.Mock(return_value=queue)):
+            with mock.patch.object(ResidentPool, 'start', autospec=True) as start:
+                with mock.patch.object(ResidentPool, 'kill', autospec=True) as kill:
+                    with mock.patch('source.notification_pusher.take_tasks_polling', mock.Mock(side_effect=ValueError)):
+                        self.assertRaises(ValueError, notification_pusher.main_loop, config)
+        worker_pool = start.call_args[0][0]
+        self.assertEqual((config.WORKER_POOL_SIZE, 3), (worker_pool.size, worker_pool.buffer_size))
+        kill.assert_called_once_with(worker_pool)
+        notification_pusher.run_application = initial_run_application
+
+    def test_main_loop_with_acker(self):
+        config = get_main_loop_config()
+        config.ACKER_ENABLED = True
+        config.PROCESSED_QUEUE_SIZE = 5
+        queue = mock.MagicMock()
+        initial_run_application = notification_pusher.run_application
+
+        def break_run(*args, **kwargs):
+            notification_pusher.run_application = False
+
+        notification_pusher.run_application = True
+        acker = mock.Mock()
+        with mock.patch('source.notification_pusher.tarantool_queue.Queue', mock.Mock(return_value=queue)):
+            with mock.patch('source.notification_pusher.lock_connection', mock.Mock()) as lock_connection:
+                with mock.patch('source.notification_pusher.gevent.spawn', mock.Mock(return_value=acker)) as spawn:
+                    with mock.patch('source.notification_pusher.done_with_processed_tasks', mock.Mock()) as done:
+                        with mock.patch('source.notification_pusher.sleep', mock.Mock(side_effect=break_run)):
+                            with mock.patch('source.notification_pusher.Greenlet', mock.Mock()):
+                                notification_pusher.main_loop(config)
+        lock_connection.assert_called_once_with(queue, mock.ANY)
+        self.assertEqual(notification_pusher.run_acker, spawn.call_args[0][0])
+        processed_task_queue = spawn.call_args[0][1]
+        self.assertEqual(5, processed_task_queue.maxsize)
+        acker.join.assert_called_once_with()
+        acker.kill.assert_called_once_with()
+        done.assert_called_once_with(processed_task_queue, config.ACK_BATCH_SIZE, None, None)
+        notification_pusher.run_application = initial_run_application
+
+    def test_main_loop_registers_metrics(self):
+        config = get_main_loop_config()
+        queue = mock.MagicMock()
+        metrics = Metrics()
+        initial_run_application = notification_pusher.run_application
+
+        def break_run(*args, **kwargs):
+            notification_pusher.run_application = False
+
+        notification_pusher.run_application = True
+        with mock.patch('source.notification_pusher.tarantool_queue.Queue', mock.Mock(return_value=queue)):
+            with mock.patch('source.notification_pusher.sleep', mock.Mock(side_effect=break_run)):
+                with mock.patch('source.notification_pusher.Greenlet', mock.Mock()):
+                    notification_pusher.main_loop(config, metrics)
+        self.assertIn('pusher_workers_busy', metrics.gauges)
+        notification_pusher.run_application = initial_run_application
+
+    def test_run_main_loop_serves_metrics_across_restarts(self):
+        config = get_main_loop_config()
+        config.METRICS_PORT = 9110
+        config.SLEEP_ON_FAIL = 0
+        pywsgi = mock.Mock()
+        initial_run_application = notification_pusher.run_application
+        loops = []
+
+        def run_loop(config, metrics):
+            loops.append(metrics)
+            if len(loops) == 2:
+                notification_pusher.run_application = False
+            else:
+                raise Exception('restart')
+
+        notification_pusher.run_application = True
+        with mock.patch.dict('sys.modules', {'gevent.pywsgi': pywsgi}):
+            with mock.patch('source.notification_pusher.main_loop', mock.Mock(side_effect=run_loop)):
+                with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                    notification_pusher.run_main_loop(config)
+        notification_pusher.run_application = initial_run_application
+        address, app = pywsgi.WSGIServer.call_args[0]
+        self.assertEqual(('127.0.0.1', 9110), address)
+        self.assertIsInstance(loops[0], Metrics)
+        self.assertIs(loops[0], loops[1])
+        self.assertEqual(loops[0].wsgi_app, app)
+        pywsgi.WSGIServer.return_value.start.assert_called_once_with()
+        pywsgi.WSGIServer.return_value.stop.assert_called_once_with()
+
+    def test_run_main_loop_without_metrics_when_port_is_busy(self):
+        config = get_main_loop_config()
+        config.METRICS_PORT = 9110
+        pywsgi = mock.Mock()
+        pywsgi.WSGIServer.return_value.start.side_effect = socket.error(98, 'Address already in use')
+        initial_run_application = notification_pusher.run_application
+
+        def break_run(*args, **kwargs):
+            notification_pusher.run_application = False
+
+        notification_pusher.run_application = True
+        with mock.patch.dict('sys.modules', {'gevent.pywsgi': pywsgi}):
+            with mock.patch('source.notification_pusher.main_loop', mock.Mock(side_effect=break_run)) as loop:
+                with mock.patch('source.notification_pusher.logger', mock.Mock()) as logger:
+                    notification_pusher.run_main_loop(config)
+        notification_pusher.run_application = initial_run_application
+        loop.assert_called_once_with(config, None)
+        self.assertTrue(logger.exception.called)
+        self.assertFalse(pywsgi.WSGIServer.return_value.stop.called)
+
+    def test_run_acker_flushes_and_warns_on_lag(self):
+        config = get_main_loop_config()
+        config.ACK_LAG_WARNING = 1
+        initial_run_application = notification_pusher.run_application
+        notification_pusher.run_application = True
+        task_queue = mock.Mock(last_wait=2)
+        task_queue.peek = mock.Mock(side_effect=[gevent_queue.Empty(), 'item'])
+        logger = mock.Mock()
+
+        def done(*args):
+            notification_pusher.run_application = False
+
+        with mock.patch('source.notification_pusher.done_with_processed_tasks', mock.Mock(side_effect=done)) as mock_done:
+            with mock.patch('source.notification_pusher.logger', logger):
+                with mock.patch('source.notification_pusher.current_thread', mock.Mock()):
+                    notification_pusher.run_acker(task_queue, config)
+        mock_done.assert_called_once_with(task_queue, config.ACK_BATCH_SIZE, None, None)
+        self.assertTrue(logger.warning.called)
+        notification_pusher.run_application = initial_run_application
+
+    def test_main_loop_event_intake_does_not_sleep(self):
+        config = get_main_loop_config()
+        config.QUEUE_INTAKE_MODE = notification_pusher.INTAKE_EVENT
+        queue = mock.MagicMock()
+        initial_run_application = notification_pusher.run_application
+
+        def break_run(*args, **kwargs):
+            notification_pusher.run_application = False
+
+        notification_pusher.run_application = True
+        mock_take_task_event = mock.Mock()
+        mock_sleep = mock.Mock()
+        with mock.patch('source.notification_pusher.tarantool_queue.Queue', mock.Mock(return_value=queue)):
+            with mock.patch('source.notification_pusher.done_with_processed_tasks', mock.Mock(side_effect=break_run)):
+                with mock.patch('source.notification_pusher.take_task_event', mock_take_task_event):
+                    with mock.patch('source.notification_pusher.sleep', mock_sleep):
+                        notification_pusher.main_loop(config)
+        self.assertEqual(1, mock_take_task_event.call_count)
+        self.assertFalse(mock_sleep.called)
+        notification_pusher.run_application = initial_run_application
+
+    def test_take_task_event_waits_for_free_worker_and_long_polls(self):
+        config = get_main_loop_config()
+        tube = mock.Mock()
+        task = mock.Mock()
+        tube.take = mock.Mock(return_value=task)
+        dispatcher = mock.Mock()
+        dispatcher.free_count = mock.Mock(return_value=1)
+        notification_pusher.take_task_event(tube, dispatcher, config)
+        dispatcher.wait_available.assert_called_once_with()
+        tube.take.assert_called_once_with(config.QUEUE_LONG_POLL_TIMEOUT)
+        dispatcher.dispatch.assert_called_once_with(task)
+
+    def test_take_task_event_does_not_take_after_stop(self):
+        config = get_main_loop_config()
+        tube = mock.Mock()
+        dispatcher = mock.Mock()
+        initial_run_application = notification_pusher.run_application
+
+        def stop():
+            notification_pusher.run_application = False
+
+        dispatcher.wait_available = mock.Mock(side_effect=stop)
+        notification_pusher.run_application = True
+        notification_pusher.take_task_event(tube, dispatcher, config)
+        notification_pusher.run_application = initial_run_application
+        self.assertFalse(tube.take.called)
+        self.assertFalse(dispatcher.run_scheduled.called)
+        self.assertFalse(dispatcher.dispatch.called)
+
+    def test_take_task_event_releases_tasks_taken_after_stop(self):
+        config = get_main_loop_config()
+        task = mock.Mock()
+        tube = mock.Mock()
+        dispatcher = mock.Mock()
+        dispatcher.free_count = mock.Mock(return_value=1)
+        initial_run_application = notification_pusher.run_application
+
+        def take(timeout):
+            notification_pusher.run_application = False
+            return task
+
+        tube.take = mock.Mock(side_effect=take)
+        notification_pusher.run_application = True
+        notification_pusher.take_task_event(tube, dispatcher, config)
+        notification_pusher.run_application = initial_run_application
+        dispatcher.release.assert_called_once_with(task, 0)
+        self.assertFalse(dispatcher.dispatch.called)
+
+    def test_take_task_event_batch(self):
+        config = get_main_loop_config()
+        config.QUEUE_TAKE_BATCH = True
+        tube = mock.Mock()
+        dispatcher = mock.Mock()
+        dispatcher.free_count = mock.Mock(return_value=3)
+        tasks = [mock.Mock(), mock.Mock()]
+        with mock.patch('source.notification_pusher.take_batch', mock.Mock(return_value=tasks)) as take_batch:
+            notification_pusher.take_task_event(tube, dispatcher, config)
+        take_batch.assert_called_once_with(tube, 3, config.QUEUE_LONG_POLL_TIMEOUT)
+        self.assertEqual([mock.call(tasks[0]), mock.call(tasks[1])], dispatcher.dispatch.call_args_list)
+        self.assertFalse(tube.take.called)
+
+    def test_take_task_event_nothing_to_take(self):
+        config = get_main_loop_config()
+        tube = mock.Mock()
+        dispatcher = mock.Mock()
+        dispatcher.free_count = mock.Mock(return_value=0)
+        with mock.patch('source.notification_pusher.sleep', mock.Mock()) as mock_sleep:
+            notification_pusher.take_task_event(tube, dispatcher, config)
+        mock_sleep.assert_called_once_with(config.SLEEP)
+        self.assertFalse(tube.take.called)
+
+    def test_take_tasks_polling_batch(self):
+        config = get_main_loop_config()
+        config.QUEUE_TAKE_BATCH = True
+        tube = mock.Mock()
+        dispatcher = mock.Mock()
+        dispatcher.free_count = mock.Mock(return_value=4)
+        task = mock.Mock()
+        with mock.patch('source.notification_pusher.take_batch', mock.Mock(return_value=[task])) as take_batch:
+            notification_pusher.take_tasks_polling(tube, dispatcher, config)
+        take_batch.assert_called_once_with(tube, 4, config.QUEUE_TAKE_TIMEOUT)
+        dispatcher.dispatch.assert_called_once_with(task)
+        self.assertFalse(tube.take.called)
+
+    def test_take_tasks_polling_batch_no_free_workers(self):
+        config = get_main_loop_config()
+        config.QUEUE_TAKE_BATCH = True
+        dispatcher = mock.Mock()
+        dispatcher.free_count = mock.Mock(return_value=0)
+        with mock.patch('source.notification_pusher.take_batch', mock.Mock()) as take_batch:
+            notification_pusher.take_tasks_polling(mock.Mock(), dispatcher, config)
+        self.assertFalse(take_batch.called)
+
+    def test_take_tasks_polling_stops_on_empty_tube(self):
+        config = get_main_loop_config()
+        tube = mock.Mock()
+        task = mock.Mock()
+        tube.take = mock.Mock(side_effect=[task, None, mock.Mock()])
+        dispatcher = mock.Mock()
+        dispatcher.free_count = mock.Mock(return_value=3)
+        notification_pusher.take_tasks_polling(tube, dispatcher, config)
+        self.assertEqual(2, tube.take.call_count)
+        dispatcher.dispatch.assert_called_once_with(task)
+        self.assertEqual([mock.call(1), mock.call(0)], dispatcher.record_take.call_args_list)
+
+    def test_take_task_event_timeout(self):
+        config = get_main_loop_config()
+        tube = mock.Mock()
+        tube.take = mock.Mock(return_value=None)
+        dispatcher = mock.Mock()
+        dispatcher.free_count = mock.Mock(return_value=1)
+        notification_pusher.take_task_event(tube, dispatcher, config)
+        self.assertFalse(dispatcher.dispatch.called)
+        dispatcher.record_take.assert_called_once_with(0)
+
+    def test_dispatcher_records_takes_and_queue_wait(self):
+        config = get_main_loop_config()
+        metrics = Metrics(buckets=(1.0, 10.0))
+        dispatcher = notification_pusher.Dispatcher(mock.Mock(), mock.Mock(), config, mock.Mock(), metrics=metrics)
+        self.assertIn(metrics, dispatcher.observers)
+        task = mock.Mock(data={'callback_url': 'http://fast.ru/'}, taken_meta={'created': 1000000, 'now': 3500000})
+        dispatcher.record_take(0)
+        dispatcher.record_take(1)
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()):
+            dispatcher.dispatch(task)
+        text = metrics.render()
+        self.assertIn('pusher_take_timeouts_total 1\n', text)
+        self.assertIn('pusher_tasks_taken_total 1\n', text)
+        self.assertIn('pusher_queue_wait_seconds_bucket{le="10.0"} 1\n', text)
+        self.assertIn('pusher_queue_wait_seconds_sum 2.5\n', text)
+
+    def test_dispatcher_without_metrics_ignores_takes(self):
+        dispatcher = notification_pusher.Dispatcher(mock.Mock(), mock.Mock(), get_main_loop_config(), mock.Mock())
+        dispatcher.record_take(1)
+        self.assertIsNone(dispatcher.metrics)
+
+    def test_register_gauges(self):
+        worker_pool = mock.MagicMock()
+        worker_pool.__len__.return_value = 3
+        worker_pool.free_count = mock.Mock(return_value=7)
+        processed_task_queue = notification_pusher.TimedQueue()
+        processed_task_queue.max_wait = 2.0
+        scheduler = HostScheduler(1, 10)
+        scheduler.push('a.ru', mock.Mock())
+        dispatcher = notification_pusher.Dispatcher(
+            worker_pool, processed_task_queue, get_main_loop_config(), mock.Mock(), scheduler=scheduler
+        )
+        metrics = Metrics()
+        notification_pusher.register_gauges(metrics, dispatcher)
+        text = metrics.render()
+        self.assertIn('pusher_workers_busy 3\n', text)
+        self.assertIn('pusher_workers_free 7\n', text)
+        self.assertIn('pusher_processed_queue_size 0\n', text)
+        self.assertIn('pusher_ack_lag_max_seconds 2.0\n', text)
+        self.assertIn('pusher_scheduler_pending 1\n', text)
+        self.assertNotIn('pusher_coalescer_pending', text)
+        self.assertIn('pusher_ack_lag_max_seconds 2.0\n', metrics.render())
+
+    def test_dispatcher_without_scheduler_starts_worker(self):
+        config = get_main_loop_config()
+        worker_pool = mock.Mock()
+        dispatcher = notification_pusher.Dispatcher(worker_pool, mock.Mock(), config, mock.Mock())
+        task = mock.Mock(data={'callback_url': 'http://fast.ru/'})
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            dispatcher.dispatch(task)
+        worker_pool.add.assert_called_once_with(greenlet.return_value)
+        greenlet.return_value.start.assert_called_once_with()
+
+    def test_dispatcher_breaker_releases_task_for_open_host(self):
+        config = get_main_loop_config()
+        worker_pool = mock.Mock()
+        breaker = mock.Mock()
+        breaker.allow.return_value = False
+        breaker.retry_delay.return_value = 12
+        dispatcher = notification_pusher.Dispatcher(worker_pool, mock.Mock(), config, mock.Mock(), breaker=breaker)
+        task = mock.Mock(task_id=1, data={'callback_url': 'http://down.ru/path'})
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            dispatcher.dispatch(task)
+        breaker.allow.assert_called_once_with('down.ru')
+        assert_released_untaken(task, 12)
+        self.assertFalse(greenlet.called)
+        self.assertEqual([breaker], dispatcher.observers)
+
+    def test_dispatcher_breaker_releases_do_not_count_as_attempts(self):
+        class Queue(object):
+            space = 0
+
+            def __init__(self):
+                self.tnt = self
+                self.ctaken = 0
+
+            def take(self):
+                self.ctaken += 1
+                return mock.Mock(
+                    task_id=1, queue=self, taken_meta={'ctaken': self.ctaken},
+                    data={'callback_url': 'http://down.ru/'}
+                )
+
+            def call(self, procedure, args):
+                if procedure == 'queue.release_untaken':
+                    self.ctaken -= 1
+
+        config = get_main_loop_config()
+        breaker = mock.Mock()
+        breaker.allow.side_effect = [False, False, False, True]
+        breaker.retry_delay.return_value = 5
+        task_queue = gevent_queue.Queue()
+        dispatcher = notification_pusher.Dispatcher(
+            mock.Mock(), task_queue, config, mock.Mock(), breaker=breaker
+        )
+        queue = Queue()
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            for _ in xrange(4):
+                task = queue.take()
+                dispatcher.dispatch(task)
+        self.assertEqual(1, greenlet.call_count)
+        self.assertEqual({'ctaken': 1}, task.taken_meta)
+
+        with mock.patch.object(requests, 'post', mock.Mock(return_value=make_response(503))):
+            notification_worker(task, task_queue, retry_policy=RetryPolicy(2, 5, 30))
+        notification_pusher.done_with_processed_tasks(task_queue, retry_policy=RetryPolicy(2, 5, 30))
+        task.release.assert_called_once_with(delay=5)
+        self.assertFalse(task.bury.called)
+
+    def test_dispatcher_releases_task_without_time_to_finish(self):
+        config = get_main_loop_config()
+        ttr_guard = mock.Mock()
+        ttr_guard.can_finish.return_value = False
+        ttr_guard.time_left.return_value = 0.5
+        metrics = Metrics()
+        dispatcher = notification_pusher.Dispatcher(
+            mock.Mock(), mock.Mock(), config, mock.Mock(), metrics=metrics, ttr_guard=ttr_guard
+        )
+        task = mock.Mock(task_id=1, data={'callback_url': 'http://slow.ru/'}, taken_meta=None)
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            dispatcher.dispatch(task)
+        assert_released_untaken(task, 0)
+        self.assertFalse(greenlet.called)
+        self.assertIn('pusher_tasks_skipped_total 1\n', metrics.render())
+
+    def test_dispatcher_bounds_timeout_and_tracks_task(self):
+        config = get_main_loop_config()
+        config.HTTP_CONNECTION_TIMEOUT = 30
+        ttr_guard = mock.Mock()
+        ttr_guard.can_finish.return_value = True
+        ttr_guard.timeout.return_value = 4
+        on_done = mock.Mock()
+        dispatcher = notification_pusher.Dispatcher(
+            mock.Mock(), mock.Mock(), config, mock.Mock(), ttr_guard=ttr_guard
+        )
+        task = mock.Mock(task_id=1, data={'callback_url': 'http://fast.ru/'})
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            dispatcher.launch(task, on_done=on_done)
+        ttr_guard.timeout.assert_called_once_with([task], 30)
+        ttr_guard.track.assert_called_once_with([task])
+        self.assertEqual(4, greenlet.call_args[1]['timeout'])
+
+        greenlet.return_value.link.call_args[0][0](None)
+        ttr_guard.untrack.assert_called_once_with([task])
+        on_done.assert_called_once_with()
+
+    def test_dispatcher_touch_expiring(self):
+        touched, gone = mock.Mock(task_id=1), mock.Mock(task_id=2)
+        gone.touch.side_effect = notification_pusher.tarantool.DatabaseError(1, 'Task is not taken')
+        ttr_guard = mock.Mock()
+        ttr_guard.expiring.return_value = [touched, gone]
+        dispatcher = notification_pusher.Dispatcher(
+            mock.Mock(), mock.Mock(), get_main_loop_config(), mock.Mock(), ttr_guard=ttr_guard
+        )
+        dispatcher.touch_expiring()
+        touched.touch.assert_called_once_with()
+        ttr_guard.untrack.assert_called_once_with([gone])
+
+    def test_run_toucher(self):
+        config = get_main_loop_config()
+        config.TTR_TOUCH_MARGIN = 4
+        dispatcher = mock.Mock()
+        initial_run_application = notification_pusher.run_application
+
+        def break_run(*args, **kwargs):
+            notification_pusher.run_application = False
+
+        notification_pusher.run_application = True
+        with mock.patch('source.notification_pusher.sleep', mock.Mock(side_effect=break_run)) as sleep:
+            notification_pusher.run_toucher(dispatcher, config)
+        notification_pusher.run_application = initial_run_application
+        dispatcher.touch_expiring.assert_called_once_with()
+        sleep.assert_called_once_with(2.0)
+
+    def test_dispatcher_breaker_releases_scheduled_host_slot(self):
+        config = get_main_loop_config()
+        config.SCHEDULER_MAX_PENDING = 10
+        worker_pool = mock.Mock()
+        worker_pool.free_count = mock.Mock(return_value=5)
+        scheduler = HostScheduler(host_limit=1, host_queue_size=5)
+        breaker = mock.Mock()
+        breaker.allow.side_effect = lambda host: host != 'down.ru'
+        breaker.retry_delay.return_value = 0
+        dispatcher = notification_pusher.Dispatcher(
+            worker_pool, mock.Mock(), config, mock.Mock(), scheduler, breaker=breaker
+        )
+        down = mock.Mock(task_id=1, data={'callback_url': 'http://down.ru/'})
+        up = mock.Mock(task_id=2, data={'callback_url': 'http://up.ru/'})
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            dispatcher.dispatch(down)
+            dispatcher.dispatch(up)
+        assert_released_untaken(down, config.CIRCUIT_BREAKER_RESET_TIMEOUT)
+        self.assertEqual(1, greenlet.call_count)
+        self.assertEqual({'up.ru': 1}, scheduler.in_flight)
+
+    def test_dispatcher_with_scheduler_limits_host(self):
+        config = get_main_loop_config()
+        config.SCHEDULER_MAX_PENDING = 10
+        config.HOST_OVERFLOW_DELAY = 3
+        worker_pool = mock.Mock()
+        worker_pool.free_count = mock.Mock(return_value=5)
+        scheduler = HostScheduler(host_limit=1, host_queue_size=1)
+        dispatcher = notification_pusher.Dispatcher(worker_pool, mock.Mock(), config, mock.Mock(), scheduler)
+        tasks = [mock.Mock(task_id=i, data={'callback_url': 'http://slow.ru/{}'.format(i)}) for i in xrange(3)]
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            for task in tasks:
+                dispatcher.dispatch(task)
+        self.assertEqual(1, greenlet.call_count)
+        self.assertEqual(1, len(scheduler))
+        self.assertEqual(9, dispatcher.free_count())
+        assert_released_untaken(tasks[2], 3)
+
+    def test_dispatcher_coalesces_tasks_by_url(self):
+        config = get_main_loop_config()
+        config.COALESCE_MAX_PENDING = 10
+        worker_pool = mock.Mock()
+        worker_pool.free_count = mock.Mock(return_value=3)
+        coalescer = Coalescer(['http://bulk.ru/'], window=60, max_size=2)
+        dispatcher = notification_pusher.Dispatcher(
+            worker_pool, mock.Mock(), config, mock.Mock(), coalescer=coalescer
+        )
+        tasks = [mock.Mock(task_id=i, data={'callback_url': 'http://bulk.ru/'}) for i in xrange(3)]
+        single = mock.Mock(task_id=9, data={'callback_url': 'http://single.ru/'})
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            for task in tasks + [single]:
+                dispatcher.dispatch(task)
+        self.assertEqual(2, greenlet.call_count)
+        batch_call, single_call = greenlet.call_args_list
+        self.assertEqual(notification_pusher.notification_batch_worker, batch_call[0][0])
+        self.assertEqual(tasks[:2], batch_call[0][1])
+        self.assertEqual('http://bulk.ru/', batch_call[0][3])
+        self.assertEqual(notification_pusher.notification_worker, single_call[0][0])
+        self.assertEqual(1, len(coalescer))
+        self.assertEqual(3, dispatcher.free_count())
+        config.COALESCE_MAX_PENDING = 2
+        self.assertEqual(1, dispatcher.free_count())
+
+    def test_dispatcher_coalesced_batch_respects_breaker(self):
+        config = get_main_loop_config()
+        config.COALESCE_MAX_PENDING = 10
+        worker_pool = mock.Mock()
+        worker_pool.free_count = mock.Mock(return_value=3)
+        breaker = mock.Mock()
+        breaker.allow.return_value = False
+        breaker.retry_delay.return_value = 5
+        coalescer = Coalescer(['http://bulk.ru/'], window=0, max_size=10)
+        dispatcher = notification_pusher.Dispatcher(
+            worker_pool, mock.Mock(), config, mock.Mock(), breaker=breaker, coalescer=coalescer
+        )
+        task = mock.Mock(task_id=1, data={'callback_url': 'http://bulk.ru/'})
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            dispatcher.dispatch(task)
+        breaker.allow.assert_called_once_with('bulk.ru')
+        assert_released_untaken(task, 5)
+        self.assertFalse(greenlet.called)
+
+    def test_dispatcher_submits_to_resident_pool(self):
+        config = get_main_loop_config()
+        worker_pool = ResidentPool(size=1, buffer_size=5)
+        task_queue = mock.Mock()
+        dispatcher = notification_pusher.Dispatcher(worker_pool, task_queue, config, mock.Mock())
+        task = mock.Mock(data={'callback_url': 'http://fast.ru/'})
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            dispatcher.dispatch(task)
+        self.assertFalse(greenlet.called)
+        run, args, kwargs, callback = worker_pool.buffer.get_nowait()
+        self.assertEqual(notification_pusher.notification_worker, run)
+        self.assertEqual((task, task_queue), args)
+        self.assertEqual(config.HTTP_CONNECTION_TIMEOUT, kwargs['timeout'])
+
+    def test_dispatcher_free_workers_respects_limiter(self):
+        worker_pool = mock.MagicMock()
+        worker_pool.free_count = mock.Mock(return_value=7)
+        worker_pool.__len__ = mock.Mock(return_value=3)
+        limiter = mock.Mock(limit=5)
+        dispatcher = notification_pusher.Dispatcher(
+            worker_pool, mock.Mock(), get_main_loop_config(), mock.Mock(), limiter=limiter
+        )
+        self.assertEqual(2, dispatcher.free_count())
+        limiter.limit = 2
+        self.assertEqual(0, dispatcher.free_count())
+        self.assertEqual([limiter], dispatcher.observers)
+
+    def test_dispatcher_scheduled_worker_releases_host(self):
+        config = get_main_loop_config()
+        worker_pool = mock.Mock()
+        worker_pool.free_count = mock.Mock(side_effect=[1, 0])
+        scheduler = mock.Mock()
+        scheduler.pop = mock.Mock(return_value=('host.ru', mock.Mock()))
+        dispatcher = notification_pusher.Dispatcher(worker_pool, mock.Mock(), config, mock.Mock(), scheduler)
+        with mock.patch('source.notification_pusher.Greenlet', mock.Mock()) as greenlet:
+            dispatcher.run_scheduled()
+        callback = greenlet.return_value.link.call_args[0][0]
+        callback(greenlet.return_value)
+        scheduler.release.assert_called_once_with('host.ru')
+
+    def test_dispatcher_drain_releases_unstarted_tasks(self):
+        config = get_main_loop_config()
+        config.COALESCE_WINDOW = 1
+        worker_pool = ResidentPool(1, 5)
+        scheduler = HostScheduler(1, 5)
+        coalescer = Coalescer(['http://bulk.ru/'], 1, 10)
+        scheduled, coalesced, buffered, batched = [mock.Mock() for _ in xrange(4)]
+        scheduler.push('a.ru', scheduled)
+        coalescer.add('http://bulk.ru/', coalesced)
+        worker_pool.submit(notification_pusher.notification_worker, (buffered, mock.Mock()))
+        worker_pool.submit(notification_pusher.notification_batch_worker, ([batched], mock.Mock(), 'http://bulk.ru/'))
+        dispatcher = notification_pusher.Dispatcher(
+            worker_pool, gevent_queue.Queue(), config, mock.Mock(), scheduler, coalescer=coalescer
+        )
+        self.assertTrue(dispatcher.drain(0))
+        for task in (scheduled, coalesced, buffered, batched):
+            assert_released_untaken(task, 0)
+        self.assertEqual(0, len(scheduler) + len(coalescer) + len(worker_pool))
+
+    def test_dispatcher_resident_job_checks_ttr_on_start(self):
+        config = get_main_loop_config()
+        config.HTTP_CONNECTION_TIMEOUT = 30
+        worker_pool = ResidentPool(1, 5)
+        dispatcher = notification_pusher.Dispatcher(
+            worker_pool, mock.Mock(), config, mock.Mock(), ttr_guard=TtrGuard(2)
+        )
+        taken_meta = {'event': 10000000, 'created': 0, 'ttl': 100000000, 'ttr': 10000000, 'ctaken': 1, 'now': 0}
+        run = mock.Mock()
+        with mock.patch('time.time', mock.Mock(return_value=100)):
+            waiting, late = [MetaTask(mock.Mock(space=0), taken_meta=taken_meta, task_id=i) for i in (1, 2)]
+            dispatcher.spawn(run, waiting)
+            dispatcher.spawn(run, late)
+        jobs = [worker_pool.buffer.get_nowait() for _ in xrange(2)]
+        self.assertEqual([10, 10], [kwargs['timeout'] for _, _, kwargs, _ in jobs])
+
+        job_run, args, kwargs, _ = jobs[0]
+        with mock.patch('time.time', mock.Mock(return_value=104)):
+            job_run(*args, **kwargs)
+        run.assert_called_once_with(waiting, args[1], **dict(kwargs, timeout=6))
+
+        job_run, args, kwargs, _ = jobs[1]
+        with mock.patch('time.time', mock.Mock(return_value=109)):
+            job_run(*args, **kwargs)
+        self.assertEqual(1, run.call_count)
+        late.queue.tnt.call.assert_called_once_with('queue.release_untaken', ('0', '2', '0'))
+
+    def test_dispatcher_drain_untracks_unstarted_tasks(self):
+        config = get_main_loop_config()
+        config.TTR_TOUCH_MARGIN = 10
+        worker_pool = ResidentPool(1, 5)
+        scheduler = HostScheduler(1, 5)
+        ttr_guard = TtrGuard(0, config.TTR_TOUCH_MARGIN)
+        taken_meta = {'event': 1000000, 'created': 0, 'ttl': 100000000, 'ttr': 1000000, 'ctaken': 1, 'now': 0}
+        task = MetaTask(mock.Mock(space=0), taken_meta=taken_meta, task_id=1)
+        scheduler.push('a.ru', task)
+        dispatcher = notification_pusher.Dispatcher(
+            worker_pool, gevent_queue.Queue(), config, mock.Mock(), scheduler, ttr_guard=ttr_guard
+        )
+        dispatcher.run_scheduled()
+        self.assertEqual([task], ttr_guard.expiring())
+        self.assertEqual({'a.ru': 1}, scheduler.in_flight)
+
+        self.assertTrue(dispatcher.drain(0))
+        task.queue.tnt.call.assert_called_once_with('queue.release_untaken', ('0', '1', '0'))
+        self.assertEqual(0, len(ttr_guard))
+        self.assertEqual({}, scheduler.in_flight)
+
+    def test_dispatcher_drain_waits_for_workers_and_flushes(self):
+        config = get_main_loop_config()
+        config.SLEEP = 0.01
+        processed_task_queue = notification_pusher.TimedQueue(1)
+        tasks = [mock.Mock(task_id=number) for number in xrange(3)]
+
+        def run(task):
+            gevent.sleep(0.01)
+            processed_task_queue.put((task, 'ack'))
+
+        worker_pool = Pool(3)
+        for task in tasks:
+            worker_pool.spawn(run, task)
+        dispatcher = notification_pusher.Dispatcher(worker_pool, processed_task_queue, config, mock.Mock())
+        with gevent.Timeout(1):
+            self.assertTrue(dispatcher.drain(1))
+        for task in tasks:
+            task.ack.assert_called_once_with()
+        self.assertEqual(0, processed_task_queue.qsize())
+
+    def test_dispatcher_drain_gives_up_after_timeout(self):
+        config = get_main_loop_config()
+        config.SLEEP = 0.01
+        worker_pool = Pool(1)
+        worker = worker_pool.spawn(gevent.sleep, 1)
+        dispatcher = notification_pusher.Dispatcher(worker_pool, gevent_queue.Queue(), config, mock.Mock())
+        with mock.patch('source.notification_pusher.logger', mock.Mock()) as logger:
+            self.assertFalse(dispatcher.drain(0.02))
+        self.assertTrue(logger.warning.called)
+        worker.kill()
+
     def test_parse_cmd_args(self):
         mock_args = '12'
         with mock.patch('source.lib.utils.argparse.ArgumentParser.parse_args', mock.Mock()) as mock_parse:
@@ -245,8 +1253,10 @@ class NotificationPusherTestCase(unittest.TestCase):
     def test_main_daemon_and_pidfile_given_and_main_loop_is_fine(self):
         mock_argv = [1, 1, 1]
         mock_parse_cmd_args = mock.Mock()
+        mock_parse_cmd_args.return_value.workers = 1
         config = Config()
         config.LOGGING = mock.Mock()
+        config.METRICS_PORT = 0
         mock_dictConfig = mock.Mock()
         initial_run_application = notification_pusher.run_application
 
@@ -274,16 +1284,220 @@ class NotificationPusherTestCase(unittest.TestCase):
         mock_daemonize.assert_called_once_with()
         mock_create_pidfile.assert_called()
         mock_dictConfig.assert_called_once_with(config.LOGGING)
-        mock_main_loop.assert_called_once_with(config)
+        mock_main_loop.assert_called_once_with(config, None)
         assert notification_pusher.exit_code == exit_code
         notification_pusher.run_application = initial_run_application
 
+    def test_main_with_workers_runs_prefork(self):
+        mock_parse_cmd_args = mock.Mock()
+        mock_parse_cmd_args.return_value.daemon = False
+        mock_parse_cmd_args.return_value.pidfile = None
+        mock_parse_cmd_args.return_value.workers = 4
+        mock_parse_cmd_args.return_value.config = 'config.py'
+        config = Config()
+        config.LOGGING = mock.Mock()
+        with mock.patch('source.notification_pusher.parse_cmd_args', mock_parse_cmd_args):
+            with mock.patch('source.notification_pusher.load_config_from_pyfile', mock.Mock(return_value=config)):
+                with mock.patch('source.notification_pusher.dictConfig', mock.Mock()):
+                    with mock.patch('source.notification_pusher.patch_all', mock.Mock()):
+                        with mock.patch('source.notification_pusher.install_signal_handlers', mock.Mock()):
+                            with mock.patch('source.notification_pusher.run_prefork', mock.Mock()) as prefork:
+                                with mock.patch('source.notification_pusher.main_loop', mock.Mock()) as loop:
+                                    notification_pusher.main(['pusher', '-c', 'config.py', '-w', '4'])
+        prefork.assert_called_once_with(config, 4)
+        self.assertFalse(loop.called)
+
+    def test_parse_cmd_args_workers(self):
+        args = notification_pusher.parse_cmd_args(['-c', 'config.py', '--workers', '3'])
+        self.assertEqual(3, args.workers)
+        self.assertEqual(1, notification_pusher.parse_cmd_args(['-c', 'config.py']).workers)
+
+    def test_spawn_child_returns_pid_in_parent(self):
+        with mock.patch('source.notification_pusher.os.fork', mock.Mock(return_value=42)):
+            with mock.patch('source.notification_pusher.run_main_loop', mock.Mock()) as run_main_loop:
+                self.assertEqual(42, notification_pusher.spawn_child(get_main_loop_config(), 0))
+        self.assertFalse(run_main_loop.called)
+
+    def test_spawn_child_runs_main_loop_and_exits_in_child(self):
+        config = get_main_loop_config()
+        config.SLEEP_ON_FAIL = 10
+        config.METRICS_PORT = 9110
+        with mock.patch('source.notification_pusher.os.fork', mock.Mock(return_value=0)):
+            with mock.patch('source.notification_pusher.os.getpid', mock.Mock(return_value=7)):
+                with mock.patch('source.notification_pusher.gevent.spawn', mock.Mock()) as spawn:
+                    with mock.patch('source.notification_pusher.run_main_loop', mock.Mock()) as run_main_loop:
+                        with mock.patch('source.notification_pusher.os._exit', mock.Mock()) as mock_exit:
+                            with mock.patch('source.notification_pusher.current_thread', mock.Mock()):
+                                with mock.patch('source.notification_pusher.logging.shutdown', mock.Mock()) as shutdown:
+                                    notification_pusher.spawn_child(config, 2)
+        spawn.assert_called_once_with(notification_pusher.watch_parent, 7, 10)
+        shutdown.assert_called_once_with()
+        run_main_loop.assert_called_once_with(config)
+        mock_exit.assert_called_once_with(notification_pusher.exit_code)
+        self.assertEqual(9112, config.METRICS_PORT)
+
+    def test_watch_parent_stops_orphan(self):
+        initial_run_application = notification_pusher.run_application
+        notification_pusher.run_application = True
+        with mock.patch('source.notification_pusher.os.getppid', mock.Mock(side_effect=[7, 1])):
+            with mock.patch('source.notification_pusher.sleep', mock.Mock()) as mock_sleep:
+                with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                    notification_pusher.watch_parent(7, 5)
+        self.assertFalse(notification_pusher.run_application)
+        mock_sleep.assert_called_once_with(5)
+        notification_pusher.run_application = initial_run_application
+
+    def test_reap_children(self):
+        children = {10: 0, 11: 1}
+        waitpid = mock.Mock(side_effect=lambda pid, options: (pid, 256) if pid == 11 else (0, 0))
+        with mock.patch('source.notification_pusher.os.waitpid', waitpid):
+            with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                self.assertEqual([1], notification_pusher.reap_children(children))
+        self.assertEqual({10: 0}, children)
+
+    def test_stop_children_forwards_signal_and_kills_stuck(self):
+        children = {10: 0, 11: 1}
+        waitpid = mock.Mock(side_effect=lambda pid, options: (pid, 0) if pid == 10 else (0, 0))
+        with mock.patch('source.notification_pusher.os.kill', mock.Mock()) as kill:
+            with mock.patch('source.notification_pusher.os.waitpid', waitpid):
+                with mock.patch('source.notification_pusher.time.time', mock.Mock(side_effect=[0, 0, 0, 100])):
+                    with mock.patch('source.notification_pusher.sleep', mock.Mock()):
+                        with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                            notification_pusher.stop_children(children, 2, 30)
+        self.assertIn(mock.call(10, 2), kill.call_args_list)
+        self.assertIn(mock.call(11, 2), kill.call_args_list)
+        self.assertIn(mock.call(11, notification_pusher.signal.SIGKILL), kill.call_args_list)
+        self.assertNotIn(mock.call(10, notification_pusher.signal.SIGKILL), kill.call_args_list)
+
+    def test_run_prefork_restarts_dead_child_and_forwards_stop_signal(self):
+        config = get_main_loop_config()
+        config.SLEEP_ON_FAIL = 0
+        config.WORKERS_SHUTDOWN_TIMEOUT = 30
+        initial_run_application = notification_pusher.run_application
+        initial_exit_code = notification_pusher.exit_code
+        notification_pusher.run_application = True
+        pids = iter(xrange(100, 110))
+        reaped = [[1], []]
+
+        def stop(*args):
+            if not reaped:
+                notification_pusher.stop_handler(15)
+
+        with mock.patch('source.notification_pusher.spawn_child', mock.Mock(side_effect=lambda c, n: next(pids))) as spawn:
+            with mock.patch('source.notification_pusher.reap_children',
+                            mock.Mock(side_effect=lambda children: reaped.pop(0))):
+                with mock.patch('source.notification_pusher.stop_children', mock.Mock()) as stop_children:
+                    with mock.patch('source.notification_pusher.sleep', mock.Mock(side_effect=stop)):
+                        with mock.patch('source.notification_pusher.logger', mock.Mock()):
+                            with mock.patch('source.notification_pusher.current_thread', mock.Mock()):
+                                notification_pusher.run_prefork(config, 2)
+        self.assertEqual(3, spawn.call_count)
+        self.assertEqual(1, spawn.call_args_list[-1][0][1])
+        stop_children.assert_called_once_with(mock.ANY, 15, 30)
+        notification_pusher.run_application = initial_run_application
+        notification_pusher.exit_code = initial_exit_code
+
+    def test_run_prefork_forwards_reload(self):
+        config = get_main_loop_config()
+        config.WORKERS_SHUTDOWN_TIMEOUT = 30
+        initial_run_application = notification_pusher.run_application
+        notification_pusher.run_application = True
+        notification_pusher.reload_requested = True
+
+        def stop(*args):
+            notification_pusher.run_application = False
+
+        with mock.patch('source.notification_pusher.spawn_child', mock.Mock(return_value=100)):
+            with mock.patch('source.notification_pusher.reap_children', mock.Mock(return_value=[])):
+                with mock.patch('source.notification_pusher.stop_children', mock.Mock()):
+                    with mock.patch('source.notification_pusher.apply_reload', mock.Mock()) as apply_reload:
+                        with mock.patch('source.notification_pusher.os.kill', mock.Mock()) as kill:
+                            with mock.patch('source.notification_pusher.sleep', mock.Mock(side_effect=stop)):
+                                notification_pusher.run_prefork(config, 1)
+        apply_reload.assert_called_once_with(config)
+        kill.assert_called_once_with(100, notification_pusher.signal.SIGHUP)
+        notification_pusher.run_application = initial_run_application
+        notification_pusher.reload_requested = False
+
+    def test_reload_handler(self):
+        with mock.patch('source.notification_pusher.logger', mock.Mock()):
+            notification_pusher.reload_handler(1)
+        self.assertTrue(notification_pusher.reload_requested)
+        notification_pusher.reload_requested = False
+
+    def test_apply_reload_resizes_pool_and_limit(self):
+        config = get_main_loop_config()
+        config.WORKER_POOL_SIZE = 10
+        config.LOGGING = {}
+        worker_pool = mock.Mock()
+        limiter = mock.Mock(limit=8, max_limit=10)
+        dispatcher = notification_pusher.Dispatcher(worker_pool, mock.Mock(), config, mock.Mock(), limiter=limiter)
+        notification_pusher.reload_requested = True
+        reload_config = mock.Mock(side_effect=lambda config, path, keys: setattr(config, 'WORKER_POOL_SIZE', 4) or {
+            'WORKER_POOL_SIZE': 4, 'LOGGING': {}
+        })
+        with mock.patch('source.notification_pusher.reload_config', reload_config):
+            with mock.patch('source.notification_pusher.apply_log_levels', mock.Mock()) as apply_log_levels:
+                changed = notification_pusher.apply_reload(config, dispatcher)
+        self.assertEqual(['LOGGING', 'WORKER_POOL_SIZE'], sorted(changed))
+        self.assertFalse(notification_pusher.reload_requested)
+        self.assertEqual(notification_pusher.RELOADABLE_KEYS, reload_config.call_args[0][2])
+        worker_pool.resize.assert_called_once_with(4)
+        self.assertEqual((4, 4), (limiter.max_limit, limiter.limit))
+        apply_log_levels.assert_called_once_with(config.LOGGING)
+
+    def test_apply_reload_updates_breaker_reset_timeout(self):
+        config = get_main_loop_config()
+        config.LOGGING = {}
+        breaker = CircuitBreaker(1, 30)
+        dispatcher = notification_pusher.Dispatcher(mock.Mock(), mock.Mock(), config, mock.Mock(), breaker=breaker)
+        reload_config = mock.Mock(side_effect=lambda config, path, keys: setattr(
+            config, 'CIRCUIT_BREAKER_RESET_TIMEOUT', 5
+        ) or {'CIRCUIT_BREAKER_RESET_TIMEOUT': 5})
+        with mock.patch('source.notification_pusher.reload_config', reload_config):
+            notification_pusher.apply_reload(config, dispatcher)
+        self.assertEqual(5, breaker.reset_timeout)
+        breaker.record('http://down.ru/', 0.1, None)
+        self.assertGreater(breaker.retry_delay('down.ru'), 0)
+        self.assertLessEqual(breaker.retry_delay('down.ru'), 5)
+
+    def test_apply_reload_keeps_config_on_error(self):
+        config = get_main_loop_config()
+        dispatcher = mock.Mock()
+        with mock.patch('source.notification_pusher.reload_config', mock.Mock(side_effect=SyntaxError)):
+            with mock.patch('source.notification_pusher.logger', mock.Mock()) as logger:
+                self.assertEqual({}, notification_pusher.apply_reload(config, dispatcher))
+        self.assertTrue(logger.exception.called)
+        self.assertFalse(dispatcher.resize.called)
+
+    def test_main_loop_applies_reload(self):
+        config = get_main_loop_config()
+        queue = mock.MagicMock()
+        initial_run_application = notification_pusher.run_application
+
+        def break_run(*args, **kwargs):
+            notification_pusher.run_application = False
+
+        notification_pusher.run_application = True
+        notification_pusher.reload_requested = True
+        with mock.patch('source.notification_pusher.tarantool_queue.Queue', mock.Mock(return_value=queue)):
+            with mock.patch('source.notification_pusher.apply_reload', mock.Mock()) as apply_reload:
+                with mock.patch('source.notification_pusher.sleep', mock.Mock(side_effect=break_run)):
+                    with mock.patch('source.notification_pusher.Greenlet', mock.Mock()):
+                        notification_pusher.main_loop(config)
+        apply_reload.assert_called_once_with(config, mock.ANY)
+        self.assertIsInstance(apply_reload.call_args[0][1], notification_pusher.Dispatcher)
+        notification_pusher.run_application = initial_run_application
+        notification_pusher.reload_requested = False
+
     def test_main_daemon_and_pidfile_given_and_main_loop_is_bad(self):
         mock_argv = [1, 1, 1]
         mock_parse_cmd_args = mock.Mock()
+        mock_parse_cmd_args.return_value.workers = 1
         config = Config()
         config.LOGGING = mock.Mock()
         config.SLEEP_ON_FAIL = 23
+        config.METRICS_PORT = 0
         mock_dictConfig = mock.Mock()
         initial_run_application = notification_pusher.run_application
 
@@ -317,7 +1531,7 @@ class NotificationPusherTestCase(unittest.TestCase):
         mock_daemonize.assert_called_once_with()
         mock_create_pidfile.assert_called()
         mock_dictConfig.assert_called_once_with(config.LOGGING)
-        mock_main_loop_exseption.assert_called_once_with(config)
+        mock_main_loop_exseption.assert_called_once_with(config, None)
         mock_sleep.assert_called_once_with(config.SLEEP_ON_FAIL)
         assert notification_pusher.exit_code == exit_code
         notification_pusher.run_application = initial_run_application
\ No newline at end of file
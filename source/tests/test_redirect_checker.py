@@ -27,6 +27,7 @@ class RedirectCheckerTestCase(unittest.TestCase):
         config.CHECK_URL = 'test_url'
         config.HTTP_TIMEOUT = 1
         config.WORKER_POOL_SIZE = 50
+        config.CONCURRENT_CHAINS = 0
         mock_spawn_workers = mock.Mock()
         mock_check_network_status = mock.Mock(return_value=True)
 
@@ -101,6 +102,71 @@ class RedirectCheckerTestCase(unittest.TestCase):
         mock_sleep.assert_called_once_with(config.SLEEP)
         redirect_checker.run_checker = True
 
+    def test_reload_workers_rolls_workers(self):
+        config = Config()
+        config.WORKER_POOL_SIZE = 3
+        config.CONCURRENT_CHAINS = 0
+        config.LOGGING = {}
+        generation = mock.Mock(value=0)
+        redirect_checker.reload_requested = True
+        with mock.patch('source.redirect_checker.reload_config', mock.Mock(return_value={'LOGGING': {}})) as reload_config:
+            with mock.patch('source.redirect_checker.apply_log_levels', mock.Mock()) as apply_log_levels:
+                with mock.patch('source.redirect_checker.spawn_workers', mock.Mock()) as spawn_workers:
+                    redirect_checker.reload_workers(config, generation, 23)
+        self.assertFalse(redirect_checker.reload_requested)
+        self.assertEqual(redirect_checker.RELOADABLE_KEYS, reload_config.call_args[0][2])
+        self.assertTrue(apply_log_levels.called)
+        self.assertEqual(1, generation.value)
+        spawn_workers.assert_called_once_with(
+            num=3, target=redirect_checker.worker, args=(config,), parent_pid=23, generation=generation
+        )
+
+    def test_get_worker_target(self):
+        config = Config()
+        config.CONCURRENT_CHAINS = 0
+        self.assertIs(redirect_checker.worker, redirect_checker.get_worker_target(config))
+        config.CONCURRENT_CHAINS = 100
+        self.assertIs(redirect_checker.multi_worker, redirect_checker.get_worker_target(config))
+
+    def test_reload_workers_keeps_workers_on_error(self):
+        generation = mock.Mock(value=0)
+        with mock.patch('source.redirect_checker.reload_config', mock.Mock(side_effect=SyntaxError)):
+            with mock.patch('source.redirect_checker.spawn_workers', mock.Mock()) as spawn_workers:
+                with mock.patch('source.redirect_checker.logger', mock.Mock()):
+                    redirect_checker.reload_workers(Config(), generation, 23)
+        self.assertEqual(0, generation.value)
+        self.assertFalse(spawn_workers.called)
+
+    def test_main_loop_reloads_on_request(self):
+        config = Config()
+        config.SLEEP = 8
+        config.CHECK_URL = 'test_url'
+        config.HTTP_TIMEOUT = 1
+        config.WORKER_POOL_SIZE = 0
+
+        def break_run(*args, **kwargs):
+            redirect_checker.run_checker = False
+
+        redirect_checker.reload_requested = True
+        with mock.patch('source.redirect_checker.check_network_status', mock.Mock(return_value=True)):
+            with mock.patch('source.redirect_checker.reload_workers', mock.Mock()) as reload_workers:
+                with mock.patch('source.redirect_checker.active_children', mock.Mock(return_value=[])):
+                    with mock.patch('source.redirect_checker.sleep', mock.Mock(side_effect=break_run)):
+                        redirect_checker.main_loop(config)
+        reload_workers.assert_called_once_with(config, mock.ANY, mock.ANY)
+        redirect_checker.run_checker = True
+        redirect_checker.reload_requested = False
+
+    def test_install_signal_handlers(self):
+        with mock.patch('source.redirect_checker.signal.signal', mock.Mock()) as set_handler:
+            with mock.patch('source.redirect_checker.signal.siginterrupt', mock.Mock()) as siginterrupt:
+                redirect_checker.install_signal_handlers()
+        set_handler.assert_called_once_with(redirect_checker.signal.SIGHUP, redirect_checker.reload_handler)
+        siginterrupt.assert_called_once_with(redirect_checker.signal.SIGHUP, False)
+        redirect_checker.reload_handler(redirect_checker.signal.SIGHUP, None)
+        self.assertTrue(redirect_checker.reload_requested)
+        redirect_checker.reload_requested = False
+
     def test_main_args_daemon_exist(self):
         mock_argv = mock.MagicMock()
         mock_parse_cmd_args = mock.Mock()